@@ -1,15 +1,17 @@
-from agents.gaurd_agent import GaurdAgent
-from agents.classification_agent import ClassificationAgent
-from agents.details_agent import DetailsAgent
 from agents.agent_protocol import AgentProtocol, AgentResponse, AgentMemory
-from agents.recommendation_agent import RecommendationAgent
-from agents.order_taking_agent import OrderTakingAgent
-from langchain_groq import ChatGroq
+from agents.memory_store import get_memory_store
+from agents.prompt_budget import PromptAssembler, enable_rolling_summary
+from agents.llm_factory import get_chat_model
+from agents.embeddings import get_embedding_service
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
 from langchain.schema import AIMessage, HumanMessage
 import os
+import time
+import asyncio
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional
 import pathlib
 from dotenv import load_dotenv
@@ -25,14 +27,18 @@ load_dotenv()
 folder_path = pathlib.Path(__file__).parent.resolve()
 
 class AgentController:
+    # Agents the classification decision can route to
+    routable_agents = ("details_agent", "recommendation_agent", "order_taking_agent")
+
     def __init__(self):
         try:
+            # Import and construction times, reported by log_startup_timings
+            self.startup_timings: Dict[str, float] = {}
+            self._agents: Dict[str, Any] = {}
+            self._agents_lock = threading.RLock()
+
             # Initialize LangChain components with Groq
-            self.chat_model = ChatGroq(
-                model_name=os.getenv("GROQ_MODEL_NAME"),
-                temperature=0.7,
-                groq_api_key=os.getenv("GROQ_API_KEY")
-            )
+            self.chat_model = get_chat_model("agent_controller", temperature=0.7)
             
             # Create system prompt template
             self.system_prompt = ChatPromptTemplate.from_messages([
@@ -49,35 +55,31 @@ class AgentController:
                 ("human", "{input}")
             ])
             
-            # Initialize memory
-            self.memory = ConversationBufferMemory(
-                memory_key="chat_history",
-                return_messages=True,
-                output_key="output"
-            )
+            # Chat history is kept per session in the shared memory store
+            self.memory_store = get_memory_store()
+            self.prompt_assembler = PromptAssembler("agent_controller", self.system_prompt)
+            # Fold the turns evicted from the histories into rolling summaries
+            if os.getenv("ROLLING_SUMMARY", "false").lower() == "true":
+                enable_rolling_summary(self.memory_store)
             
             # Create main chain
             self.chain = LLMChain(
                 llm=self.chat_model,
                 prompt=self.system_prompt,
-                memory=self.memory,
                 verbose=True
             )
 
-            # Initialize agents
-            self.gaurd_agent = GaurdAgent()
-            self.classification_agent = ClassificationAgent()
+            # Guard and classification only read the incoming messages, so they can run side by side
+            self.concurrent_pipeline = os.getenv("CONCURRENT_PIPELINE", "true").lower() == "true"
+            self.pre_routing_executor = ThreadPoolExecutor(
+                max_workers=2,
+                thread_name_prefix="pre_routing"
+            ) if self.concurrent_pipeline else None
 
-            self.recommendation_agent = RecommendationAgent(
-                f"{folder_path}/recommendation_objects/apriori_recommendations.json",
-                f"{folder_path}/recommendation_objects/popularity_recommendation.csv"
-            )
-
-            self.agent_dict: Dict[str, AgentProtocol] = {
-                "details_agent": DetailsAgent(),
-                "recommendation_agent": self.recommendation_agent,
-                "order_taking_agent": OrderTakingAgent(recommendation_agent=self.recommendation_agent)
-            }
+            # In lazy mode agents are imported and built on first use instead of here
+            self.lazy_agents = os.getenv("LAZY_AGENTS", "false").lower() == "true"
+            if not self.lazy_agents:
+                self.prewarm()
             
             logger.info("AgentController initialized successfully")
             
@@ -85,12 +87,126 @@ class AgentController:
             logger.error(f"Error initializing AgentController: {str(e)}")
             raise
 
+    @property
+    def gaurd_agent(self):
+        return self._get_agent("gaurd_agent")
+
+    @property
+    def classification_agent(self):
+        return self._get_agent("classification_agent")
+
+    @property
+    def guard_router_agent(self):
+        return self._get_agent("guard_router_agent")
+
+    @property
+    def details_agent(self):
+        return self._get_agent("details_agent")
+
+    @property
+    def recommendation_agent(self):
+        return self._get_agent("recommendation_agent")
+
+    def prewarm(self):
+        """Build every agent and load the embedding model ahead of the first request"""
+        for name in ("gaurd_agent", "classification_agent", "guard_router_agent") + self.routable_agents:
+            self._get_agent(name)
+
+        start = time.perf_counter()
+        get_embedding_service(os.getenv("HF_EMBEDDING_MODEL"), 'cpu').load()
+        self.startup_timings["model:embeddings"] = time.perf_counter() - start
+
+    def log_startup_timings(self):
+        """Log the time spent importing and building each agent, slowest first"""
+        for name, seconds in sorted(self.startup_timings.items(), key=lambda item: -item[1]):
+            logger.info(f"Startup {name}: {seconds:.2f}s")
+        logger.info(f"Startup total: {sum(self.startup_timings.values()):.2f}s")
+
+    def _get_agent(self, name: str):
+        """Return an agent, importing and building it on first use"""
+        if name not in self._agents:
+            with self._agents_lock:
+                if name not in self._agents:
+                    start = time.perf_counter()
+                    import_seconds = self._import_seconds()
+                    self._agents[name] = getattr(self, f"_build_{name}")()
+                    # Construction time only, the imports it triggered are reported separately
+                    self.startup_timings[f"agent:{name}"] = (
+                        time.perf_counter() - start - (self._import_seconds() - import_seconds)
+                    )
+        return self._agents[name]
+
+    def _import_seconds(self) -> float:
+        return sum(seconds for name, seconds in self.startup_timings.items() if name.startswith("import:"))
+
+    def _import(self, module_name: str):
+        """Import an agent module, recording how long the first import took"""
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self.startup_timings.setdefault(f"import:{module_name}", time.perf_counter() - start)
+        return module
+
+    def _build_gaurd_agent(self):
+        gaurd_agent = self._import("agents.gaurd_agent").GuardAgent()
+
+        # Allow or reject clear-cut messages without calling the LLM guard
+        if os.getenv("GUARD_PREFILTER", "false").lower() == "true":
+            gaurd_agent = self._import("agents.guard_prefilter").GuardPrefilter(
+                gaurd_agent,
+                get_embedding_service(os.getenv("HF_EMBEDDING_MODEL"), 'cpu')
+            )
+        return gaurd_agent
+
+    def _build_classification_agent(self):
+        classification_agent = self._import("agents.classification_agent").ClassificationAgent()
+
+        # Route obvious queries locally with the shared embedding model
+        if os.getenv("LOCAL_INTENT_ROUTER", "false").lower() == "true":
+            classification_agent = self._import("agents.intent_router").IntentRouter(
+                classification_agent,
+                get_embedding_service(os.getenv("HF_EMBEDDING_MODEL"), 'cpu')
+            )
+        return classification_agent
+
+    def _build_guard_router_agent(self):
+        # One LLM call for both guard and routing, the separate agents stay as the fallback
+        if os.getenv("FUSED_GUARD_ROUTING", "false").lower() != "true":
+            return None
+        return self._import("agents.guard_router_agent").GuardRouterAgent()
+
+    def _build_details_agent(self):
+        details_agent = self._import("agents.details_agent").DetailsAgent()
+
+        # Fill the details agent's answer cache with FAQ answers in the background
+        faq_path = os.getenv("DETAILS_CACHE_FAQ_PATH")
+        if faq_path:
+            with open(faq_path, 'r') as file:
+                faqs = [line.strip() for line in file if line.strip()]
+            threading.Thread(target=details_agent.prewarm_answer_cache, args=(faqs,), daemon=True).start()
+        return details_agent
+
+    def _build_recommendation_agent(self):
+        return self._import("agents.recommendation_agent").RecommendationAgent(
+            f"{folder_path}/recommendation_objects/apriori_recommendations.json",
+            f"{folder_path}/recommendation_objects/popularity_recommendation.csv",
+            partitions_path=os.getenv("RECOMMENDATION_PARTITIONS_PATH"),
+            personalization_path=os.getenv("CUSTOMER_RECOMMENDATIONS_PATH"),
+            artifact_path=os.getenv("RECOMMENDATION_ARTIFACT_PATH")
+        )
+
+    def _build_order_taking_agent(self):
+        return self._import("agents.order_taking_agent").OrderTakingAgent(
+            recommendation_agent=self.recommendation_agent
+        )
+
     def get_response(self, input: Dict[str, Any]) -> Dict[str, Any]:
         """
         Process user input and get response from appropriate agent.
         
         Args:
-            input: Dictionary containing user input with 'input' key containing 'messages'
+            input: Dictionary containing user input with 'input' key containing 'messages',
+                   the 'session_id' of the conversation, the same on every turn, and an optional
+                   'context' such as {"outlet_id": 3, "time": "2019-04-01T08:30:00", "customer_id": 12}
         
         Returns:
             Dictionary containing response message, memory state, and agent info
@@ -99,37 +215,85 @@ class AgentController:
             # Extract User Input
             job_input = input["input"]
             messages = job_input["messages"]
+            session_id = self._get_session_id(input)
             
             logger.info(f"Processing message: {messages[-1]['content'][:50]}...")
 
-            # Get GuardAgent's response
-            gaurd_agent_response = self.gaurd_agent.get_response(messages)
-            if gaurd_agent_response["memory"]["guard_decision"] == "not allowed":
+            # Get GuardAgent's and ClassificationAgent's responses
+            gaurd_agent_response, classification_agent_response = self._get_pre_routing_responses(messages, session_id)
+            if classification_agent_response is None:
                 logger.info("Guard agent rejected the query")
                 return self._format_response(gaurd_agent_response)
             
-            # Get ClassificationAgent's response
-            classification_agent_response = self.classification_agent.get_response(messages)
             chosen_agent = classification_agent_response["memory"]["classification_decision"]
             
             logger.info(f"Chosen agent: {chosen_agent}")
 
             # Get the chosen agent's response
-            if chosen_agent in self.agent_dict:
-                agent = self.agent_dict[chosen_agent]
-                response = agent.get_response(messages)
+            if chosen_agent in self.routable_agents:
+                agent: AgentProtocol = self._get_agent(chosen_agent)
+                response = agent.get_response(messages, session_id=session_id, context=job_input.get("context"))
                 
                 # Enhance response using LangChain
                 enhanced_response = self.chain.predict(
                     input=response["content"],
-                    chat_history=messages
+                    chat_history=self.prompt_assembler.history(session_id, response["content"])
                 )
                 
                 # Update memory
-                self.memory.chat_memory.add_message(
-                    AIMessage(content=enhanced_response)
+                self.memory_store.add_turn(session_id, "agent_controller", response["content"], enhanced_response)
+                
+                return self._format_response({
+                    "content": enhanced_response,
+                    "memory": response.get("memory", {}),
+                    "agent": chosen_agent
+                })
+            else:
+                logger.error(f"Invalid agent decision: {chosen_agent}")
+                return self._format_error_response("Invalid agent decision")
+                
+        except Exception as e:
+            logger.error(f"Error processing response: {str(e)}")
+            return self._format_error_response(str(e))
+
+    async def aget_response(self, input: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Async counterpart of get_response, used as the runpod async handler.
+        
+        Args:
+            input: Dictionary containing user input with 'input' key containing 'messages'
+                   and the 'session_id' of the conversation
+        
+        Returns:
+            Dictionary containing response message, memory state, and agent info
+        """
+        try:
+            job_input = input["input"]
+            messages = job_input["messages"]
+            session_id = self._get_session_id(input)
+            
+            logger.info(f"Processing message: {messages[-1]['content'][:50]}...")
+
+            gaurd_agent_response, classification_agent_response = await self._aget_pre_routing_responses(messages, session_id)
+            if classification_agent_response is None:
+                logger.info("Guard agent rejected the query")
+                return self._format_response(gaurd_agent_response)
+            
+            chosen_agent = classification_agent_response["memory"]["classification_decision"]
+            
+            logger.info(f"Chosen agent: {chosen_agent}")
+
+            if chosen_agent in self.routable_agents:
+                agent: AgentProtocol = self._get_agent(chosen_agent)
+                response = await agent.aget_response(messages, session_id=session_id, context=job_input.get("context"))
+                
+                enhanced_response = await self.chain.apredict(
+                    input=response["content"],
+                    chat_history=self.prompt_assembler.history(session_id, response["content"])
                 )
                 
+                self.memory_store.add_turn(session_id, "agent_controller", response["content"], enhanced_response)
+                
                 return self._format_response({
                     "content": enhanced_response,
                     "memory": response.get("memory", {}),
@@ -143,6 +307,160 @@ class AgentController:
             logger.error(f"Error processing response: {str(e)}")
             return self._format_error_response(str(e))
 
+    async def astream_response(self, input: Dict[str, Any]):
+        """
+        Stream the response for the runpod generator handler.
+        
+        Routing is done up front, then the chosen agent's tokens are streamed as they
+        arrive. The enhancement chain is skipped because it would need the full agent
+        response before emitting its first token.
+        
+        Args:
+            input: Dictionary containing user input with 'input' key containing 'messages'
+                   and the 'session_id' of the conversation
+        
+        Yields:
+            {"message": str} chunks, followed by a closing {"memory": ..., "agent": ...} chunk
+        """
+        try:
+            job_input = input["input"]
+            messages = job_input["messages"]
+            session_id = self._get_session_id(input)
+            
+            logger.info(f"Streaming message: {messages[-1]['content'][:50]}...")
+
+            gaurd_agent_response, classification_agent_response = await self._aget_pre_routing_responses(messages, session_id)
+            if classification_agent_response is None:
+                logger.info("Guard agent rejected the query")
+                yield {"message": gaurd_agent_response["content"]}
+                yield {"memory": gaurd_agent_response.get("memory", {}), "agent": "unknown"}
+                return
+            
+            chosen_agent = classification_agent_response["memory"]["classification_decision"]
+            
+            logger.info(f"Chosen agent: {chosen_agent}")
+
+            if chosen_agent not in self.routable_agents:
+                logger.error(f"Invalid agent decision: {chosen_agent}")
+                yield self._format_error_response("Invalid agent decision")
+                return
+
+            response = {}
+            async for chunk in self._get_agent(chosen_agent).astream_response(
+                messages, session_id=session_id, context=job_input.get("context")
+            ):
+                if "delta" in chunk:
+                    yield {"message": chunk["delta"]}
+                else:
+                    response = chunk
+
+            yield {"memory": response.get("memory", {}), "agent": chosen_agent}
+                
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            yield self._format_error_response(str(e))
+
+    def _get_pre_routing_responses(self, messages: List[Dict[str, Any]], session_id: Optional[str] = None):
+        """
+        Run the guard and classification agents on the conversation.
+        
+        In fused mode a single GuardRouterAgent call makes both decisions, falling back
+        to the separate agents if it fails. In concurrent pipeline mode both agents are
+        started at once and the classification result is only used when the guard
+        allows the query.
+        
+        Args:
+            messages: List of conversation messages
+            session_id: Conversation id used for the agents' memory
+        
+        Returns:
+            Tuple of (guard response, classification response). The classification
+            response is None when the guard rejected the query.
+        """
+        if self.guard_router_agent is not None:
+            try:
+                guard_router_response = self.guard_router_agent.get_response(messages, session_id=session_id)
+                return self._split_guard_router_response(guard_router_response)
+            except Exception as e:
+                logger.error(f"Fused guard routing failed, using separate agents: {str(e)}")
+
+        if not self.concurrent_pipeline:
+            gaurd_agent_response = self.gaurd_agent.get_response(messages, session_id=session_id)
+            if gaurd_agent_response["memory"]["guard_decision"] == "not allowed":
+                return gaurd_agent_response, None
+            return gaurd_agent_response, self.classification_agent.get_response(messages, session_id=session_id)
+
+        gaurd_future = self.pre_routing_executor.submit(self.gaurd_agent.get_response, messages, session_id)
+        classification_future = self.pre_routing_executor.submit(self.classification_agent.get_response, messages, session_id)
+
+        gaurd_agent_response = gaurd_future.result()
+        if gaurd_agent_response["memory"]["guard_decision"] == "not allowed":
+            # Drop the routing branch: cancel it if it has not started, otherwise ignore its result
+            if not classification_future.cancel():
+                classification_future.add_done_callback(self._discard_future)
+            return gaurd_agent_response, None
+
+        return gaurd_agent_response, classification_future.result()
+
+    async def _aget_pre_routing_responses(self, messages: List[Dict[str, Any]], session_id: Optional[str] = None):
+        """Async counterpart of _get_pre_routing_responses"""
+        if self.guard_router_agent is not None:
+            try:
+                guard_router_response = await self.guard_router_agent.aget_response(messages, session_id=session_id)
+                return self._split_guard_router_response(guard_router_response)
+            except Exception as e:
+                logger.error(f"Fused guard routing failed, using separate agents: {str(e)}")
+
+        if not self.concurrent_pipeline:
+            gaurd_agent_response = await self.gaurd_agent.aget_response(messages, session_id=session_id)
+            if gaurd_agent_response["memory"]["guard_decision"] == "not allowed":
+                return gaurd_agent_response, None
+            return gaurd_agent_response, await self.classification_agent.aget_response(messages, session_id=session_id)
+
+        classification_task = asyncio.create_task(
+            self.classification_agent.aget_response(messages, session_id=session_id)
+        )
+        try:
+            gaurd_agent_response = await self.gaurd_agent.aget_response(messages, session_id=session_id)
+        except BaseException:
+            classification_task.cancel()
+            raise
+
+        if gaurd_agent_response["memory"]["guard_decision"] == "not allowed":
+            classification_task.cancel()
+            return gaurd_agent_response, None
+
+        return gaurd_agent_response, await classification_task
+
+    @staticmethod
+    def _split_guard_router_response(guard_router_response: Dict[str, Any]):
+        """The fused response stands in for both the guard and the classification response"""
+        if guard_router_response["memory"]["guard_decision"] == "not allowed":
+            return guard_router_response, None
+        return guard_router_response, guard_router_response
+
+    @staticmethod
+    def _get_session_id(input: Dict[str, Any]) -> str:
+        """
+        Conversation id from the job input.
+
+        Clients send the same session_id on every turn of a conversation. It is required:
+        the runpod job id changes with every request, so it can't key the chat history.
+
+        Raises:
+            ValueError: If the job input has no session_id
+        """
+        session_id = input["input"].get("session_id")
+        if not session_id:
+            raise ValueError("session_id is required in the job input")
+        return str(session_id)
+
+    @staticmethod
+    def _discard_future(future):
+        """Swallow the outcome of a pre-routing branch that is no longer needed"""
+        if not future.cancelled() and future.exception() is not None:
+            logger.info(f"Discarded classification branch failed: {future.exception()}")
+
     def _format_response(self, response: Dict[str, Any]) -> Dict[str, Any]:
         """Format the response according to the AgentResponse schema"""
         return {
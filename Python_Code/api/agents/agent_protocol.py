@@ -1,4 +1,5 @@
-from typing import Protocol, List, Dict, Any, Optional
+from abc import abstractmethod
+from typing import Protocol, List, Dict, Any, Optional, AsyncIterator
 from pydantic import BaseModel, Field
 
 class AgentMemory(BaseModel):
@@ -15,16 +16,31 @@ class AgentResponse(BaseModel):
     content: str = Field(description="Content of the response")
     memory: AgentMemory = Field(description="Agent's memory state")
 
+class CompactOutput(BaseModel):
+    """
+    Base schema of the compact LLM outputs: short keys and codes, no reasoning fields.
+    Subclasses must implement expand(), pydantic models are abstract base classes so
+    a subclass without it can't be instantiated.
+    """
+    @abstractmethod
+    def expand(self) -> BaseModel:
+        """The output converted to the agent's full schema"""
+
 class AgentProtocol(Protocol):
     """Protocol defining the interface for all agents in the coffee shop chatbot"""
     
-    def get_response(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def get_response(self, messages: List[Dict[str, Any]], session_id: Optional[str] = None, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Get a response from the agent based on the conversation history.
         
         Args:
             messages: List of conversation messages, where each message is a dictionary
                      containing 'role' and 'content' keys.
+            session_id: Conversation id used to look up the agent's chat history.
+                        None uses the default session.
+            context: Optional request context from the job input, e.g.
+                     {"outlet_id": 3, "time": "2019-04-01T08:30:00", "customer_id": 12},
+                     used by the recommendations. Agents that don't need it ignore it.
         
         Returns:
             Dictionary containing:
@@ -37,4 +53,33 @@ class AgentProtocol(Protocol):
                 - guard_decision: Optional[str] - Guard agent's decision
                 - asked_recommendation_before: Optional[bool] - Whether recommendations were given
         """
-        ...
\ No newline at end of file
+        ...
+
+    async def aget_response(self, messages: List[Dict[str, Any]], session_id: Optional[str] = None, context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Async counterpart of get_response, used by the async request path.
+        
+        Args:
+            messages: List of conversation messages
+            session_id: Conversation id used to look up the agent's chat history
+            context: Optional request context from the job input
+        
+        Returns:
+            Dictionary with the same structure as get_response
+        """
+        ...
+
+    def astream_response(self, messages: List[Dict[str, Any]], session_id: Optional[str] = None, context: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream the response of the agent as it is generated.
+        
+        Args:
+            messages: List of conversation messages
+            session_id: Conversation id used to look up the agent's chat history
+            context: Optional request context from the job input
+        
+        Yields:
+            {"delta": str} chunks with the response tokens, followed by the full
+            response dictionary with the same structure as get_response
+        """
+        ...
@@ -0,0 +1,154 @@
+import heapq
+from operator import itemgetter
+from typing import Dict, List
+
+class AprioriIndex:
+    """
+    Association rules compiled for fast basket queries.
+
+    Product and category names are interned to integer ids and every antecedent's
+    rules are stored as (negated confidence, product id, category id) tuples sorted by
+    confidence. A basket query lazily merges the rule lists of every antecedent
+    contained in the basket with a heap, so it only reads as many rules as it needs
+    to fill top_k. Baskets with few candidate rules are sorted instead.
+
+    Antecedents with several items use the "_"-joined keys written by
+    recommendation_engine_training.ipynb, e.g. "Latte_Ginger Scone".
+
+    Indexes loaded from a binary artifact keep the rules in the memory-mapped file and
+    compile an antecedent's rule list the first time a basket matches it.
+    """
+    # Above this many candidate rules the heap merge beats sorting them all
+    merge_threshold = 48
+
+    def __init__(self, rules: Dict[str, List[dict]], per_category_limit=2):
+        self.per_category_limit = per_category_limit
+
+        self.product_names = []
+        self.product_ids = {}
+        self.category_names = []
+        self.category_ids = {}
+
+        # Single item -> rules, and item set -> rules for multi-item antecedents
+        self.single_item_rules = {}
+        self.multi_item_rules = {}
+        # Single item -> multi-item antecedents that contain it
+        self.multi_item_antecedents = {}
+
+        # Artifact-backed indexes store antecedent numbers in the rule dictionaries
+        self.artifact = None
+        self.compiled_rules = {}
+
+        for key, recommendations in rules.items():
+            recommendations = sorted(recommendations, key=lambda x: x['confidence'], reverse=True)
+            compiled = [
+                (
+                    -recommendation['confidence'],
+                    self._intern(recommendation['product'], self.product_ids, self.product_names),
+                    self._intern(recommendation['product_category'], self.category_ids, self.category_names)
+                )
+                for recommendation in recommendations
+            ]
+
+            self._add_antecedent(key.split("_"), compiled)
+
+    @classmethod
+    def from_artifact(cls, artifact, per_category_limit=2):
+        """
+        Index the rules of a RecommendationArtifact without copying them.
+
+        Product and category ids are the artifact's string ids.
+        """
+        index = cls({}, per_category_limit)
+        index.artifact = artifact
+        index.product_names = index.category_names = artifact.strings
+        for antecedent in range(len(artifact)):
+            index._add_antecedent(artifact.antecedent(antecedent), antecedent)
+        return index
+
+    def _add_antecedent(self, items, rules):
+        antecedent = frozenset(items)
+        if len(antecedent) == 1:
+            self.single_item_rules[items[0]] = rules
+        else:
+            self.multi_item_rules[antecedent] = rules
+            for item in antecedent:
+                self.multi_item_antecedents.setdefault(item, []).append(antecedent)
+
+    def _rule_list(self, rules):
+        """Compiled rules, compiling an artifact antecedent on first use"""
+        if not isinstance(rules, int):
+            return rules
+        compiled = self.compiled_rules.get(rules)
+        if compiled is None:
+            products, categories, confidences = self.artifact.rules(rules)
+            compiled = list(zip((-confidences).tolist(), products.tolist(), categories.tolist()))
+            self.compiled_rules[rules] = compiled
+        return compiled
+
+    @staticmethod
+    def _intern(name, ids, names):
+        if name not in ids:
+            ids[name] = len(names)
+            names.append(name)
+        return ids[name]
+
+    def matching_rules(self, products):
+        """Rule lists of the antecedents whose items are all in the basket, in basket order"""
+        rule_lists = []
+        basket = None
+        seen = set()
+        for product in products:
+            rules = self.single_item_rules.get(product)
+            if rules is not None and product not in seen:
+                seen.add(product)
+                rule_lists.append(self._rule_list(rules))
+
+            for antecedent in self.multi_item_antecedents.get(product, ()):
+                if basket is None:
+                    basket = set(products)
+                if antecedent not in seen and antecedent <= basket:
+                    seen.add(antecedent)
+                    rule_lists.append(self._rule_list(self.multi_item_rules[antecedent]))
+        return rule_lists
+
+    def recommend(self, products, top_k=5):
+        """
+        Recommend products for a basket.
+
+        Args:
+            products (list): Product names in the basket
+            top_k (int): Maximum number of recommendations
+
+        Returns:
+            list: Product names by confidence, at most per_category_limit per category
+        """
+        rule_lists = self.matching_rules(products)
+        if not rule_lists:
+            return []
+        if len(rule_lists) == 1:
+            rules = rule_lists[0]
+        elif sum(len(rule_list) for rule_list in rule_lists) <= self.merge_threshold:
+            # Short lists are cheaper to sort in C than to merge in Python
+            rules = sorted([rule for rule_list in rule_lists for rule in rule_list], key=itemgetter(0))
+        else:
+            rules = heapq.merge(*rule_lists, key=itemgetter(0))
+        # Both keep the basket order between rules with the same confidence
+
+        recommendations = []
+        recommended_ids = set()
+        per_category = {}
+        for _, product_id, category_id in rules:
+            if product_id in recommended_ids:
+                continue
+            category_count = per_category.get(category_id, 0)
+            if category_count >= self.per_category_limit:
+                continue
+
+            recommended_ids.add(product_id)
+            per_category[category_id] = category_count + 1
+            recommendations.append(self.product_names[product_id])
+            if len(recommendations) >= top_k:
+                break
+
+        return recommendations
@@ -0,0 +1,238 @@
+import re
+import json
+import logging
+import pathlib
+import threading
+from decimal import Decimal
+from functools import lru_cache
+from typing import Dict, List, Optional
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+PRODUCTS_PATH = folder_path.parent.parent / "products" / "products.jsonl"
+POPULARITY_PATH = folder_path.parent / "recommendation_objects" / "popularity_recommendation.csv"
+
+# Size suffixes of the sales data ("Dark chocolate Lg"), stripped as in training
+SIZE_WORDS = {"rg", "lg", "sm", "regular", "large", "small", "medium"}
+
+# Spellings the fuzzy match can't be trusted with, mapped to the menu's
+WORD_ALIASES = {
+    "caramel": "carmel",
+    "expresso": "espresso",
+    "chocolat": "chocolate",
+    "savoury": "savory",
+}
+
+# Phrases customers use for a menu item, by menu name. A plain "dark chocolate" is
+# the drink, the packaged one has to be asked for.
+PHRASE_ALIASES = {
+    "Dark chocolate (Drinking Chocolate)": ["dark chocolate", "hot chocolate", "drinking chocolate", "dark hot chocolate"],
+    "Dark chocolate (Packaged Chocolate)": ["packaged chocolate", "packaged dark chocolate", "dark chocolate bar", "chocolate bar"],
+    "Espresso shot": ["espresso"],
+    "Jumbo Savory Scone": ["savory scone"],
+    "Sugar Free Vanilla syrup": ["vanilla syrup", "sugar free vanilla"],
+}
+
+class CatalogItem(BaseModel):
+    """A product on the menu"""
+    id: int = Field(description="Position in products.jsonl")
+    name: str = Field(description="Name shown to the customer, unique on the menu")
+    product: str = Field(description="Product name in products.jsonl and the recommendation artifacts")
+    category: str = Field(description="Product category")
+    price: Decimal = Field(description="Unit price")
+
+def normalize(text):
+    """Lowercase words without punctuation, size suffixes, plural s or known misspellings"""
+    words = []
+    for word in re.findall(r"[a-z0-9]+", str(text).lower().replace("'", "")):
+        if word in SIZE_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(WORD_ALIASES.get(word, word))
+    return " ".join(words)
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class Catalog:
+    """
+    Menu of the coffee shop with name resolution for free text.
+
+    Every item is reachable through normalized keys: its name, its name with the
+    category, the phrase aliases and the product image name. Mentions are resolved
+    with a dictionary lookup of the normalized text first, then with a trigram
+    index narrowing the keys down to a few candidates compared by edit distance.
+    Results are cached, so repeated mentions cost a dictionary lookup.
+    """
+    # Candidates compared by edit distance after the trigram filter
+    fuzzy_candidates = 5
+
+    def __init__(self, products_path=None, popularity_path=None):
+        products = []
+        with open(products_path or PRODUCTS_PATH, 'r') as file:
+            for line in file:
+                if line.strip():
+                    products.append(json.loads(line))
+
+        name_counts = {}
+        for product in products:
+            name_counts[product["name"]] = name_counts.get(product["name"], 0) + 1
+
+        self.items: List[CatalogItem] = []
+        self.by_name: Dict[str, CatalogItem] = {}
+        self.keys: Dict[str, int] = {}
+        for product in products:
+            name = product["name"]
+            if name_counts[name] > 1:
+                name = f"{name} ({product['category']})"
+            item = CatalogItem(
+                id=len(self.items), name=name, product=product["name"], category=product["category"],
+                price=Decimal(str(product["price"]))
+            )
+            self.items.append(item)
+            self.by_name[name] = item
+
+            self._add_key(name, item)
+            self._add_key(f"{product['name']} {product['category']}", item)
+            if name_counts[product["name"]] == 1:
+                self._add_key(product["name"], item)
+            if product.get("image_path"):
+                self._add_key(pathlib.Path(product["image_path"]).stem, item)
+
+        for name, phrases in PHRASE_ALIASES.items():
+            if name in self.by_name:
+                for phrase in phrases:
+                    self.keys[normalize(phrase)] = self.by_name[name].id
+
+        self.trigram_index: Dict[str, List[str]] = {}
+        for key in self.keys:
+            for trigram in trigrams(key):
+                self.trigram_index.setdefault(trigram, []).append(key)
+
+        self.key_words = {key: set(key.split()) for key in self.keys}
+        self.max_words = max(len(words) for words in self.key_words.values())
+
+        # (product, product_category) of the recommendation artifacts -> menu item
+        self.artifact_items = {}
+        if popularity_path is not False:
+            self.load_artifact_names(popularity_path or POPULARITY_PATH)
+
+        self.resolve = lru_cache(maxsize=4096)(self._resolve)
+
+    def _add_key(self, text, item):
+        # First come first served, a key never moves to another item
+        self.keys.setdefault(normalize(text), item.id)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def load_artifact_names(self, popularity_path):
+        """Map the products of the recommendation artifacts to menu items"""
+        from .popularity_index import PopularityIndex
+        if not pathlib.Path(popularity_path).exists():
+            return
+        for product, category, _ in PopularityIndex.from_csv(popularity_path).rows:
+            item = self.resolve_key(normalize(f"{product} {category}")) or self.resolve_key(normalize(product))
+            if item is None:
+                logger.warning(f"Recommended product {product} ({category}) is not on the menu")
+                continue
+            self.artifact_items[(product, category)] = item
+
+    def resolve_key(self, key):
+        item_id = self.keys.get(key)
+        return self.items[item_id] if item_id is not None else None
+
+    def _resolve(self, text) -> Optional[CatalogItem]:
+        """
+        Menu item a mention refers to.
+
+        Args:
+            text (str): Product name as written by a customer, an LLM or the sales data
+
+        Returns:
+            CatalogItem: The item, or None if nothing on the menu is close enough
+        """
+        key = normalize(text)
+        item = self.resolve_key(key)
+        if item is not None or len(key) < 4:
+            return item
+
+        # Keys sharing the most trigrams with the mention, closest by edit distance
+        shared = {}
+        for trigram in trigrams(key):
+            for candidate in self.trigram_index.get(trigram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        candidates = sorted(shared, key=shared.get, reverse=True)[:self.fuzzy_candidates]
+
+        limit = 1 if len(key) < 8 else 2 if len(key) < 13 else 3
+        best, best_distance = None, limit + 1
+        for candidate in candidates:
+            distance = edit_distance(key, candidate, limit)
+            if distance < best_distance:
+                best, best_distance = candidate, distance
+        return self.resolve_key(best) if best is not None else None
+
+    def candidates(self, text) -> List[CatalogItem]:
+        """Items whose name contains every word of a partial mention, e.g. "scone" """
+        words = set(normalize(text).split())
+        if not words:
+            return []
+        ids = {item_id for key, item_id in self.keys.items() if words <= self.key_words[key]}
+        return [self.items[item_id] for item_id in sorted(ids)]
+
+    def find_mentions(self, text) -> List[CatalogItem]:
+        """
+        Menu items named anywhere in a message, longest names first.
+
+        Exact and alias matches are found on every word span, misspellings only on
+        spans of two or more words or single words of five letters or more.
+        """
+        words = normalize(text).split()
+        found = []
+        used = [False] * len(words)
+        for size in range(min(self.max_words, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                if any(used[start:start + size]):
+                    continue
+                span = " ".join(words[start:start + size])
+                item = self.resolve_key(span)
+                if item is None and (size > 1 or len(span) >= 5):
+                    item = self.resolve(span)
+                if item is not None:
+                    used[start:start + size] = [True] * size
+                    if item not in found:
+                        found.append(item)
+        return found
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog() -> Catalog:
+    """Get the catalog shared by every agent in the process"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = Catalog()
+        return _catalog
@@ -1,13 +1,12 @@
 from dotenv import load_dotenv
-import os
-import json
 from copy import deepcopy
-from .utils import get_chatbot_response, double_check_json_output
-from langchain_groq import ChatGroq
+from .utils import get_chatbot_response, parse_structured_output, aparse_structured_output
+from .memory_store import get_memory_store
+from .prompt_budget import PromptAssembler
+from .llm_factory import get_structured_output_model, compact_output_enabled
+from .agent_protocol import CompactOutput
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
 from typing import Literal
 load_dotenv()
@@ -20,13 +19,24 @@ class AgentDecision(BaseModel):
     )
     message: str = Field(description="Response message to the user", default="")
 
+AGENT_CODES = {"d": "details_agent", "o": "order_taking_agent", "r": "recommendation_agent"}
+
+class CompactAgentDecision(CompactOutput):
+    """Compact AgentDecision: {"a": "d"}, {"a": "o"} or {"a": "r"}"""
+    a: Literal["d", "o", "r"] = Field(description="d: details_agent, o: order_taking_agent, r: recommendation_agent")
+
+    def expand(self):
+        return AgentDecision(chain_of_thought="", decision=AGENT_CODES[self.a])
+
+COMPACT_OUTPUT_FORMAT = """Respond with JSON only: {"a": "d"} for details_agent, {"a": "o"} for order_taking_agent, {"a": "r"} for recommendation_agent."""
+
 class ClassificationAgent:
-    def __init__(self):
-        self.client = ChatGroq(
-            model_name=os.getenv("GROQ_MODEL_NAME"),
-            temperature=0.7,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+    def __init__(self, compact=None):
+        # Compact outputs skip the reasoning, see COMPACT_OUTPUT in llm_factory
+        self.compact = compact_output_enabled("classification_agent") if compact is None else compact
+        self.output_schema = CompactAgentDecision if self.compact else AgentDecision
+
+        self.client = get_structured_output_model("classification_agent", temperature=0.7, compact=self.compact)
         
         # Create the system prompt template
         self.system_prompt = ChatPromptTemplate.from_messages([
@@ -49,51 +59,62 @@ class ClassificationAgent:
                - Personalized suggestions
                - Menu exploration
             
-            Analyze the user's input and determine the most appropriate agent to handle their request."""),
+            Analyze the user's input and determine the most appropriate agent to handle their request.
+            {output_format}"""),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}")
-        ])
+        ]).partial(output_format=COMPACT_OUTPUT_FORMAT if self.compact else "")
         
-        # Initialize memory
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+        # Chat history is kept per session in the shared memory store
+        self.memory_store = get_memory_store()
+        self.prompt_assembler = PromptAssembler("classification_agent", self.system_prompt)
         
         # Create the chain
         self.chain = LLMChain(
             llm=self.client,
             prompt=self.system_prompt,
-            memory=self.memory,
             verbose=True
         )
-        
-        # Initialize output parser
-        self.output_parser = PydanticOutputParser(pydantic_object=AgentDecision)
     
-    def get_response(self, messages):
-        messages = deepcopy(messages)
+    def get_response(self, messages, session_id=None):
+        input_text = self.build_input(messages)
         
-        # Get the last 3 messages for context
-        recent_messages = messages[-3:]
+        # Get response from the chain
+        chain_response = self.chain.predict(
+            input=input_text,
+            chat_history=self.prompt_assembler.history(session_id, input_text)
+        )
+        self.memory_store.add_turn(session_id, "classification_agent", input_text, chain_response)
         
-        # Convert messages to string format for the chain
-        input_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_messages])
+        # Parse the response into structured format, repairing malformed JSON locally
+        parsed_response = parse_structured_output("classification_agent", chain_response, self.output_schema)
+        output = self.postprocess(parsed_response)
         
-        # Get response from the chain
-        chain_response = self.chain.predict(input=input_text)
+        return output
+
+    async def aget_response(self, messages, session_id=None):
+        """Async counterpart of get_response"""
+        input_text = self.build_input(messages)
+        chain_response = await self.chain.apredict(
+            input=input_text,
+            chat_history=self.prompt_assembler.history(session_id, input_text)
+        )
+        self.memory_store.add_turn(session_id, "classification_agent", input_text, chain_response)
         
-        # Parse the response into structured format
-        try:
-            parsed_response = self.output_parser.parse(chain_response)
-            output = self.postprocess(parsed_response)
-        except Exception as e:
-            # Fallback to JSON parsing if Pydantic parsing fails
-            json_response = double_check_json_output(self.client, os.getenv("GROQ_MODEL_NAME"), chain_response)
-            output = self.postprocess(json.loads(json_response))
+        parsed_response = await aparse_structured_output("classification_agent", chain_response, self.output_schema)
+        output = self.postprocess(parsed_response)
         
         return output
 
+    def build_input(self, messages):
+        messages = deepcopy(messages)
+        
+        # Get the last 3 messages for context
+        recent_messages = messages[-3:]
+        
+        # Convert messages to string format for the chain
+        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_messages])
+
     def postprocess(self, output):
         if isinstance(output, AgentDecision):
             decision = output.decision
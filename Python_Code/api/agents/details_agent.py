@@ -1,35 +1,32 @@
 from dotenv import load_dotenv
 import os
-from .utils import get_embedding
-from langchain_groq import ChatGroq
+import asyncio
+import pathlib
+from .utils import astream_chain
+from .memory_store import get_memory_store
+from .prompt_budget import PromptAssembler
+from .llm_factory import get_chat_model
+from .semantic_cache import SemanticCache, corpus_fingerprint
+from .retrieval import get_retriever
+from .embeddings import get_embedding_service
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain_community.vectorstores import Pinecone
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from copy import deepcopy
-from pinecone import Pinecone as PineconeClient
 load_dotenv()
 
+folder_path = pathlib.Path(__file__).parent.resolve()
+
 class DetailsAgent:
     def __init__(self):
         # Initialize Groq client
-        self.client = ChatGroq(
-            model_name=os.getenv("GROQ_MODEL_NAME"),
-            temperature=0.7,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+        self.client = get_chat_model("details_agent", temperature=0.7)
         
-        # Initialize Pinecone client
-        self.pc = PineconeClient(api_key=os.getenv("PINECONE_API_KEY"))
+        # Initialize the retrieval backend (Pinecone or the local index)
+        self.retriever = get_retriever()
         self.index_name = os.getenv("PINECONE_INDEX_NAME")
         
-        # Initialize embedding model
-        self.embedding_model = HuggingFaceEmbeddings(
-            model_name=os.getenv("HF_EMBEDDING_MODEL"),
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # Shared embedding model, loaded on first use and batched across concurrent requests
+        self.embedding_model = get_embedding_service(os.getenv("HF_EMBEDDING_MODEL"), 'cpu')
         
         # Create the system prompt template
         self.system_prompt = ChatPromptTemplate.from_messages([
@@ -46,54 +43,186 @@ class DetailsAgent:
             ("human", "{input}")
         ])
         
-        # Initialize memory
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+        # Chat history is kept per session in the shared memory store
+        self.memory_store = get_memory_store()
+        self.prompt_assembler = PromptAssembler("details_agent", self.system_prompt)
+        
+        # Answers to repeated questions, keyed on the query embedding. Only first questions
+        # of a conversation use it, later ones are answered with the chat history.
+        self.answer_cache = SemanticCache() if os.getenv("DETAILS_ANSWER_CACHE", "false").lower() == "true" else None
+        products_folder = folder_path.parent.parent / "products"
+        self.corpus_paths = [
+            products_folder / "products.jsonl",
+            products_folder / "Merry's_way_about_us.txt",
+            products_folder / "menu_items_text.txt"
+        ]
         
         # Create the chain
         self.chain = LLMChain(
             llm=self.client,
             prompt=self.system_prompt,
-            memory=self.memory,
             verbose=True
         )
     
     def get_closest_results(self, index_name, input_embeddings, top_k=2):
         """
-        Retrieve the most relevant documents from Pinecone.
+        Retrieve the most relevant documents from the retrieval backend.
         
         Args:
-            index_name (str): Name of the Pinecone index
+            index_name (str): Name of the Pinecone index, the backend is configured with it
             input_embeddings (list): Query embeddings
             top_k (int): Number of results to return
             
         Returns:
             list: List of relevant documents with metadata
         """
-        index = self.pc.Index(index_name)
-        
-        results = index.query(
-            namespace="ns1",
-            vector=input_embeddings,
-            top_k=top_k,
-            include_values=False,
-            include_metadata=True
-        )
-        
-        return results
+        return self.retriever.query(input_embeddings, top_k=top_k)
 
-    def get_response(self, messages):
+    def get_response(self, messages, session_id=None, context=None):
         messages = deepcopy(messages)
         user_message = messages[-1]['content']
         
         # Get embeddings for the query
         embedding = self.embedding_model.embed_query(user_message)
         
+        # Answer repeated questions from the cache
+        cacheable = self.is_standalone(messages, session_id)
+        cached_answer = self.get_cached_answer(embedding) if cacheable else None
+        if cached_answer is not None:
+            self.memory_store.add_turn(session_id, "details_agent", user_message, cached_answer)
+            return self.postprocess(cached_answer)
+        
         # Get relevant documents
         results = self.get_closest_results(self.index_name, embedding)
         
+        # Get response from the chain
+        prompt = self.build_prompt(user_message, results)
+        response = self.chain.predict(
+            input=prompt,
+            chat_history=self.prompt_assembler.history(session_id, prompt)
+        )
+        self.memory_store.add_turn(session_id, "details_agent", user_message, response)
+        if cacheable:
+            self.cache_answer(embedding, response)
+        
+        return self.postprocess(response)
+
+    async def aget_response(self, messages, session_id=None, context=None):
+        """Async counterpart of get_response"""
+        messages = deepcopy(messages)
+        user_message = messages[-1]['content']
+        
+        # Embedding and Pinecone calls are blocking, keep them off the event loop
+        embedding = await asyncio.to_thread(self.embedding_model.embed_query, user_message)
+        
+        cacheable = self.is_standalone(messages, session_id)
+        cached_answer = self.get_cached_answer(embedding) if cacheable else None
+        if cached_answer is not None:
+            self.memory_store.add_turn(session_id, "details_agent", user_message, cached_answer)
+            return self.postprocess(cached_answer)
+        
+        results = await asyncio.to_thread(self.get_closest_results, self.index_name, embedding)
+        
+        prompt = self.build_prompt(user_message, results)
+        response = await self.chain.apredict(
+            input=prompt,
+            chat_history=self.prompt_assembler.history(session_id, prompt)
+        )
+        self.memory_store.add_turn(session_id, "details_agent", user_message, response)
+        if cacheable:
+            self.cache_answer(embedding, response)
+        
+        return self.postprocess(response)
+
+    async def astream_response(self, messages, session_id=None, context=None):
+        """Stream the answer tokens, then yield the full response"""
+        messages = deepcopy(messages)
+        user_message = messages[-1]['content']
+        
+        embedding = await asyncio.to_thread(self.embedding_model.embed_query, user_message)
+        
+        cacheable = self.is_standalone(messages, session_id)
+        cached_answer = self.get_cached_answer(embedding) if cacheable else None
+        if cached_answer is not None:
+            self.memory_store.add_turn(session_id, "details_agent", user_message, cached_answer)
+            yield {"delta": cached_answer}
+            yield self.postprocess(cached_answer)
+            return
+        
+        results = await asyncio.to_thread(self.get_closest_results, self.index_name, embedding)
+        
+        prompt = self.build_prompt(user_message, results)
+        response = ""
+        async for token in astream_chain(
+            self.chain,
+            input=prompt,
+            chat_history=self.prompt_assembler.history(session_id, prompt)
+        ):
+            response += token
+            yield {"delta": token}
+        self.memory_store.add_turn(session_id, "details_agent", user_message, response)
+        if cacheable:
+            self.cache_answer(embedding, response)
+        
+        yield self.postprocess(response)
+
+    def corpus_version(self):
+        """Version of the indexed documents, set DETAILS_CORPUS_VERSION when rebuilding the index elsewhere"""
+        return (
+            os.getenv("DETAILS_CORPUS_VERSION")
+            or getattr(self.retriever, "version", None)
+            or corpus_fingerprint(self.corpus_paths)
+        )
+
+    def is_standalone(self, messages, session_id=None):
+        """
+        Whether the question opens the conversation. Answers to follow-ups like
+        "how much is it?" depend on the history, so they are never cached.
+        """
+        return (
+            not any(message["role"] == "user" for message in messages[:-1])
+            and not self.memory_store.get_messages(session_id, "details_agent")
+            and not self.memory_store.get_summary(session_id, "details_agent")
+        )
+
+    def get_cached_answer(self, embedding):
+        if self.answer_cache is None:
+            return None
+        self.answer_cache.ensure_version(self.corpus_version())
+        return self.answer_cache.lookup(embedding)
+
+    def cache_answer(self, embedding, answer):
+        if self.answer_cache is not None:
+            self.answer_cache.add(embedding, answer)
+
+    def prewarm_answer_cache(self, questions):
+        """
+        Answer a list of frequently asked questions so their answers are cached.
+        
+        Args:
+            questions (list): FAQ texts
+        """
+        if self.answer_cache is None:
+            return
+        for question in questions:
+            embedding = self.embedding_model.embed_query(question)
+            if self.get_cached_answer(embedding) is not None:
+                continue
+            results = self.get_closest_results(self.index_name, embedding)
+            response = self.chain.predict(input=self.build_prompt(question, results), chat_history=[])
+            self.cache_answer(embedding, response)
+
+    def build_prompt(self, user_message, results):
+        """
+        Build the chain input from the user query and the retrieved documents.
+        
+        Args:
+            user_message (str): The user's query
+            results (dict): Retrieval results with 'matches'
+            
+        Returns:
+            str: Prompt text for the chain
+        """
         # Format the context from retrieved documents
         source_knowledge = "\n".join([
             f"Context {i+1}: {match['metadata']['text'].strip()}"
@@ -101,7 +230,7 @@ class DetailsAgent:
         ])
         
         # Create the prompt with context
-        prompt = f"""Using the following contexts, answer the user's query accurately and concisely.
+        return f"""Using the following contexts, answer the user's query accurately and concisely.
         If the contexts don't contain enough information, say so politely.
 
         Contexts:
@@ -109,11 +238,6 @@ class DetailsAgent:
 
         User Query: {user_message}
         """
-        
-        # Get response from the chain
-        response = self.chain.predict(input=prompt)
-        
-        return self.postprocess(response)
 
     def postprocess(self, output):
         """
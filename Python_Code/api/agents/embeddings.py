@@ -0,0 +1,153 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class EmbeddingService:
+    """
+    Shared sentence-transformer embeddings with lazy loading and micro-batching.
+
+    The model is loaded on first use. Concurrent embed_query calls are queued and a
+    worker thread encodes everything that arrives within batch_window_ms of the first
+    query as one batch. Exposes the same embed_query/embed_documents methods as
+    HuggingFaceEmbeddings, so it can be used wherever an embedding model is expected.
+    """
+    def __init__(self, model_name, device, batch_window_ms=None, max_batch_size=None):
+        self.model_name = model_name
+        self.device = device
+        self.batch_window = (batch_window_ms if batch_window_ms is not None else float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", "2"))) / 1000
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+
+        self._model = None
+        self._load_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self.load_seconds = None
+        self.batches = 0
+        self.batched_queries = 0
+        self.largest_batch = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    @property
+    def model(self):
+        if self._model is None:
+            self.load()
+        return self._model
+
+    def load(self):
+        """Load the model now instead of on first use"""
+        with self._load_lock:
+            if self._model is None:
+                from langchain_community.embeddings import HuggingFaceEmbeddings
+
+                start = time.perf_counter()
+                self._model = HuggingFaceEmbeddings(
+                    model_name=self.model_name,
+                    model_kwargs={'device': self.device},
+                    encode_kwargs={'normalize_embeddings': True}
+                )
+                self.load_seconds = time.perf_counter() - start
+                logger.info(f"Loaded embedding model {self.model_name} on {self.device} in {self.load_seconds:.2f}s")
+        return self._model
+
+    def embed_documents(self, texts):
+        return self.model.embed_documents(texts)
+
+    def embed_query(self, text):
+        """Embed a single query, batched with the other queries arriving at the same time"""
+        start = time.perf_counter()
+        future = Future()
+        self._queue.put((text, future))
+        self._ensure_worker()
+        embedding = future.result()
+
+        with self._stats_lock:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+        return embedding
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "model": self.model_name,
+                "device": self.device,
+                "load_seconds": self.load_seconds,
+                "batches": self.batches,
+                "avg_batch_size": self.batched_queries / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest_batch,
+                "queries": self.queries,
+                "avg_query_ms": 1000 * self.query_seconds / self.queries if self.queries else 0.0
+            }
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(target=self._run, name="embedding_batcher", daemon=True)
+                    self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.batch_window
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+
+            try:
+                embeddings = self.model.embed_documents([text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.batched_queries += len(batch)
+                self.largest_batch = max(self.largest_batch, len(batch))
+
+_services = {}
+_services_lock = threading.Lock()
+
+def get_embedding_service(model_name=None, device=None) -> EmbeddingService:
+    """
+    Get the process-wide embedding service for a model and device.
+
+    Args:
+        model_name: HuggingFace model name, defaults to HF_EMBEDDING_MODEL
+        device: 'cuda', 'mps' or 'cpu', defaults to the best available device
+
+    Returns:
+        EmbeddingService: One shared instance per (model_name, device)
+    """
+    model_name = model_name or os.getenv("HF_EMBEDDING_MODEL")
+    if device is None:
+        from .utils import get_available_device
+        device = get_available_device()
+
+    with _services_lock:
+        key = (model_name, device)
+        if key not in _services:
+            _services[key] = EmbeddingService(model_name, device)
+        return _services[key]
+
+def get_embedding_stats():
+    """Counters of every embedding service created in the process"""
+    with _services_lock:
+        services = list(_services.values())
+    return [service.stats() for service in services]
@@ -1,16 +1,15 @@
 from dotenv import load_dotenv
-import os
-import json
 import logging
 from copy import deepcopy
-from langchain_groq import ChatGroq
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from typing import Optional
-from .utils import double_check_json_output
+from typing import Literal, Optional
+from .utils import parse_structured_output, aparse_structured_output
+from .memory_store import get_memory_store
+from .prompt_budget import PromptAssembler
+from .llm_factory import get_structured_output_model, compact_output_enabled
+from .agent_protocol import CompactOutput
 load_dotenv()
 
 # Configure logging
@@ -23,14 +22,34 @@ class GuardDecision(BaseModel):
     decision: str = Field(description="Decision: 'allowed' or 'not allowed'")
     message: str = Field(description="Response message if not allowed, empty if allowed")
 
+REJECTION_MESSAGE = "Sorry, I can't help with that. Can I help you with your order?"
+
+class CompactGuardDecision(CompactOutput):
+    """Compact GuardDecision: {"d": "a"} for allowed, {"d": "n"} for not allowed"""
+    d: Literal["a", "n"] = Field(description="a: allowed, n: not allowed")
+
+    def expand(self):
+        if self.d == "a":
+            return GuardDecision(chain_of_thought="", decision="allowed", message="")
+        return GuardDecision(chain_of_thought="", decision="not allowed", message=REJECTION_MESSAGE)
+
+FULL_OUTPUT_FORMAT = f"""Your response should be in JSON format with these fields:
+            {{
+                "chain_of_thought": "your reasoning about the query",
+                "decision": "allowed" or "not allowed",
+                "message": "" if allowed, or "{REJECTION_MESSAGE}" if not allowed
+            }}"""
+
+COMPACT_OUTPUT_FORMAT = """Respond with JSON only: {"d": "a"} if allowed, {"d": "n"} if not allowed."""
+
 class GuardAgent:
-    def __init__(self):
+    def __init__(self, compact=None):
+        # Compact outputs skip the reasoning, see COMPACT_OUTPUT in llm_factory
+        self.compact = compact_output_enabled("guard_agent") if compact is None else compact
+        self.output_schema = CompactGuardDecision if self.compact else GuardDecision
+
         # Initialize Groq client
-        self.client = ChatGroq(
-            model_name=os.getenv("GROQ_MODEL_NAME"),
-            temperature=0.7,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+        self.client = get_structured_output_model("guard_agent", temperature=0.7, compact=self.compact)
         
         # Create the system prompt template
         self.system_prompt = ChatPromptTemplate.from_messages([
@@ -47,87 +66,80 @@ class GuardAgent:
             1. Ask questions about anything else other than our coffee shop.
             2. Ask questions about the staff or how to make a certain menu item.
 
-            Your response should be in JSON format with these fields:
-            {
-                "chain_of_thought": "your reasoning about the query",
-                "decision": "allowed" or "not allowed",
-                "message": "" if allowed, or "Sorry, I can't help with that. Can I help you with your order?" if not allowed
-            }"""),
+            {output_format}"""),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}")
-        ])
+        ]).partial(output_format=COMPACT_OUTPUT_FORMAT if self.compact else FULL_OUTPUT_FORMAT)
         
-        # Initialize memory
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+        # Chat history is kept per session in the shared memory store
+        self.memory_store = get_memory_store()
+        self.prompt_assembler = PromptAssembler("guard_agent", self.system_prompt)
         
         # Create the chain
         self.chain = LLMChain(
             llm=self.client,
             prompt=self.system_prompt,
-            memory=self.memory,
             verbose=True
         )
         
-        # Initialize output parser
-        self.output_parser = PydanticOutputParser(pydantic_object=GuardDecision)
-        
         logger.info("GuardAgent initialized successfully")
     
-    def get_response(self, messages):
+    def get_response(self, messages, session_id=None):
         """Get guard agent response"""
         messages = deepcopy(messages)
-        chain_response = None
         
         try:
             logger.info(f"Processing message: {messages[-1]['content']}")
             
             # Get response from the chain
-            chain_response = self.chain.predict(input=messages[-1]['content'])
+            chain_response = self.chain.predict(
+                input=messages[-1]['content'],
+                chat_history=self.prompt_assembler.history(session_id, messages[-1]['content'])
+            )
+            self.memory_store.add_turn(session_id, "guard_agent", messages[-1]['content'], chain_response)
             logger.info(f"Chain response: {chain_response}")
+            output = self.postprocess(parse_structured_output("guard_agent", chain_response, self.output_schema))
+            logger.info(f"Final output: {output}")
             
-            # Parse the response
-            parsed_response = self.output_parser.parse(chain_response)
-            logger.info(f"Parsed response: {parsed_response}")
+        except Exception as e:
+            logger.error(f"Error in get_response: {str(e)}")
+            output = self.rejection_output()
+        
+        return output
+
+    async def aget_response(self, messages, session_id=None):
+        """Async counterpart of get_response"""
+        messages = deepcopy(messages)
+        
+        try:
+            logger.info(f"Processing message: {messages[-1]['content']}")
             
-            output = self.postprocess(parsed_response)
+            chain_response = await self.chain.apredict(
+                input=messages[-1]['content'],
+                chat_history=self.prompt_assembler.history(session_id, messages[-1]['content'])
+            )
+            self.memory_store.add_turn(session_id, "guard_agent", messages[-1]['content'], chain_response)
+            logger.info(f"Chain response: {chain_response}")
+            output = self.postprocess(await aparse_structured_output("guard_agent", chain_response, self.output_schema))
             logger.info(f"Final output: {output}")
             
         except Exception as e:
-            logger.error(f"Error in get_response: {str(e)}")
-            # Fallback to JSON parsing if Pydantic parsing fails
-            if chain_response is not None:
-                try:
-                    json_response = double_check_json_output(
-                        self.client,
-                        os.getenv("GROQ_MODEL_NAME"),
-                        chain_response
-                    )
-                    output = self.postprocess(json.loads(json_response))
-                except Exception as json_error:
-                    logger.error(f"Error in JSON parsing: {str(json_error)}")
-                    output = {
-                        "role": "assistant",
-                        "content": "Sorry, I couldn't process that request. Can I help you with something else?",
-                        "memory": {
-                            "agent": "guard_agent",
-                            "guard_decision": "not allowed"
-                        }
-                    }
-            else:
-                output = {
-                    "role": "assistant",
-                    "content": "Sorry, I couldn't process that request. Can I help you with something else?",
-                    "memory": {
-                        "agent": "guard_agent",
-                        "guard_decision": "not allowed"
-                    }
-                }
+            logger.error(f"Error in aget_response: {str(e)}")
+            output = self.rejection_output()
         
         return output
 
+    def rejection_output(self):
+        """Response used when the query could not be processed"""
+        return {
+            "role": "assistant",
+            "content": "Sorry, I couldn't process that request. Can I help you with something else?",
+            "memory": {
+                "agent": "guard_agent",
+                "guard_decision": "not allowed"
+            }
+        }
+
     def postprocess(self, output):
         """Process the output and format the response"""
         try:
@@ -148,14 +160,7 @@ class GuardAgent:
             }
         except Exception as e:
             logger.error(f"Error in postprocess: {str(e)}")
-            return {
-                "role": "assistant",
-                "content": "Sorry, I couldn't process that request. Can I help you with something else?",
-                "memory": {
-                    "agent": "guard_agent",
-                    "guard_decision": "not allowed"
-                }
-            }
+            return self.rejection_output()
 
 
 
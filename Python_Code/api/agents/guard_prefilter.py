@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import pathlib
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from .intent_router import ROUTE_EXEMPLARS
+from .catalog import get_catalog, normalize
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+ORDER_PATTERN = re.compile(
+    r"\b(order|i'?d like|i would like|can i (get|have)|could i (get|have)|i'?ll (have|take)|i want|give me)\b"
+)
+
+# Requests the guard must refuse even when they mention menu items, always left to the LLM
+SENSITIVE_PATTERN = re.compile(
+    r"\b(how (do|to|can|would) (i|you|we)? ?(make|brew|bake|prepare)|recipe|staff|employee|barista|manager|salary)\b"
+)
+
+DOMAIN_KEYWORDS = {
+    "coffee", "menu", "drink", "drinks", "pastry", "pastries", "bakery", "price", "prices",
+    "open", "opening", "hours", "location", "located", "deliver", "delivery", "recommend",
+    "recommendation", "popular", "merry's", "shop", "cafe"
+}
+
+GENERIC_NAME_WORDS = {"shot", "free", "sugar", "chip", "jumbo", "savory", "dark", "drinking", "packaged"}
+
+OFF_TOPIC_EXEMPLARS = [
+    "What's the weather like today?",
+    "Who won the football game last night?",
+    "Write me a poem about the ocean",
+    "Help me with my math homework",
+    "What is the capital of France?",
+    "Tell me a joke",
+    "How do I fix my car?",
+    "What's the stock price of Apple?",
+    "Can you write Python code for me?",
+    "Who is the president of the United States?",
+    "Translate this sentence into Spanish",
+    "What's the meaning of life?",
+    "Write a poem about a cup of latte",
+    "What is the best vanilla ice cream brand to buy?",
+    "Which chocolate brand should I buy at the supermarket?",
+]
+
+class GuardPrefilter:
+    """
+    Local pre-classifier placed in front of the GuardAgent.
+
+    Short messages naming a menu item or placing an order are allowed immediately when
+    their embedding is also closer to the coffee shop requests than to the off-topic
+    ones by the margin, so "write me a poem about a latte" still goes to the LLM.
+    Messages very close to the domain are allowed, and messages far from it and close
+    to known off-topic requests without a menu mention are rejected. Anything
+    ambiguous, long messages, and any message touching recipes or staff are sent to
+    the LLM guard.
+    Responses have the same shape as the GuardAgent's.
+    """
+    def __init__(self, guard_agent, embedding_model, catalog=None,
+                 allow_threshold=None, reject_threshold=None, margin=None):
+        self.guard_agent = guard_agent
+        self.embedding_model = embedding_model
+        self.allow_threshold = allow_threshold if allow_threshold is not None else float(os.getenv("GUARD_PREFILTER_ALLOW_THRESHOLD", "0.6"))
+        self.reject_threshold = reject_threshold if reject_threshold is not None else float(os.getenv("GUARD_PREFILTER_REJECT_THRESHOLD", "0.2"))
+        self.margin = margin if margin is not None else float(os.getenv("GUARD_PREFILTER_MARGIN", "0.1"))
+        self.max_words = int(os.getenv("GUARD_PREFILTER_MAX_WORDS", "12"))
+
+        self.catalog = catalog or get_catalog()
+        self.menu_words = self.load_menu_words(self.catalog)
+
+        on_topic = [text for exemplars in ROUTE_EXEMPLARS.values() for text in exemplars]
+        self.on_topic_embeddings = self._embed_documents(on_topic)
+        self.off_topic_embeddings = self._embed_documents(OFF_TOPIC_EXEMPLARS)
+
+        self.lock = threading.Lock()
+        self.counters = {"allowed_locally": 0, "rejected_locally": 0, "sent_to_llm": 0}
+
+        logger.info("GuardPrefilter initialized successfully")
+
+    @staticmethod
+    def load_menu_words(catalog):
+        """Distinctive words of the menu names, e.g. croissant or biscotti"""
+        # Normalized like the messages, so "caramel" and "croissants" match too
+        return {
+            word for item in catalog for word in normalize(item.name).split()
+            if len(word) > 3 and word not in GENERIC_NAME_WORDS
+        }
+
+    def classify(self, text):
+        """
+        Decide locally whether a message is allowed.
+
+        Args:
+            text (str): The user message
+
+        Returns:
+            str: "allowed", "not allowed", or None when the LLM guard has to decide
+        """
+        text = text.lower()
+        words = re.findall(r"[a-z']+", text)
+        # Long messages can wrap an off-topic request around a menu item
+        if SENSITIVE_PATTERN.search(text) or len(words) > self.max_words:
+            return None
+
+        mentions_menu = bool(set(normalize(text).split()) & self.menu_words or self.catalog.find_mentions(text))
+        places_order = bool(ORDER_PATTERN.search(text) and set(words) & (DOMAIN_KEYWORDS | {"order"}))
+
+        embedding = np.asarray(self.embedding_model.embed_query(text), dtype=np.float32)
+        embedding /= np.linalg.norm(embedding)
+        on_topic = float(np.max(self.on_topic_embeddings @ embedding))
+        off_topic = float(np.max(self.off_topic_embeddings @ embedding))
+        on_topic_margin = on_topic - off_topic >= self.margin
+
+        # A menu word alone is no proof, the embedding has to agree
+        if (mentions_menu or places_order) and on_topic_margin:
+            return "allowed"
+        if on_topic >= self.allow_threshold and on_topic_margin:
+            return "allowed"
+        if not mentions_menu and on_topic <= self.reject_threshold and off_topic - on_topic >= self.margin:
+            return "not allowed"
+        return None
+
+    def get_response(self, messages, session_id=None):
+        decision = self.classify(messages[-1]['content'])
+        self._record(decision)
+        if decision is None:
+            return self.guard_agent.get_response(messages, session_id=session_id)
+        return self.postprocess(decision)
+
+    async def aget_response(self, messages, session_id=None):
+        """Async counterpart of get_response"""
+        decision = await asyncio.to_thread(self.classify, messages[-1]['content'])
+        self._record(decision)
+        if decision is None:
+            return await self.guard_agent.aget_response(messages, session_id=session_id)
+        return self.postprocess(decision)
+
+    def postprocess(self, decision):
+        if decision == "allowed":
+            message = "I understand. How can I help you with your order?"
+        else:
+            message = "Sorry, I can't help with that. Can I help you with your order?"
+        return {
+            "role": "assistant",
+            "content": message,
+            "memory": {
+                "agent": "guard_agent",
+                "guard_decision": decision
+            }
+        }
+
+    def stats(self):
+        """How many messages were short-circuited locally"""
+        with self.lock:
+            counters = dict(self.counters)
+        total = sum(counters.values())
+        counters["short_circuit_rate"] = (total - counters["sent_to_llm"]) / total if total else 0.0
+        return counters
+
+    def evaluate(self, labeled_examples):
+        """
+        Measure the local decisions against labeled messages, without calling the LLM.
+
+        Args:
+            labeled_examples: Iterable of {"content": str, "label": "allowed" | "not allowed"}
+
+        Returns:
+            dict: Short-circuit rate and precision of the local allow and reject decisions
+        """
+        results = {"allowed": [0, 0], "not allowed": [0, 0]}
+        total = 0
+        for example in labeled_examples:
+            total += 1
+            decision = self.classify(example["content"])
+            if decision is not None:
+                results[decision][0] += decision == example["label"]
+                results[decision][1] += 1
+
+        short_circuited = results["allowed"][1] + results["not allowed"][1]
+        return {
+            "examples": total,
+            "short_circuit_rate": short_circuited / total if total else 0.0,
+            "allow_precision": results["allowed"][0] / results["allowed"][1] if results["allowed"][1] else None,
+            "reject_precision": results["not allowed"][0] / results["not allowed"][1] if results["not allowed"][1] else None,
+            "unsafe_allows": results["allowed"][1] - results["allowed"][0]
+        }
+
+    def _embed_documents(self, texts):
+        embeddings = np.asarray(self.embedding_model.embed_documents(texts), dtype=np.float32)
+        return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    def _record(self, decision):
+        key = {"allowed": "allowed_locally", "not allowed": "rejected_locally"}.get(decision, "sent_to_llm")
+        with self.lock:
+            self.counters[key] += 1
+
+if __name__ == "__main__":
+    # Report the pre-filter's precision on a labeled set: python -m agents.guard_prefilter [labels.jsonl]
+    import sys
+    from .embeddings import get_embedding_service
+
+    labels_path = sys.argv[1] if len(sys.argv) > 1 else folder_path.parent / "guard_prefilter_labels.jsonl"
+    with open(labels_path, 'r') as file:
+        labeled_examples = [json.loads(line) for line in file if line.strip()]
+
+    embedding_model = get_embedding_service(os.getenv("HF_EMBEDDING_MODEL"), 'cpu')
+    prefilter = GuardPrefilter(None, embedding_model)
+    print(json.dumps(prefilter.evaluate(labeled_examples), indent=2))
@@ -0,0 +1,159 @@
+from dotenv import load_dotenv
+import logging
+from copy import deepcopy
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.chains import LLMChain
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+from .utils import parse_structured_output, aparse_structured_output
+from .memory_store import get_memory_store
+from .prompt_budget import PromptAssembler
+from .llm_factory import get_structured_output_model, compact_output_enabled
+from .agent_protocol import CompactOutput
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class GuardRoutingDecision(BaseModel):
+    """Schema for the fused guard and routing decision"""
+    decision: Literal["allowed", "not allowed"] = Field(description="Whether the query is relevant to the coffee shop")
+    route: Optional[Literal["details_agent", "order_taking_agent", "recommendation_agent"]] = Field(
+        description="The agent that should handle the input, null if not allowed",
+        default=None
+    )
+    message: str = Field(description="Response message if not allowed, empty if allowed", default="")
+
+ROUTE_CODES = {"d": "details_agent", "o": "order_taking_agent", "r": "recommendation_agent"}
+
+class CompactGuardRoutingDecision(CompactOutput):
+    """Compact GuardRoutingDecision: {"d": "a", "r": "o"} or {"d": "n", "r": null}"""
+    d: Literal["a", "n"] = Field(description="a: allowed, n: not allowed")
+    r: Optional[Literal["d", "o", "r"]] = Field(
+        description="d: details_agent, o: order_taking_agent, r: recommendation_agent, null if not allowed",
+        default=None
+    )
+
+    def expand(self):
+        return GuardRoutingDecision(
+            decision="allowed" if self.d == "a" else "not allowed",
+            route=ROUTE_CODES[self.r] if self.r else None
+        )
+
+FULL_OUTPUT_FORMAT = """Respond with JSON only, in this format:
+            {
+                "decision": "allowed" or "not allowed",
+                "route": "details_agent", "order_taking_agent" or "recommendation_agent", null if not allowed,
+                "message": "" if allowed, or "Sorry, I can't help with that. Can I help you with your order?" if not allowed
+            }"""
+
+COMPACT_OUTPUT_FORMAT = """Respond with JSON only, in this format:
+            {"d": "a" if allowed or "n" if not, "r": "d" for details_agent, "o" for order_taking_agent, "r" for recommendation_agent, null if not allowed}"""
+
+class GuardRouterAgent:
+    """
+    Single-call replacement for GuardAgent followed by ClassificationAgent.
+
+    The response carries both the guard_decision and the classification_decision, so
+    it can be used in place of either agent's response.
+    """
+    def __init__(self, compact=None):
+        # Compact outputs use short codes, see COMPACT_OUTPUT in llm_factory
+        self.compact = compact_output_enabled("guard_router_agent") if compact is None else compact
+        self.output_schema = CompactGuardRoutingDecision if self.compact else GuardRoutingDecision
+
+        self.client = get_structured_output_model("guard_router_agent", temperature=0, compact=self.compact)
+
+        # Create the system prompt template
+        self.system_prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries.
+            For the user's latest message, decide whether it is allowed and, if so, which agent should handle it.
+
+            The user is allowed to:
+            1. Ask questions about the coffee shop, like location, working hours, menu items and coffee shop related questions.
+            2. Ask questions about menu items, they can ask for ingredients in an item and more details about the item.
+            3. Make an order.
+            4. Ask about recommendations of what to buy.
+
+            The user is NOT allowed to:
+            1. Ask questions about anything else other than our coffee shop.
+            2. Ask questions about the staff or how to make a certain menu item.
+
+            Agents:
+            - details_agent: location, working hours, delivery, menu items and their details, general questions about the shop
+            - order_taking_agent: taking, modifying and completing orders
+            - recommendation_agent: product recommendations, suggestions and menu exploration
+
+            {output_format}"""),
+            MessagesPlaceholder(variable_name="chat_history"),
+            ("human", "{input}")
+        ]).partial(output_format=COMPACT_OUTPUT_FORMAT if self.compact else FULL_OUTPUT_FORMAT)
+
+        # Chat history is kept per session in the shared memory store
+        self.memory_store = get_memory_store()
+        self.prompt_assembler = PromptAssembler("guard_router_agent", self.system_prompt)
+
+        self.chain = LLMChain(
+            llm=self.client,
+            prompt=self.system_prompt,
+            verbose=True
+        )
+
+        logger.info("GuardRouterAgent initialized successfully")
+
+    def get_response(self, messages, session_id=None):
+        """
+        Get the guard and routing decision in one LLM call.
+
+        Raises:
+            ValueError: If the model output can't be turned into a valid decision,
+                        so the caller can fall back to the separate agents
+        """
+        input_text = self.build_input(messages)
+        chain_response = self.chain.predict(
+            input=input_text,
+            chat_history=self.prompt_assembler.history(session_id, input_text)
+        )
+        self.memory_store.add_turn(session_id, "guard_router_agent", input_text, chain_response)
+
+        parsed_response = parse_structured_output("guard_router_agent", chain_response, self.output_schema)
+
+        return self.postprocess(parsed_response)
+
+    async def aget_response(self, messages, session_id=None):
+        """Async counterpart of get_response"""
+        input_text = self.build_input(messages)
+        chain_response = await self.chain.apredict(
+            input=input_text,
+            chat_history=self.prompt_assembler.history(session_id, input_text)
+        )
+        self.memory_store.add_turn(session_id, "guard_router_agent", input_text, chain_response)
+
+        parsed_response = await aparse_structured_output("guard_router_agent", chain_response, self.output_schema)
+
+        return self.postprocess(parsed_response)
+
+    def build_input(self, messages):
+        messages = deepcopy(messages)
+
+        # Same context window as the ClassificationAgent
+        recent_messages = messages[-3:]
+        return "\n".join([f"{msg['role']}: {msg['content']}" for msg in recent_messages])
+
+    def postprocess(self, output):
+        if output.decision == "allowed" and output.route is None:
+            raise ValueError("Allowed query without a route")
+
+        if output.decision == "allowed":
+            message = output.message if output.message else "I understand. How can I help you with your order?"
+        else:
+            message = output.message if output.message else "Sorry, I can't help with that. Can I help you with your order?"
+
+        return {
+            "role": "assistant",
+            "content": message,
+            "memory": {
+                "agent": "guard_router_agent",
+                "guard_decision": output.decision,
+                "classification_decision": output.route
+            }
+        }
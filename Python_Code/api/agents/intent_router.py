@@ -0,0 +1,166 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Labeled examples of the traffic each agent handles
+ROUTE_EXEMPLARS = {
+    "details_agent": [
+        "What are your opening hours?",
+        "Where is the coffee shop located?",
+        "Do you deliver?",
+        "Is the cappuccino lactose free?",
+        "What ingredients are in the almond croissant?",
+        "How much is a latte?",
+        "What is on the menu?",
+        "Tell me more about the chocolate croissant",
+        "Are you open on Sundays?",
+        "Does the scone contain nuts?",
+        "What is the rating of the hazelnut biscotti?",
+        "Tell me about Merry's Way",
+    ],
+    "order_taking_agent": [
+        "I'd like a latte",
+        "One cappuccino please",
+        "Can I get two croissants?",
+        "I want to order a chocolate croissant and an espresso shot",
+        "Add a ginger scone to my order",
+        "Remove the latte from my order",
+        "Can I have a large dark chocolate?",
+        "I'll take an oatmeal scone",
+        "That's all, I'm done with my order",
+        "Give me one hazelnut syrup with my coffee",
+        "Change my order to three lattes",
+        "Let me order a cranberry scone",
+    ],
+    "recommendation_agent": [
+        "What do you recommend?",
+        "What's popular here?",
+        "Can you suggest a pastry?",
+        "What goes well with a latte?",
+        "Recommend me a drink",
+        "What is your best selling coffee?",
+        "I don't know what to get, any suggestions?",
+        "What bakery items are the most popular?",
+        "Suggest something sweet",
+        "What should I try today?",
+        "Any recommendations for a snack with my cappuccino?",
+        "What are your most popular flavours?",
+    ],
+}
+
+class IntentRouter:
+    """
+    Local nearest-centroid router placed in front of the ClassificationAgent.
+
+    The last user turn is embedded and compared with the centroid of each route's
+    exemplars. Confident matches are answered locally, everything else goes to the
+    LLM classification agent. Responses have the same shape as the ClassificationAgent's.
+    """
+    def __init__(self, classification_agent, embedding_model, threshold=None, margin=None, exemplars=None):
+        self.classification_agent = classification_agent
+        self.embedding_model = embedding_model
+        self.threshold = threshold if threshold is not None else float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.55"))
+        self.margin = margin if margin is not None else float(os.getenv("INTENT_ROUTER_MARGIN", "0.05"))
+
+        exemplars = exemplars or ROUTE_EXEMPLARS
+        self.routes = list(exemplars.keys())
+        centroids = []
+        for route in self.routes:
+            embeddings = np.asarray(self.embedding_model.embed_documents(exemplars[route]), dtype=np.float32)
+            centroid = embeddings.mean(axis=0)
+            centroids.append(centroid / np.linalg.norm(centroid))
+        self.centroids = np.stack(centroids)
+
+        self.lock = threading.Lock()
+        self.local_hits = 0
+        self.llm_fallbacks = 0
+        self.local_seconds = 0.0
+
+        logger.info("IntentRouter initialized successfully")
+
+    def route(self, text):
+        """
+        Score the text against every route.
+
+        Args:
+            text (str): The user message
+
+        Returns:
+            tuple: (best route, whether the match is confident enough to skip the LLM)
+        """
+        embedding = np.asarray(self.embedding_model.embed_query(text), dtype=np.float32)
+        embedding /= np.linalg.norm(embedding)
+        scores = self.centroids @ embedding
+
+        ranking = np.argsort(scores)[::-1]
+        best, second = scores[ranking[0]], scores[ranking[1]]
+        confident = best >= self.threshold and best - second >= self.margin
+        return self.routes[ranking[0]], confident
+
+    def needs_context(self, messages):
+        """
+        Short follow ups such as "yes" or "that's all" depend on the previous turn,
+        which the local router doesn't look at.
+        """
+        for message in reversed(messages[:-1]):
+            if message["role"] == "assistant":
+                return message.get("memory", {}).get("agent") == "order_taking_agent"
+        return False
+
+    def get_response(self, messages, session_id=None):
+        start = time.perf_counter()
+        route, confident = self.route(messages[-1]['content'])
+        if confident and not self.needs_context(messages):
+            self._record_hit(time.perf_counter() - start)
+            return self.postprocess(route)
+
+        self._record_fallback()
+        return self.classification_agent.get_response(messages, session_id=session_id)
+
+    async def aget_response(self, messages, session_id=None):
+        """Async counterpart of get_response"""
+        start = time.perf_counter()
+        route, confident = await asyncio.to_thread(self.route, messages[-1]['content'])
+        if confident and not self.needs_context(messages):
+            self._record_hit(time.perf_counter() - start)
+            return self.postprocess(route)
+
+        self._record_fallback()
+        return await self.classification_agent.aget_response(messages, session_id=session_id)
+
+    def postprocess(self, route):
+        return {
+            "role": "assistant",
+            "content": "",
+            "memory": {
+                "agent": "classification_agent",
+                "classification_decision": route
+            }
+        }
+
+    def stats(self):
+        """Local hit and LLM fallback counters"""
+        with self.lock:
+            total = self.local_hits + self.llm_fallbacks
+            return {
+                "local_hits": self.local_hits,
+                "llm_fallbacks": self.llm_fallbacks,
+                "hit_rate": self.local_hits / total if total else 0.0,
+                "avg_local_ms": 1000 * self.local_seconds / self.local_hits if self.local_hits else 0.0
+            }
+
+    def _record_hit(self, seconds):
+        with self.lock:
+            self.local_hits += 1
+            self.local_seconds += seconds
+
+    def _record_fallback(self):
+        with self.lock:
+            self.llm_fallbacks += 1
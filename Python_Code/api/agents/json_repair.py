@@ -0,0 +1,183 @@
+import json
+import threading
+from collections import defaultdict
+from pydantic import ValidationError
+
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+CLOSING = {"{": "}", "[": "]"}
+
+class JSONRepairError(ValueError):
+    """Raised when a model output can't be turned into the expected JSON object"""
+
+def extract_json_object(text):
+    """
+    First JSON object in a model output.
+
+    Skips code fences and prose around the object, and closes the brackets and string
+    left open by a truncated output.
+
+    Raises:
+        JSONRepairError: If the text contains no object
+    """
+    start = text.find("{")
+    if start == -1:
+        raise JSONRepairError("No JSON object in the output")
+
+    stack = []
+    quote = None
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char in CLOSING:
+            stack.append(CLOSING[char])
+        elif char in "}]" and stack:
+            stack.pop()
+            if not stack:
+                return text[start:index + 1]
+
+    # Truncated output
+    return text[start:] + (quote or "") + "".join(reversed(stack))
+
+def repair_json(text):
+    """
+    Rewrite the near-JSON that models produce as JSON.
+
+    Converts single-quoted strings to double-quoted ones, quotes bare keys and words,
+    turns the Python literals True, False and None into JSON and drops trailing commas.
+    Double-quoted strings are copied as they are, apostrophes included.
+    """
+    output = []
+    index = 0
+    length = len(text)
+    while index < length:
+        char = text[index]
+        if char == '"':
+            end = index + 1
+            while end < length and text[end] != '"':
+                end += 2 if text[end] == "\\" else 1
+            output.append(text[index:end + 1])
+            index = end + 1
+        elif char == "'":
+            value = []
+            end = index + 1
+            while end < length and text[end] != "'":
+                if text[end] == "\\" and end + 1 < length:
+                    value.append(text[end + 1] if text[end + 1] == "'" else text[end:end + 2])
+                    end += 2
+                else:
+                    value.append('\\"' if text[end] == '"' else text[end])
+                    end += 1
+            output.append('"' + "".join(value) + '"')
+            index = end + 1
+        elif (char.isalpha() or char == "_") and not (output and output[-1][-1:].isdigit()):
+            end = index
+            while end < length and (text[end].isalnum() or text[end] == "_"):
+                end += 1
+            word = text[index:end]
+            if word in PYTHON_LITERALS:
+                output.append(PYTHON_LITERALS[word])
+            elif word in ("true", "false", "null"):
+                output.append(word)
+            else:
+                output.append(f'"{word}"')
+            index = end
+        elif char in "}]":
+            # Trailing comma before the closing bracket
+            while output and output[-1].isspace():
+                output.pop()
+            if output and output[-1] == ",":
+                output.pop()
+            output.append(char)
+            index += 1
+        else:
+            output.append(char)
+            index += 1
+    return "".join(output)
+
+def loads_tolerant(text):
+    """
+    Parse a model output as a JSON object, repairing it if needed.
+
+    Returns:
+        tuple: (dict, whether the output had to be repaired)
+
+    Raises:
+        JSONRepairError: If no object can be recovered
+    """
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, False
+    except ValueError:
+        pass
+
+    # An object in a code fence or prose only needs extracting, as the Pydantic parser did
+    extracted = extract_json_object(text)
+    for candidate, repaired in ((extracted, False), (repair_json(extracted), True)):
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(data, dict):
+            return data, repaired
+    raise JSONRepairError(f"Could not repair the output: {text[:200]}")
+
+class RepairStats:
+    """How the structured outputs of each agent were parsed"""
+    outcomes = ("parsed", "repaired_locally", "repaired_by_llm", "failed")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: dict.fromkeys(self.outcomes, 0))
+
+    def record(self, agent_name, outcome):
+        with self.lock:
+            self.counters[agent_name][outcome] += 1
+
+    def stats(self):
+        with self.lock:
+            stats = {agent_name: dict(counters) for agent_name, counters in self.counters.items()}
+        for counters in stats.values():
+            malformed = counters["repaired_locally"] + counters["repaired_by_llm"] + counters["failed"]
+            counters["local_repair_rate"] = counters["repaired_locally"] / malformed if malformed else None
+        return stats
+
+repair_stats = RepairStats()
+
+def parse_model(text, schema, agent_name=None):
+    """
+    Parse a model output into a Pydantic schema, repairing it locally if needed.
+
+    Args:
+        text (str): Raw model output
+        schema: Pydantic model class the output must validate against
+        agent_name (str): Agent the outcome is counted for, not counted if None
+
+    Returns:
+        An instance of schema
+
+    Raises:
+        JSONRepairError: If the output can't be repaired or doesn't match the schema
+    """
+    data, repaired = loads_tolerant(text)
+    try:
+        parsed = schema(**data)
+    except ValidationError as e:
+        raise JSONRepairError(f"Output does not match {schema.__name__}: {str(e)}") from e
+    if agent_name is not None:
+        repair_stats.record(agent_name, "repaired_locally" if repaired else "parsed")
+    return parsed
+
+def get_repair_stats():
+    """Parse outcomes and local repair rate of each agent"""
+    return repair_stats.stats()
@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import pathlib
+import threading
+from typing import Any, Optional
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Persistent exact-match cache of LLM completions.
+
+    Entries are keyed on the model configuration (model name, temperature and the
+    other invocation parameters LangChain puts in llm_string) and the fully rendered
+    prompt. The least recently used entries are deleted once max_entries is exceeded.
+    Point the database at a network volume so new workers start warm.
+    """
+    def __init__(self, database_path, max_entries=10000):
+        self.database_path = str(database_path)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        pathlib.Path(self.database_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.database_path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                """CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    generations TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)"
+            )
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\x00{prompt}".encode()).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self.make_key(prompt, llm_string)
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT generations FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.connection.execute(
+                "UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self.hits += 1
+
+        try:
+            return [loads(generation) for generation in json.loads(row[0])]
+        except Exception as e:
+            logger.warning(f"Could not deserialize cached completion: {str(e)}")
+            return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        key = self.make_key(prompt, llm_string)
+        generations = json.dumps([dumps(generation) for generation in return_val])
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions (key, generations, last_access) VALUES (?, ?, ?)",
+                (key, generations, time.time())
+            )
+            count = self.connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    """DELETE FROM completions WHERE key IN (
+                        SELECT key FROM completions ORDER BY last_access LIMIT ?
+                    )""",
+                    (count - self.max_entries,)
+                )
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM completions")
+
+    def stats(self):
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "entries": entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache(agent_name: str) -> Optional[SQLiteLLMCache]:
+    """
+    Get the completion cache for an agent.
+
+    Caching is opt-in per agent: list the agent names in LLM_CACHE_AGENTS
+    (comma separated, or "all"). Every opted-in agent shares the same database.
+
+    Args:
+        agent_name: Name of the agent, e.g. "guard_agent"
+
+    Returns:
+        The shared cache, or None if the agent is not opted in
+    """
+    global _llm_cache
+    enabled_agents = {name.strip() for name in os.getenv("LLM_CACHE_AGENTS", "").split(",") if name.strip()}
+    if agent_name not in enabled_agents and "all" not in enabled_agents:
+        return None
+
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = SQLiteLLMCache(
+                os.getenv("LLM_CACHE_PATH", str(folder_path.parent / "cache" / "llm_cache.sqlite")),
+                max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "10000"))
+            )
+        return _llm_cache
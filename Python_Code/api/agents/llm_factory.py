@@ -0,0 +1,212 @@
+import os
+import logging
+import threading
+from collections import defaultdict
+import httpx
+from langchain_groq import ChatGroq
+from langchain_core.callbacks import BaseCallbackHandler
+from .llm_cache import get_llm_cache
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+class InFlightGauge(BaseCallbackHandler):
+    """Counts the LLM requests of each agent that are currently running"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = defaultdict(int)
+        self.peak = defaultdict(int)
+        self.calls = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.run_agents = {}
+
+    def start(self, run_id, agent_name):
+        with self.lock:
+            self.run_agents[run_id] = agent_name
+            self.in_flight[agent_name] += 1
+            self.calls[agent_name] += 1
+            self.peak[agent_name] = max(self.peak[agent_name], self.in_flight[agent_name])
+
+    def end(self, run_id, failed=False):
+        with self.lock:
+            agent_name = self.run_agents.pop(run_id, None)
+            if agent_name is None:
+                return
+            self.in_flight[agent_name] -= 1
+            if failed:
+                self.errors[agent_name] += 1
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        self.start(run_id, (metadata or {}).get("agent_name", "unknown"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.end(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.end(run_id, failed=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                agent_name: {
+                    "in_flight": self.in_flight[agent_name],
+                    "peak": self.peak[agent_name],
+                    "calls": self.calls[agent_name],
+                    "errors": self.errors[agent_name]
+                }
+                for agent_name in self.calls
+            }
+
+gauge = InFlightGauge()
+
+class OutputTokenMeter(BaseCallbackHandler):
+    """Output tokens generated per agent, split by full and compact output mode"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runs = {}
+        self.calls = defaultdict(int)
+        self.output_tokens = defaultdict(int)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        metadata = metadata or {}
+        with self.lock:
+            self.runs[run_id] = (metadata.get("agent_name", "unknown"), metadata.get("output_mode", "full"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            key = self.runs.pop(run_id, None)
+        tokens = self.completion_tokens(response)
+        # Cached responses have no usage
+        if key is None or tokens is None:
+            return
+        with self.lock:
+            self.calls[key] += 1
+            self.output_tokens[key] += tokens
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.runs.pop(run_id, None)
+
+    @staticmethod
+    def completion_tokens(response):
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if "completion_tokens" in token_usage:
+            return token_usage["completion_tokens"]
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    return usage["output_tokens"]
+        return None
+
+    def stats(self):
+        with self.lock:
+            calls, output_tokens = dict(self.calls), dict(self.output_tokens)
+        stats = {}
+        for (agent_name, output_mode), count in calls.items():
+            stats.setdefault(agent_name, {})[output_mode] = {
+                "calls": count,
+                "output_tokens": output_tokens[(agent_name, output_mode)],
+                "mean_output_tokens": output_tokens[(agent_name, output_mode)] / count
+            }
+        for modes in stats.values():
+            if "full" in modes and "compact" in modes:
+                modes["saved_per_call"] = modes["full"]["mean_output_tokens"] - modes["compact"]["mean_output_tokens"]
+        return stats
+
+output_token_meter = OutputTokenMeter()
+
+_http_client = None
+_http_async_client = None
+_chat_models = {}
+_lock = threading.Lock()
+
+def _http_clients():
+    """Keep-alive connection pools shared by every chat model in the process"""
+    global _http_client, _http_async_client
+    if _http_client is None:
+        limits = httpx.Limits(
+            max_connections=int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", "50")),
+            max_keepalive_connections=int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("LLM_HTTP_KEEPALIVE_SECONDS", "60"))
+        )
+        timeout = httpx.Timeout(float(os.getenv("LLM_REQUEST_TIMEOUT", "60")), connect=10)
+        _http_client = httpx.Client(limits=limits, timeout=timeout)
+        # Bound to the event loop that first uses it, i.e. the worker's serving loop
+        _http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+    return _http_client, _http_async_client
+
+def get_chat_model(agent_name, temperature=0) -> ChatGroq:
+    """
+    Get the shared chat model of an agent.
+
+    Models are created once per agent and temperature and reused by every call. They
+    all send their requests through the same pooled keep-alive HTTP clients. The model
+    and temperature can be overridden per agent with <AGENT_NAME>_MODEL_NAME and
+    <AGENT_NAME>_TEMPERATURE, e.g. GUARD_AGENT_MODEL_NAME.
+
+    Args:
+        agent_name: Name of the agent, e.g. "guard_agent"
+        temperature: Temperature used when no override is set
+
+    Returns:
+        ChatGroq: The agent's chat model
+    """
+    prefix = agent_name.upper()
+    model_name = os.getenv(f"{prefix}_MODEL_NAME") or os.getenv("GROQ_MODEL_NAME")
+    temperature = float(os.getenv(f"{prefix}_TEMPERATURE", temperature))
+
+    with _lock:
+        key = (agent_name, model_name, temperature)
+        if key not in _chat_models:
+            http_client, http_async_client = _http_clients()
+            _chat_models[key] = ChatGroq(
+                model_name=model_name,
+                temperature=temperature,
+                groq_api_key=os.getenv("GROQ_API_KEY"),
+                cache=get_llm_cache(agent_name),
+                http_client=http_client,
+                http_async_client=http_async_client,
+                callbacks=[gauge, output_token_meter],
+                metadata={"agent_name": agent_name}
+            )
+            logger.info(f"Created chat model for {agent_name} ({model_name}, temperature={temperature})")
+        return _chat_models[key]
+
+def compact_output_enabled(agent_name):
+    """
+    Whether an agent generates compact structured outputs: no reasoning fields and
+    short codes for its decisions. Set with COMPACT_OUTPUT, overridden per agent with
+    <AGENT_NAME>_COMPACT_OUTPUT.
+    """
+    default = os.getenv("COMPACT_OUTPUT", "false")
+    return os.getenv(f"{agent_name.upper()}_COMPACT_OUTPUT", default).lower() == "true"
+
+def get_structured_output_model(agent_name, temperature=0, compact=False):
+    """
+    Chat model for an agent's JSON outputs.
+
+    In compact mode the requests ask for JSON mode (response_format json_object),
+    unless LLM_JSON_MODE is false for models that don't support it, and their output
+    tokens are counted under the "compact" mode.
+
+    Args:
+        agent_name: Name of the agent, e.g. "guard_agent"
+        temperature: Temperature used when no override is set
+        compact: Whether the agent uses its compact output schema
+    """
+    chat_model = get_chat_model(agent_name, temperature)
+    if not compact:
+        return chat_model
+    if os.getenv("LLM_JSON_MODE", "true").lower() == "true":
+        chat_model = chat_model.bind(response_format={"type": "json_object"})
+    return chat_model.with_config(metadata={"output_mode": "compact"})
+
+def get_output_token_stats():
+    """Output tokens per call of each agent in full and compact output mode"""
+    return output_token_meter.stats()
+
+def get_llm_stats():
+    """In-flight, peak, call and error counts of each agent's LLM requests"""
+    return gauge.stats()
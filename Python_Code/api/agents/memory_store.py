@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional
+from langchain.schema import AIMessage, HumanMessage, BaseMessage
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SESSION_ID = "default"
+
+def estimate_tokens(text):
+    """Cheap local token estimate (~4 characters per token)"""
+    return len(text) // 4 + 1
+
+class SessionHistory:
+    """Chat histories of a single session, one per agent"""
+    def __init__(self):
+        self.histories: Dict[str, deque] = {}
+        # Rolling summary of the turns evicted from each history
+        self.summaries: Dict[str, str] = {}
+        self.tokens = 0
+        self.last_access = time.monotonic()
+
+class SessionMemoryStore:
+    """
+    Process-wide conversation memory keyed by session id.
+
+    Every agent keeps its history in its own namespace of the session. Each history
+    is bounded by a number of turns and a token budget, idle sessions expire after a
+    TTL, and the least recently used sessions are evicted once the number of
+    sessions or the total number of stored tokens goes over its cap.
+
+    The token budget can be set per agent with <AGENT_NAME>_HISTORY_TOKENS. When an
+    eviction_listener is set, the turns dropped from a history are passed to it so
+    they can be folded into the history's summary. A full history is then trimmed to
+    half its bounds, so the listener gets several turns at a time.
+    """
+    def __init__(self, max_turns=None, max_tokens=None, max_sessions=None,
+                 ttl_seconds=None, max_total_tokens=None):
+        self.max_turns = max_turns or int(os.getenv("SESSION_MEMORY_TURNS", "6"))
+        self.max_tokens = max_tokens or int(os.getenv("SESSION_MEMORY_TOKENS", "1500"))
+        self.max_sessions = max_sessions or int(os.getenv("SESSION_MEMORY_MAX_SESSIONS", "1000"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("SESSION_MEMORY_TTL_SECONDS", "1800"))
+        self.max_total_tokens = max_total_tokens or int(os.getenv("SESSION_MEMORY_TOTAL_TOKENS", "2000000"))
+
+        self.sessions: "OrderedDict[str, SessionHistory]" = OrderedDict()
+        self.total_tokens = 0
+        self.evicted_sessions = 0
+        self.lock = threading.Lock()
+
+        self.namespace_tokens: Dict[str, int] = {}
+        # Called with (session_id, namespace, evicted messages), outside the lock
+        self.eviction_listener: Optional[Callable[[str, str, List[BaseMessage]], None]] = None
+
+    def get_messages(self, session_id: Optional[str], namespace: str) -> List[BaseMessage]:
+        """
+        Get the chat history of an agent for a session.
+
+        Args:
+            session_id: Conversation id, None for the default session
+            namespace: Name of the agent owning the history
+
+        Returns:
+            List of LangChain messages, oldest first
+        """
+        session_id = session_id or DEFAULT_SESSION_ID
+        with self.lock:
+            self._evict_expired()
+            session = self.sessions.get(session_id)
+            if session is None:
+                return []
+            self._touch(session_id, session)
+            return [message for message, _ in session.histories.get(namespace, ())]
+
+    def add_turn(self, session_id: Optional[str], namespace: str, input_text: str, output_text: str):
+        """
+        Append a user/assistant exchange to an agent's history and enforce the bounds.
+
+        Args:
+            session_id: Conversation id, None for the default session
+            namespace: Name of the agent owning the history
+            input_text: Text sent to the model
+            output_text: Text returned by the model
+        """
+        session_id = session_id or DEFAULT_SESSION_ID
+        with self.lock:
+            self._evict_expired()
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self.sessions[session_id] = SessionHistory()
+            self._touch(session_id, session)
+
+            history = session.histories.setdefault(namespace, deque())
+            for message in (HumanMessage(content=input_text), AIMessage(content=output_text)):
+                tokens = estimate_tokens(message.content)
+                history.append((message, tokens))
+                session.tokens += tokens
+                self.total_tokens += tokens
+
+            # Keep at most max_turns exchanges within the token budget
+            max_messages, max_tokens = 2 * self.max_turns, self.history_tokens(namespace)
+            history_tokens = sum(tokens for _, tokens in history)
+            listener = self.eviction_listener
+            if listener is not None and (len(history) > max_messages or history_tokens > max_tokens):
+                max_messages, max_tokens = max(max_messages // 2, 2), max_tokens // 2
+            evicted = []
+            while history and (len(history) > max_messages or history_tokens > max_tokens):
+                message, tokens = history.popleft()
+                evicted.append(message)
+                history_tokens -= tokens
+                session.tokens -= tokens
+                self.total_tokens -= tokens
+
+            while len(self.sessions) > self.max_sessions or self.total_tokens > self.max_total_tokens:
+                if len(self.sessions) == 1:
+                    break
+                self._evict_oldest()
+
+        if evicted and listener is not None:
+            listener(session_id, namespace, evicted)
+
+    def history_tokens(self, namespace: str) -> int:
+        """Token budget of an agent's history"""
+        if namespace not in self.namespace_tokens:
+            override = os.getenv(f"{namespace.upper()}_HISTORY_TOKENS")
+            self.namespace_tokens[namespace] = int(override) if override else self.max_tokens
+        return self.namespace_tokens[namespace]
+
+    def get_summary(self, session_id: Optional[str], namespace: str) -> str:
+        """Rolling summary of an agent's evicted turns, empty if there is none"""
+        with self.lock:
+            session = self.sessions.get(session_id or DEFAULT_SESSION_ID)
+            return session.summaries.get(namespace, "") if session is not None else ""
+
+    def set_summary(self, session_id: Optional[str], namespace: str, summary: str):
+        """Replace the rolling summary of an agent's history, ignored if the session expired"""
+        with self.lock:
+            session = self.sessions.get(session_id or DEFAULT_SESSION_ID)
+            if session is None:
+                return
+            previous = session.summaries.get(namespace)
+            tokens = estimate_tokens(summary) - (estimate_tokens(previous) if previous else 0)
+            session.summaries[namespace] = summary
+            session.tokens += tokens
+            self.total_tokens += tokens
+
+    def clear(self, session_id: Optional[str] = None):
+        """Drop one session, or every session when no id is given"""
+        with self.lock:
+            if session_id is None:
+                self.sessions.clear()
+                self.total_tokens = 0
+            elif session_id in self.sessions:
+                self.total_tokens -= self.sessions.pop(session_id).tokens
+
+    def stats(self):
+        """Current size of the store"""
+        with self.lock:
+            return {
+                "sessions": len(self.sessions),
+                "total_tokens": self.total_tokens,
+                "evicted_sessions": self.evicted_sessions
+            }
+
+    def _touch(self, session_id, session):
+        session.last_access = time.monotonic()
+        self.sessions.move_to_end(session_id)
+
+    def _evict_oldest(self):
+        session_id, session = self.sessions.popitem(last=False)
+        self.total_tokens -= session.tokens
+        self.evicted_sessions += 1
+        logger.debug(f"Evicted session {session_id}")
+
+    def _evict_expired(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_access >= deadline:
+                break
+            self._evict_oldest()
+
+_memory_store = None
+_memory_store_lock = threading.Lock()
+
+def get_memory_store() -> SessionMemoryStore:
+    """Get the memory store shared by every agent in the process"""
+    global _memory_store
+    with _memory_store_lock:
+        if _memory_store is None:
+            _memory_store = SessionMemoryStore()
+        return _memory_store
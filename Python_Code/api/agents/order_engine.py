@@ -0,0 +1,180 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict, List, Tuple
+from pydantic import BaseModel, Field
+from .catalog import get_catalog
+from .agent_protocol import CompactOutput
+
+# Values of the "step number" memory key
+TAKING_ORDER = 1
+CONFIRMING = 2
+CLOSED = 3
+
+CENT = Decimal("0.01")
+
+class ItemMention(BaseModel):
+    """An item the customer mentioned, as extracted by the LLM"""
+    item: str = Field(description="Menu item name as the customer said it")
+    quantity: int = Field(description="Number of items, 1 if not said", default=1)
+    action: str = Field(description="add or remove", default="add")
+
+class OrderExtraction(BaseModel):
+    """Schema of the LLM output for an order turn"""
+    items: List[ItemMention] = Field(description="Items the customer wants to add or remove in this message", default_factory=list)
+    finished: bool = Field(description="Whether the customer said they need nothing else or confirmed the order", default=False)
+
+class CompactOrderExtraction(CompactOutput):
+    """Compact OrderExtraction: {"a": [["latte", 2]], "r": [["croissant", 1]], "f": false}"""
+    a: List[Tuple[str, int]] = Field(description="[item, quantity] pairs to add", default_factory=list)
+    r: List[Tuple[str, int]] = Field(description="[item, quantity] pairs to remove", default_factory=list)
+    f: bool = Field(description="finished", default=False)
+
+    def expand(self):
+        items = [ItemMention(item=item, quantity=quantity, action="add") for item, quantity in self.a]
+        items += [ItemMention(item=item, quantity=quantity, action="remove") for item, quantity in self.r]
+        return OrderExtraction(items=items, finished=self.f)
+
+class OrderState(BaseModel):
+    """Order of a conversation, as kept in the order taking agent's memory"""
+    step_number: int = Field(description="TAKING_ORDER, CONFIRMING or CLOSED", default=TAKING_ORDER)
+    quantities: Dict[str, int] = Field(description="Menu item name -> quantity, in order of addition", default_factory=dict)
+
+class OrderUpdate(BaseModel):
+    """What an order turn changed, used to word the reply"""
+    state: OrderState
+    added: List[str] = Field(default_factory=list)
+    removed: List[str] = Field(default_factory=list)
+    unknown: List[str] = Field(default_factory=list)
+    ambiguous: Dict[str, List[str]] = Field(description="Partial mention -> menu items it could be", default_factory=dict)
+
+class OrderEngine:
+    """
+    Deterministic order taking: validates item mentions against the catalog, keeps
+    the quantities, moves through the add, confirm and close steps and does the
+    price arithmetic in Decimal. The LLM only extracts ItemMentions from the
+    customer's message.
+
+    Step transitions:
+        TAKING_ORDER --finished--> CONFIRMING --finished--> CLOSED
+        Changes to the order while CONFIRMING are shown for confirmation again,
+        and a message after CLOSED starts a new order.
+    """
+    max_quantity = 50
+
+    def __init__(self, catalog=None):
+        self.catalog = catalog or get_catalog()
+
+    def state_from_memory(self, memory):
+        """
+        Rebuild the state from the agent's memory, re-validating the stored items.
+
+        Args:
+            memory (dict): {"step number": int, "order": [{"item", "quantity", "price"}]}, or None
+        """
+        if not memory:
+            return OrderState()
+        quantities = {}
+        for line in memory.get("order") or []:
+            item = self.catalog.resolve(line.get("item", ""))
+            if item is not None:
+                quantities[item.name] = quantities.get(item.name, 0) + int(line.get("quantity", 1))
+        step_number = memory.get("step number")
+        # Orders taken before the engine used free-form step numbers
+        if step_number not in (TAKING_ORDER, CONFIRMING, CLOSED):
+            step_number = TAKING_ORDER
+        return OrderState(step_number=step_number, quantities=quantities)
+
+    def apply(self, state, extraction):
+        """
+        Apply an extracted turn to the order.
+
+        Args:
+            state (OrderState): State before the customer's message
+            extraction (OrderExtraction): Items and intent of the message
+
+        Returns:
+            OrderUpdate: New state and the changes made
+        """
+        if state.step_number == CLOSED:
+            state = OrderState()
+        quantities = dict(state.quantities)
+        update = OrderUpdate(state=state)
+
+        for mention in extraction.items:
+            item = self.catalog.resolve(mention.item)
+            candidates = self.catalog.candidates(mention.item) if item is None else []
+            if candidates and mention.action == "remove":
+                # "the scone" is the scone of the order
+                ordered = [candidate for candidate in candidates if candidate.name in quantities]
+                candidates = ordered or candidates
+            if len(candidates) == 1:
+                item = candidates[0]
+            if item is None:
+                if candidates:
+                    update.ambiguous[mention.item] = [candidate.name for candidate in candidates]
+                else:
+                    update.unknown.append(mention.item)
+                continue
+            quantity = min(max(int(mention.quantity), 1), self.max_quantity)
+            if mention.action == "remove":
+                if item.name in quantities:
+                    quantities[item.name] -= quantity
+                    if quantities[item.name] <= 0:
+                        del quantities[item.name]
+                    update.removed.append(item.name)
+            else:
+                quantities[item.name] = min(quantities.get(item.name, 0) + quantity, self.max_quantity)
+                update.added.append(item.name)
+
+        changed = bool(update.added or update.removed)
+        step_number = state.step_number
+        if not quantities:
+            step_number = TAKING_ORDER
+        elif extraction.finished and not changed and not update.ambiguous and step_number == CONFIRMING:
+            step_number = CLOSED
+        elif extraction.finished or (changed and step_number == CONFIRMING):
+            step_number = CONFIRMING
+
+        update.state = OrderState(step_number=step_number, quantities=quantities)
+        return update
+
+    def line_total(self, name, quantity):
+        return (self.catalog.by_name[name].price * quantity).quantize(CENT, rounding=ROUND_HALF_UP)
+
+    def total(self, state):
+        return sum((self.line_total(name, quantity) for name, quantity in state.quantities.items()), Decimal("0.00"))
+
+    def order_lines(self, state):
+        """Order in the memory format: [{"item", "quantity", "price"}] with price the line total"""
+        return [
+            {"item": name, "quantity": quantity, "price": float(self.line_total(name, quantity))}
+            for name, quantity in state.quantities.items()
+        ]
+
+    def summary(self, state):
+        lines = [f"- {quantity} x {name}: ${self.line_total(name, quantity):.2f}" for name, quantity in state.quantities.items()]
+        lines.append(f"Total: ${self.total(state):.2f}")
+        return "\n".join(lines)
+
+    def reply(self, update):
+        """Reply to the customer with the exact order and total"""
+        state = update.state
+        parts = []
+        if update.unknown:
+            parts.append(f"Sorry, {', '.join(update.unknown)} {'is' if len(update.unknown) == 1 else 'are'} not on our menu.")
+        if update.added:
+            parts.append(f"I've added {', '.join(update.added)} to your order.")
+        if update.removed:
+            parts.append(f"I've removed {', '.join(update.removed)} from your order.")
+        for mention, names in update.ambiguous.items():
+            parts.append(f"Which {mention} do you mean: {', '.join(names[:-1])} or {names[-1]}?")
+
+        if not state.quantities:
+            if not update.ambiguous:
+                parts.append("Your order is empty. What would you like to have?")
+        elif state.step_number == CLOSED:
+            parts.append(f"Your order is placed:\n{self.summary(state)}\nThank you for ordering at Merry's Way, enjoy!")
+        elif state.step_number == CONFIRMING:
+            parts.append(f"Here is your order:\n{self.summary(state)}\nShall I place it?")
+        else:
+            parts.append(f"Your order so far:\n{self.summary(state)}\nWould you like anything else?")
+        return "\n".join(parts)
@@ -1,176 +1,168 @@
-import os
-import json
-from .utils import double_check_json_output
-from langchain_groq import ChatGroq
+from .utils import parse_structured_output, aparse_structured_output
+from .memory_store import get_memory_store
+from .prompt_budget import PromptAssembler
+from .llm_factory import get_structured_output_model, compact_output_enabled
+from .order_engine import OrderEngine, OrderExtraction, CompactOrderExtraction
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
-from typing import List, Optional
 from copy import deepcopy
 from dotenv import load_dotenv
 load_dotenv()
 
-class OrderItem(BaseModel):
-    """Schema for order items"""
-    item: str = Field(description="Name of the menu item")
-    quantity: int = Field(description="Quantity of the item ordered")
-    price: float = Field(description="Total price for this item")
+FULL_OUTPUT_FORMAT = """Output only this JSON:
+            {"items": [{"item": "<name>", "quantity": <number>, "action": "add" or "remove"}], "finished": true or false}"""
 
-class OrderResponse(BaseModel):
-    """Schema for order taking response"""
-    chain_of_thought: str = Field(description="Reasoning about the current step and user input")
-    step_number: int = Field(description="Current step in the order process")
-    order: List[OrderItem] = Field(description="List of ordered items")
-    response: str = Field(description="Response to the user")
+COMPACT_OUTPUT_FORMAT = """Output only this JSON, with [name, quantity] pairs:
+            {"a": [items to add], "r": [items to remove], "f": finished, true or false}"""
 
 class OrderTakingAgent:
-    def __init__(self, recommendation_agent):
+    def __init__(self, recommendation_agent, order_engine=None, compact=None):
+        # Compact outputs use short keys, see COMPACT_OUTPUT in llm_factory
+        self.compact = compact_output_enabled("order_taking_agent") if compact is None else compact
+        self.output_schema = CompactOrderExtraction if self.compact else OrderExtraction
+
         # Initialize Groq client
-        self.client = ChatGroq(
-            model_name=os.getenv("GROQ_MODEL_NAME"),
-            temperature=0.7,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
-        
+        self.client = get_structured_output_model("order_taking_agent", temperature=0, compact=self.compact)
+
         self.recommendation_agent = recommendation_agent
-        
+
+        # Menu validation, name resolution, order state and prices are handled
+        # locally, the LLM only extracts the items the user mentions
+        self.order_engine = order_engine or OrderEngine()
+
         # Create the system prompt template
         self.system_prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a customer support Bot for a coffee shop called "Merry's way".
-
-            Menu:
-            - Cappuccino - $4.50
-            - Jumbo Savory Scone - $3.25
-            - Latte - $4.75
-            - Chocolate Chip Biscotti - $2.50
-            - Espresso shot - $2.00
-            - Hazelnut Biscotti - $2.75
-            - Chocolate Croissant - $3.75
-            - Dark chocolate (Drinking Chocolate) - $5.00
-            - Cranberry Scone - $3.50
-            - Croissant - $3.25
-            - Almond Croissant - $4.00
-            - Ginger Biscotti - $2.50
-            - Oatmeal Scone - $3.25
-            - Ginger Scone - $3.50
-            - Chocolate syrup - $1.50
-            - Hazelnut syrup - $1.50
-            - Carmel syrup - $1.50
-            - Sugar Free Vanilla syrup - $1.50
-            - Dark chocolate (Packaged Chocolate) - $3.00
-
-            Important Rules:
-            * DO NOT ask about payment methods (cash/card)
-            * DO NOT direct users to the counter
-            * DO NOT tell users where to collect their order
-
-            Your Process:
-            1. Take the User's Order
-            2. Validate all items against the menu
-            3. For invalid items, inform the user and confirm remaining valid items
-            4. Ask if they need anything else
-            5. If yes, repeat from step 3
-            6. If no, complete the order by:
-                - Listing all items and prices
-                - Calculating the total
-                - Thanking the user and closing the conversation
-
-            Use the memory section to track:
-            - Current order
-            - Step number
-            - Previous interactions"""),
+            ("system", """You extract order changes for a coffee shop called "Merry's way".
+
+            From the user's message, list the items they want to add to or remove from
+            their order, named as the user named them. Set "finished" to true when the user
+            says they need nothing else, or confirms the order they were shown.
+
+            {output_format}"""),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}")
-        ])
-        
-        # Initialize memory
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-        
+        ]).partial(output_format=COMPACT_OUTPUT_FORMAT if self.compact else FULL_OUTPUT_FORMAT)
+
+        # Chat history is kept per session in the shared memory store
+        self.memory_store = get_memory_store()
+        self.prompt_assembler = PromptAssembler("order_taking_agent", self.system_prompt)
+
         # Create the chain
         self.chain = LLMChain(
             llm=self.client,
             prompt=self.system_prompt,
-            memory=self.memory,
             verbose=True
         )
-        
-        # Initialize output parser
-        self.output_parser = PydanticOutputParser(pydantic_object=OrderResponse)
-    
-    def get_response(self, messages):
+
+    def get_response(self, messages, session_id=None, context=None):
+        messages = deepcopy(messages)
+        combined_input, state, asked_recommendation_before = self.build_input(messages)
+
+        # Get response from the chain
+        chain_response = self.chain.predict(
+            input=combined_input,
+            chat_history=self.prompt_assembler.history(session_id, combined_input)
+        )
+
+        # Parse the response, repairing malformed JSON locally
+        extraction = parse_structured_output("order_taking_agent", chain_response, self.output_schema)
+
+        update = self.order_engine.apply(state, extraction)
+        order = self.order_engine.order_lines(update.state)
+        response = self.order_engine.reply(update)
+        self.memory_store.add_turn(session_id, "order_taking_agent", combined_input, response)
+
+        # Add recommendations if needed
+        if not asked_recommendation_before and len(order) > 0:
+            recommendation_output = self.recommendation_agent.get_recommendations_from_order(
+                messages, order, context
+            )
+            # The engine's reply carries the total and any question to the customer
+            response = f"{response}\n\n{recommendation_output['content']}"
+            asked_recommendation_before = True
+
+        return self.postprocess(order, update.state.step_number, response, asked_recommendation_before)
+
+    async def aget_response(self, messages, session_id=None, context=None):
+        """Async counterpart of get_response"""
         messages = deepcopy(messages)
-        
+        combined_input, state, asked_recommendation_before = self.build_input(messages)
+
+        chain_response = await self.chain.apredict(
+            input=combined_input,
+            chat_history=self.prompt_assembler.history(session_id, combined_input)
+        )
+        extraction = await aparse_structured_output("order_taking_agent", chain_response, self.output_schema)
+
+        update = self.order_engine.apply(state, extraction)
+        order = self.order_engine.order_lines(update.state)
+        response = self.order_engine.reply(update)
+        self.memory_store.add_turn(session_id, "order_taking_agent", combined_input, response)
+
+        if not asked_recommendation_before and len(order) > 0:
+            recommendation_output = await self.recommendation_agent.aget_recommendations_from_order(
+                messages, order, context
+            )
+            # The engine's reply carries the total and any question to the customer
+            response = f"{response}\n\n{recommendation_output['content']}"
+            asked_recommendation_before = True
+
+        return self.postprocess(order, update.state.step_number, response, asked_recommendation_before)
+
+    async def astream_response(self, messages, session_id=None, context=None):
+        """
+        The reply depends on the whole extracted order change, so it is only
+        available once generation finishes and is sent as a single chunk.
+        """
+        response = await self.aget_response(messages, session_id, context)
+        yield {"delta": response["content"]}
+        yield response
+
+    def build_input(self, messages):
+        """
+        Combine the previous order status with the latest user message.
+
+        Args:
+            messages: List of conversation messages
+
+        Returns:
+            tuple: (chain input, OrderState before the message, whether recommendations were given before)
+        """
         # Get previous order status
         last_order_taking_status = ""
         asked_recommendation_before = False
-        
+        state = self.order_engine.state_from_memory(None)
+
         for message_index in range(len(messages)-1, 0, -1):
             message = messages[message_index]
             agent_name = message.get("memory", {}).get("agent", "")
-            
+
             if message["role"] == "assistant" and agent_name == "order_taking_agent":
-                step_number = message["memory"]["step number"]
-                order = message["memory"]["order"]
+                state = self.order_engine.state_from_memory(message["memory"])
                 asked_recommendation_before = message["memory"]["asked_recommendation_before"]
                 last_order_taking_status = f"""
-                Current Status:
-                Step Number: {step_number}
-                Current Order: {order}
+                Current Order: {state.quantities}
+                Last Reply: {message["content"]}
                 """
                 break
-        
+
         # Combine status with user message
         combined_input = f"{last_order_taking_status}\nUser Message: {messages[-1]['content']}"
-        
-        try:
-            # Get response from the chain
-            chain_response = self.chain.predict(input=combined_input)
-            
-            # Parse the response
-            parsed_response = self.output_parser.parse(chain_response)
-            output = self.postprocess(parsed_response, messages, asked_recommendation_before)
-            
-        except Exception as e:
-            # Fallback to JSON parsing if Pydantic parsing fails
-            json_response = double_check_json_output(self.client, os.getenv("GROQ_MODEL_NAME"), chain_response)
-            output = self.postprocess(json.loads(json_response), messages, asked_recommendation_before)
-        
-        return output
-
-    def postprocess(self, output, messages, asked_recommendation_before):
+        return combined_input, state, asked_recommendation_before
+
+    def postprocess(self, order, step_number, response, asked_recommendation_before):
         """
-        Process the output and add recommendations if needed.
-        
+        Format the response with the updated order state.
+
         Args:
-            output: Either OrderResponse object or dict
-            messages: List of conversation messages
+            order: Current order items
+            step_number: Current step in the order process
+            response: Response text for the user
             asked_recommendation_before: Boolean indicating if recommendations were given
-            
+
         Returns:
             dict: Formatted response with role and memory
         """
-        if isinstance(output, OrderResponse):
-            order = [item.dict() for item in output.order]
-            step_number = output.step_number
-            response = output.response
-        else:
-            order = output["order"]
-            step_number = output["step number"]
-            response = output["response"]
-        
-        # Add recommendations if needed
-        if not asked_recommendation_before and len(order) > 0:
-            recommendation_output = self.recommendation_agent.get_recommendations_from_order(
-                messages, order
-            )
-            response = recommendation_output['content']
-            asked_recommendation_before = True
-        
         return {
             "role": "assistant",
             "content": response,
@@ -181,5 +173,3 @@ class OrderTakingAgent:
                 "asked_recommendation_before": asked_recommendation_before
             }
         }
-
-    
\ No newline at end of file
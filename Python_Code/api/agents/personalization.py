@@ -0,0 +1,37 @@
+import json
+import pathlib
+import numpy as np
+
+class CustomerRecommendations:
+    """
+    Precomputed top-N recommendations of every known customer.
+
+    Row customer_id of a memory-mapped .npy file holds the product ids recommended to
+    that customer, padded with -1. A .json file next to it holds the product names.
+    A lookup is one row read, so personalization adds no request latency. Written by
+    training.personalization.
+    """
+    def __init__(self, path):
+        path = pathlib.Path(path)
+        self.recommendations = np.load(path.with_suffix(".npy"), mmap_mode="r")
+        with open(path.with_suffix(".json"), 'r') as file:
+            metadata = json.load(file)
+        self.product_names = metadata["products"]
+        self.version = metadata["version"]
+
+    def recommend(self, customer_id, top_k=5):
+        """
+        Args:
+            customer_id: Loyalty customer id, anonymous customers have none or 0
+            top_k (int): Maximum number of recommendations, None for the whole precomputed row
+
+        Returns:
+            list: Product names, empty for anonymous or unknown customers
+        """
+        try:
+            customer_id = int(customer_id)
+        except (TypeError, ValueError):
+            return []
+        if customer_id <= 0 or customer_id >= self.recommendations.shape[0]:
+            return []
+        return [self.product_names[product] for product in self.recommendations[customer_id, :top_k] if product >= 0]
@@ -0,0 +1,71 @@
+import csv
+import heapq
+from operator import itemgetter
+
+class PopularityIndex:
+    """
+    Popularity rankings precomputed from popularity_recommendation.csv.
+
+    Keeps a global ranking and one ranking per category, both by number of
+    transactions. Rankings for a set of categories are merged once and memoized, so
+    repeated queries are a dictionary lookup.
+    """
+    def __init__(self, rows):
+        """
+        Args:
+            rows (list): (product, product_category, number_of_transactions) tuples
+        """
+        self.rows = list(rows)
+        self.products = [product for product, _, _ in self.rows]
+        self.product_categories = [category for _, category, _ in self.rows]
+
+        ranked = sorted(self.rows, key=itemgetter(2), reverse=True)
+        self.ranking = [product for product, _, _ in ranked]
+
+        # Category -> (negated transactions, product) by popularity, ready to be merged
+        self.category_rankings = {}
+        for product, category, transactions in ranked:
+            self.category_rankings.setdefault(category, []).append((-transactions, product))
+
+        self.merged_rankings = {}
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, 'r', newline='') as file:
+            return cls(
+                (row['product'], row['product_category'], int(float(row['number_of_transactions'])))
+                for row in csv.DictReader(file)
+            )
+
+    @classmethod
+    def from_artifact(cls, artifact):
+        """Rankings of a RecommendationArtifact's popularity rows"""
+        return cls(artifact.popularity_rows())
+
+    def category_ranking(self, product_categories):
+        """Products of the given categories by popularity"""
+        # Unknown categories are dropped so the memo is bounded by the known ones
+        key = frozenset(category for category in product_categories if category in self.category_rankings)
+        ranking = self.merged_rankings.get(key)
+        if ranking is None:
+            rankings = [self.category_rankings[category] for category in key]
+            ranking = [product for _, product in heapq.merge(*rankings)]
+            self.merged_rankings[key] = ranking
+        return ranking
+
+    def recommend(self, product_categories=None, top_k=5):
+        """
+        Most popular products, optionally restricted to some categories.
+
+        Args:
+            product_categories (str or list): Category or categories to recommend from, all if None
+            top_k (int): Maximum number of recommendations
+
+        Returns:
+            list: Product names by number of transactions
+        """
+        if product_categories is None:
+            return self.ranking[:top_k]
+        if isinstance(product_categories, str):
+            product_categories = [product_categories]
+        return self.category_ranking(product_categories)[:top_k]
@@ -0,0 +1,205 @@
+import os
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from langchain.prompts import ChatPromptTemplate
+from langchain.chains import LLMChain
+from langchain.schema import BaseMessage, SystemMessage
+from .memory_store import estimate_tokens, get_memory_store
+from .llm_factory import get_chat_model
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+def template_tokens(prompt):
+    """Tokens of the fixed text of a chat prompt template, partial variables included"""
+    tokens = 0
+    for message in prompt.messages:
+        template = getattr(getattr(message, "prompt", None), "template", None)
+        if template:
+            tokens += estimate_tokens(template)
+    for value in prompt.partial_variables.values():
+        if isinstance(value, str):
+            tokens += estimate_tokens(value)
+    return tokens
+
+class PromptMetrics:
+    """Estimated prompt sizes of each agent"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(lambda: {
+            "calls": 0, "prompt_tokens": 0, "max_prompt_tokens": 0,
+            "history_tokens": 0, "summary_tokens": 0, "dropped_messages": 0
+        })
+
+    def record(self, agent_name, prompt_tokens, history_tokens, summary_tokens, dropped_messages):
+        with self.lock:
+            counters = self.counters[agent_name]
+            counters["calls"] += 1
+            counters["prompt_tokens"] += prompt_tokens
+            counters["max_prompt_tokens"] = max(counters["max_prompt_tokens"], prompt_tokens)
+            counters["history_tokens"] += history_tokens
+            counters["summary_tokens"] += summary_tokens
+            counters["dropped_messages"] += dropped_messages
+
+    def stats(self):
+        with self.lock:
+            stats = {agent_name: dict(counters) for agent_name, counters in self.counters.items()}
+        for counters in stats.values():
+            for key in ("prompt_tokens", "history_tokens", "summary_tokens"):
+                counters[f"mean_{key}"] = counters.pop(key) / counters["calls"]
+        return stats
+
+prompt_metrics = PromptMetrics()
+
+class PromptAssembler:
+    """
+    Chat history of an agent fitted into its prompt token budget.
+
+    The budget covers the whole prompt and is set with <AGENT_NAME>_PROMPT_TOKENS,
+    or PROMPT_TOKEN_BUDGET for every agent. What the fixed prompt text and the input
+    leave of it goes to the history: the rolling summary of the evicted turns first,
+    then the most recent exchanges verbatim. Tokens are estimated locally.
+
+    Exchanges that don't fit are left out of the prompt but stay in the memory store
+    until it evicts them into the summary, so keep <AGENT_NAME>_HISTORY_TOKENS within
+    the budget for every turn to be either verbatim or summarized.
+    """
+    def __init__(self, agent_name, prompt=None, memory_store=None):
+        self.agent_name = agent_name
+        self.memory_store = memory_store or get_memory_store()
+        self.fixed_tokens = template_tokens(prompt) if prompt is not None else 0
+        default = os.getenv("PROMPT_TOKEN_BUDGET", "2000")
+        self.budget = int(os.getenv(f"{agent_name.upper()}_PROMPT_TOKENS", default))
+
+    def history(self, session_id: Optional[str], input_text: str = "", extra_tokens: int = 0) -> List[BaseMessage]:
+        """
+        Messages for the chat_history placeholder of the agent's prompt.
+
+        Args:
+            session_id: Conversation id, None for the default session
+            input_text: Text of the human message of the prompt
+            extra_tokens: Tokens of the other prompt variables, e.g. the product list
+
+        Returns:
+            List of LangChain messages: the summary as a system message, if any,
+            then the recent exchanges, oldest first
+        """
+        available = self.budget - self.fixed_tokens - extra_tokens - estimate_tokens(input_text)
+        messages = self.memory_store.get_messages(session_id, self.agent_name)
+
+        history = []
+        summary_tokens = 0
+        summary = self.memory_store.get_summary(session_id, self.agent_name)
+        if summary:
+            summary_message = SystemMessage(content=SUMMARY_PREFIX + summary)
+            if estimate_tokens(summary_message.content) <= available:
+                summary_tokens = estimate_tokens(summary_message.content)
+                available -= summary_tokens
+                history.append(summary_message)
+
+        # Whole exchanges from the newest, so no answer is kept without its question
+        start = len(messages)
+        history_tokens = 0
+        while start >= 2:
+            tokens = estimate_tokens(messages[start - 2].content) + estimate_tokens(messages[start - 1].content)
+            if history_tokens + tokens > available:
+                break
+            history_tokens += tokens
+            start -= 2
+        history.extend(messages[start:])
+
+        prompt_tokens = self.fixed_tokens + extra_tokens + estimate_tokens(input_text) + summary_tokens + history_tokens
+        prompt_metrics.record(self.agent_name, prompt_tokens, history_tokens, summary_tokens, start)
+        return history
+
+class RollingSummarizer:
+    """
+    Folds the turns evicted from the memory store into the rolling summary of their
+    history. Summaries are written in a background thread, so no request waits on
+    them, one at a time per history so no evicted turn is lost.
+    """
+    def __init__(self, memory_store=None, max_workers=2):
+        self.memory_store = memory_store or get_memory_store()
+        self.max_words = int(os.getenv("SUMMARY_MAX_WORDS", "80"))
+
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", """You keep a running summary of a customer's conversation with a coffee shop assistant.
+            Update the summary with the new messages. Keep what later replies may depend on: items
+            ordered or removed, preferences, questions asked and answers given. Drop greetings and
+            small talk. Answer with the summary only, in at most {max_words} words."""),
+            ("human", "Summary so far:\n{summary}\n\nNew messages:\n{messages}")
+        ]).partial(max_words=str(self.max_words))
+        self.chain = LLMChain(
+            llm=get_chat_model("summary_agent", temperature=0).bind(max_tokens=2 * self.max_words),
+            prompt=self.prompt
+        )
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="summary")
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.folds = 0
+        self.failures = 0
+
+    def submit(self, session_id, namespace, messages):
+        """Queue evicted messages, used as the memory store's eviction_listener"""
+        key = (session_id, namespace)
+        with self.lock:
+            running = key in self.pending
+            self.pending.setdefault(key, []).extend(messages)
+        if not running:
+            self.executor.submit(self._fold, key)
+
+    def _fold(self, key):
+        session_id, namespace = key
+        while True:
+            with self.lock:
+                messages = self.pending[key]
+                if not messages:
+                    del self.pending[key]
+                    return
+                self.pending[key] = []
+            summary = self.memory_store.get_summary(session_id, namespace)
+            try:
+                summary = self.summarize(summary, messages)
+            except Exception as e:
+                logger.warning(f"Could not summarize {namespace} history of session {session_id}: {str(e)}")
+                with self.lock:
+                    self.failures += 1
+                continue
+            self.memory_store.set_summary(session_id, namespace, summary)
+            with self.lock:
+                self.folds += 1
+
+    def summarize(self, summary, messages):
+        transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+        return self.chain.predict(summary=summary or "(empty)", messages=transcript).strip()
+
+    def stats(self):
+        with self.lock:
+            return {"folds": self.folds, "failures": self.failures, "pending_histories": len(self.pending)}
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+
+def enable_rolling_summary(memory_store=None) -> RollingSummarizer:
+    """Fold the turns evicted from the memory store into rolling summaries"""
+    global _summarizer
+    memory_store = memory_store or get_memory_store()
+    with _summarizer_lock:
+        if _summarizer is None:
+            _summarizer = RollingSummarizer(memory_store)
+        memory_store.eviction_listener = _summarizer.submit
+        return _summarizer
+
+def get_prompt_stats():
+    """Estimated prompt sizes per agent and the rolling summary counters"""
+    stats = {"agents": prompt_metrics.stats()}
+    if _summarizer is not None:
+        stats["summaries"] = _summarizer.stats()
+    return stats
@@ -1,44 +1,78 @@
 import json
-import pandas as pd
 import os
-from langchain_groq import ChatGroq
+import logging
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 from copy import deepcopy
 from dotenv import load_dotenv
-from .utils import get_chatbot_response, double_check_json_output
+from .utils import get_chatbot_response, aget_chatbot_response, parse_structured_output, aparse_structured_output, astream_chain
+from .memory_store import get_memory_store, estimate_tokens
+from .prompt_budget import PromptAssembler
+from .apriori_index import AprioriIndex
+from .popularity_index import PopularityIndex
+from .recommendation_artifact import RecommendationArtifact
+from .recommendation_partitions import PartitionedRecommendations
+from .personalization import CustomerRecommendations
+from .catalog import get_catalog
+from .llm_factory import get_chat_model, get_structured_output_model, compact_output_enabled
+from .agent_protocol import CompactOutput
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 class RecommendationType(BaseModel):
     """Schema for recommendation classification"""
     chain_of_thought: str = Field(description="Reasoning about the recommendation type")
     recommendation_type: str = Field(description="Type of recommendation: apriori, popular, or popular by category")
     parameters: List[str] = Field(description="List of items or categories for recommendations")
 
+RECOMMENDATION_TYPE_CODES = {"a": "apriori", "p": "popular", "c": "popular by category"}
+
+class CompactRecommendationType(CompactOutput):
+    """Compact RecommendationType: {"t": "a", "p": ["Latte"]}"""
+    t: Literal["a", "p", "c"] = Field(description="a: apriori, p: popular, c: popular by category")
+    p: List[str] = Field(description="Items or categories for recommendations", default_factory=list)
+
+    def expand(self):
+        return RecommendationType(chain_of_thought="", recommendation_type=RECOMMENDATION_TYPE_CODES[self.t], parameters=self.p)
+
+COMPACT_OUTPUT_FORMAT = """Respond with JSON only: {"t": "a" for apriori, "p" for popular or "c" for popular by category, "p": [the items for apriori or the categories for popular by category]}"""
+
 class RecommendationAgent():
-    def __init__(self,apriori_recommendation_path,popular_recommendation_path):
-        self.client = ChatGroq(
-            model_name=os.getenv("GROQ_MODEL_NAME"),
-            temperature=0.7,
-            groq_api_key=os.getenv("GROQ_API_KEY")
-        )
+    def __init__(self,apriori_recommendation_path,popular_recommendation_path,partitions_path=None,personalization_path=None,artifact_path=None,compact=None):
+        self.client = get_chat_model("recommendation_agent", temperature=0.7)
         self.model_name = os.getenv("MODEL_NAME")
 
-        with open(apriori_recommendation_path, 'r') as file:
-            self.apriori_recommendations = json.load(file)
+        # Compact classification outputs skip the reasoning, see COMPACT_OUTPUT in llm_factory
+        self.compact = compact_output_enabled("recommendation_agent") if compact is None else compact
+        self.classification_schema = CompactRecommendationType if self.compact else RecommendationType
+        self.classification_client = get_structured_output_model("recommendation_agent", temperature=0.7, compact=self.compact)
+
+        if artifact_path:
+            # Memory-mapped binary form of both artifacts below, shared by the worker processes
+            artifact = RecommendationArtifact(artifact_path)
+            self.apriori_index = AprioriIndex.from_artifact(artifact)
+            self.popularity_index = PopularityIndex.from_artifact(artifact)
+        else:
+            with open(apriori_recommendation_path, 'r') as file:
+                self.apriori_index = AprioriIndex(json.load(file))
+            self.popularity_index = PopularityIndex.from_csv(popular_recommendation_path)
+        self.products = self.popularity_index.products
+        self.product_categories = self.popularity_index.product_categories
 
-        self.popular_recommendations = pd.read_csv(popular_recommendation_path)
-        self.products = self.popular_recommendations['product'].tolist()
-        self.product_categories = self.popular_recommendations['product_category'].tolist()
+        # Models per outlet and time of day, the global ones above are the fallback
+        self.partitions = PartitionedRecommendations(partitions_path) if partitions_path else None
+        # Per-customer top-N, anonymous customers get the popularity models
+        self.personalization = CustomerRecommendations(personalization_path) if personalization_path else None
+        self.personalization_categories = dict(zip(self.products, self.product_categories))
     
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
+        # Resolves the product names of orders and classifications to the artifacts' names
+        self.catalog = get_catalog()
+
+        # Chat history is kept per session in the shared memory store
+        self.memory_store = get_memory_store()
         
         self.classification_prompt = ChatPromptTemplate.from_messages([
             ("system", """You are a helpful AI assistant for a coffee shop application which serves drinks and pastries. We have 3 types of recommendations:
@@ -47,14 +81,18 @@ class RecommendationAgent():
             2. Popular Recommendations: Based on overall popularity of items in the coffee shop
             3. Popular Recommendations by Category: Based on popularity within specific categories
             
-            Available Products: {products}
             Available Categories: {categories}
             
-            Determine the recommendation type based on the user's message.
+            Determine the recommendation type based on the user's message. Name items as the
+            user did, they are matched against the menu.
+            {output_format}
             """),
             MessagesPlaceholder(variable_name="chat_history"),
             ("human", "{input}")
-        ])
+        ]).partial(
+            categories=", ".join(dict.fromkeys(self.product_categories)),
+            output_format=COMPACT_OUTPUT_FORMAT if self.compact else ""
+        )
         
         self.response_prompt = ChatPromptTemplate.from_messages([
             ("system", """You are a helpful AI assistant for a coffee shop application.
@@ -67,131 +105,180 @@ class RecommendationAgent():
             ("human", "{input}")
         ])
         
+        # Both prompts share the agent's history, each within its own token budget
+        self.classification_assembler = PromptAssembler("recommendation_agent", self.classification_prompt)
+        self.response_assembler = PromptAssembler("recommendation_agent", self.response_prompt)
+        
         self.classification_chain = LLMChain(
-            llm=self.client,
+            llm=self.classification_client,
             prompt=self.classification_prompt,
-            memory=self.memory,
             verbose=True
         )
         
         self.response_chain = LLMChain(
             llm=self.client,
             prompt=self.response_prompt,
-            memory=self.memory,
             verbose=True
         )
-        
-        self.output_parser = PydanticOutputParser(pydantic_object=RecommendationType)
 
-    def get_apriori_recommendation(self,products,top_k=5):
-        recommendation_list = []
-        for product in products:
-            if product in self.apriori_recommendations:
-                recommendation_list += self.apriori_recommendations[product]
-        
-        # Sort recommendation list by "confidence"
-        recommendation_list = sorted(recommendation_list,key=lambda x: x['confidence'],reverse=True)
+    def get_apriori_recommendation(self,products,top_k=5,context=None):
+        products = self.canonical_products(products)
+        partition = self.get_partition(context)
+        if partition is not None:
+            recommendations = partition[0].recommend(products, top_k=top_k)
+            if recommendations:
+                return recommendations
+        return self.apriori_index.recommend(products, top_k=top_k)
 
+    def get_popular_recommendation(self,product_categories=None,top_k=5,context=None):
+        personalized = self.get_personalized_recommendation(product_categories, top_k=top_k, context=context)
+        if len(personalized) >= top_k:
+            return personalized
+        # Customer rows are short, so the popular products fill up the rest
+        fill_k = top_k + len(personalized)
         recommendations = []
-        recommendations_per_category = {}
-        for recommendation in recommendation_list:
-            # If Duplicated recommendations then skip
-            if recommendation in recommendations:
-                continue 
-
-            # Limit 2 recommendations per category
-            product_catory = recommendation['product_category']
-            if product_catory not in recommendations_per_category:
-                recommendations_per_category[product_catory] = 0
-            
-            if recommendations_per_category[product_catory] >= 2:
-                continue
-
-            recommendations_per_category[product_catory]+=1
+        partition = self.get_partition(context)
+        if partition is not None:
+            recommendations = partition[1].recommend(product_categories, top_k=fill_k)
+        if not recommendations:
+            recommendations = self.popularity_index.recommend(product_categories, top_k=fill_k)
+        seen = set(personalized)
+        return (personalized + [product for product in recommendations if product not in seen])[:top_k]
 
-            # Add recommendation
-            recommendations.append(recommendation['product'])
+    def canonical_products(self, products):
+        """Names of the recommendation artifacts for product mentions, unknown ones kept as they are"""
+        canonical = []
+        for product in products:
+            item = self.catalog.resolve(product)
+            canonical.append(item.product if item is not None else product)
+        return canonical
 
-            if len(recommendations) >= top_k:
-                break
+    def get_personalized_recommendation(self,product_categories=None,top_k=5,context=None):
+        """Precomputed recommendations of the context's customer_id, empty for anonymous or unknown customers"""
+        if self.personalization is None or not context or context.get("customer_id") is None:
+            return []
+        # Filter the whole row, slicing first could leave fewer than top_k products of the categories
+        recommendations = self.personalization.recommend(context["customer_id"], top_k=None)
+        if product_categories:
+            categories = set(product_categories)
+            recommendations = [product for product in recommendations if self.personalization_categories.get(product) in categories]
+        return recommendations[:top_k]
 
-        return recommendations 
+    def get_partition(self, context):
+        """(AprioriIndex, PopularityIndex) of the request context, None to use the global models"""
+        if self.partitions is None or not context:
+            return None
+        try:
+            return self.partitions.resolve(context)
+        except (ValueError, TypeError, AttributeError) as e:
+            logger.warning(f"Ignoring invalid recommendation context {context}: {str(e)}")
+            return None
 
-    def get_popular_recommendation(self,product_categories=None,top_k=5):
-        recommendations_df = self.popular_recommendations
+    def recommendation_classification(self, messages, session_id=None):
+        """Classify the type of recommendation needed"""
+        # Get response from classification chain
+        chain_response = self.classification_chain.predict(**self.classification_inputs(messages, session_id))
         
-        if type(product_categories) == str:
-            product_categories = [product_categories]
+        # Parse the response, repairing malformed JSON locally
+        return self.parse_classification(parse_structured_output("recommendation_agent", chain_response, self.classification_schema))
 
-        if product_categories is not None:
-            recommendations_df = self.popular_recommendations[self.popular_recommendations['product_category'].isin(product_categories)]
-        recommendations_df = recommendations_df.sort_values(by='number_of_transactions',ascending=False)
-        
-        if recommendations_df.shape[0] == 0:
-            return []
+    async def arecommendation_classification(self, messages, session_id=None):
+        """Async counterpart of recommendation_classification"""
+        chain_response = await self.classification_chain.apredict(**self.classification_inputs(messages, session_id))
+        return self.parse_classification(await aparse_structured_output("recommendation_agent", chain_response, self.classification_schema))
 
-        recommendations = recommendations_df['product'].tolist()[:top_k]
-        return recommendations
+    def classification_inputs(self, messages, session_id=None):
+        return {
+            "input": messages[-1]['content'],
+            "chat_history": self.classification_assembler.history(session_id, messages[-1]['content'])
+        }
 
-    def recommendation_classification(self, messages):
-        """Classify the type of recommendation needed"""
-        try:
-            # Get response from classification chain
-            chain_response = self.classification_chain.predict(
-                input=messages[-1]['content'],
-                products=", ".join(self.products),
-                categories=", ".join(self.product_categories)
-            )
-            
-            # Parse the response
-            parsed_response = self.output_parser.parse(chain_response)
-            return {
-                "recommendation_type": parsed_response.recommendation_type,
-                "parameters": parsed_response.parameters
-            }
-            
-        except Exception as e:
-            # Fallback to JSON parsing if Pydantic parsing fails
-            json_response = double_check_json_output(
-                self.client,
-                os.getenv("GROQ_MODEL_NAME"),
-                chain_response
+    def response_inputs(self, messages, recommendations, session_id=None):
+        recommendations = ", ".join(recommendations)
+        return {
+            "input": messages[-1]['content'],
+            "recommendations": recommendations,
+            "chat_history": self.response_assembler.history(
+                session_id, messages[-1]['content'], extra_tokens=estimate_tokens(recommendations)
             )
-            return json.loads(json_response)
+        }
 
-    def get_response(self, messages):
+    def parse_classification(self, parsed_response):
+        return {
+            "recommendation_type": parsed_response.recommendation_type,
+            "parameters": parsed_response.parameters
+        }
+
+    def get_response(self, messages, session_id=None, context=None):
         """Get recommendation response"""
         messages = deepcopy(messages)
         
         # Get recommendation classification
-        classification = self.recommendation_classification(messages)
+        classification = self.recommendation_classification(messages, session_id)
+        recommendations = self.get_recommendations_for_classification(classification, context)
+        
+        if not recommendations:
+            return self.no_recommendation_response()
+        
+        # Generate response using response chain
+        response = self.response_chain.predict(**self.response_inputs(messages, recommendations, session_id))
+        self.memory_store.add_turn(session_id, "recommendation_agent", messages[-1]['content'], response)
+        
+        return self.postprocess(response)
+
+    async def aget_response(self, messages, session_id=None, context=None):
+        """Async counterpart of get_response"""
+        messages = deepcopy(messages)
+        
+        classification = await self.arecommendation_classification(messages, session_id)
+        recommendations = self.get_recommendations_for_classification(classification, context)
+        
+        if not recommendations:
+            return self.no_recommendation_response()
+        
+        response = await self.response_chain.apredict(**self.response_inputs(messages, recommendations, session_id))
+        self.memory_store.add_turn(session_id, "recommendation_agent", messages[-1]['content'], response)
+        
+        return self.postprocess(response)
+
+    async def astream_response(self, messages, session_id=None, context=None):
+        """Stream the recommendation tokens, then yield the full response"""
+        messages = deepcopy(messages)
+        
+        classification = await self.arecommendation_classification(messages, session_id)
+        recommendations = self.get_recommendations_for_classification(classification, context)
+        
+        if not recommendations:
+            response = self.no_recommendation_response()
+            yield {"delta": response["content"]}
+            yield response
+            return
+        
+        response = ""
+        async for token in astream_chain(self.response_chain, **self.response_inputs(messages, recommendations, session_id)):
+            response += token
+            yield {"delta": token}
+        self.memory_store.add_turn(session_id, "recommendation_agent", messages[-1]['content'], response)
+        
+        yield self.postprocess(response)
+
+    def get_recommendations_for_classification(self, classification, context=None):
+        """Get recommendations based on the classified recommendation type"""
         recommendation_type = classification['recommendation_type']
         
-        # Get recommendations based on type
         recommendations = []
         if recommendation_type == "apriori":
-            recommendations = self.get_apriori_recommendation(classification['parameters'])
+            recommendations = self.get_apriori_recommendation(classification['parameters'], context=context)
         elif recommendation_type == "popular":
-            recommendations = self.get_popular_recommendation()
+            recommendations = self.get_popular_recommendation(context=context)
         elif recommendation_type == "popular by category":
-            recommendations = self.get_popular_recommendation(classification['parameters'])
-        
-        if not recommendations:
-            return {
-                "role": "assistant",
-                "content": "Sorry, I can't help with that. Can I help you with your order?",
-                "memory": {"agent": "recommendation_agent"}
-            }
-        
-        # Generate response using response chain
-        response = self.response_chain.predict(
-            input=messages[-1]['content'],
-            recommendations=", ".join(recommendations)
-        )
-        
+            recommendations = self.get_popular_recommendation(classification['parameters'], context=context)
+        return recommendations
+
+    def no_recommendation_response(self):
         return {
             "role": "assistant",
-            "content": response,
+            "content": "Sorry, I can't help with that. Can I help you with your order?",
             "memory": {"agent": "recommendation_agent"}
         }
 
@@ -204,12 +291,28 @@ class RecommendationAgent():
         }
         return dict_output
 
-    def get_recommendations_from_order(self,messages,order):
+    def get_recommendations_from_order(self,messages,order,context=None):
+        input_messages = self.build_order_recommendation_messages(messages,order,context)
+
+        chatbot_output =get_chatbot_response(self.client,self.model_name,input_messages)
+        output = self.postprocess(chatbot_output)
+
+        return output
+
+    async def aget_recommendations_from_order(self,messages,order,context=None):
+        """Async counterpart of get_recommendations_from_order"""
+        input_messages = self.build_order_recommendation_messages(messages,order,context)
+
+        chatbot_output = await aget_chatbot_response(self.client,self.model_name,input_messages)
+        return self.postprocess(chatbot_output)
+
+    def build_order_recommendation_messages(self,messages,order,context=None):
+        messages = deepcopy(messages)
         products = []
         for product in order:
             products.append(product['item'])
 
-        recommendations = self.get_apriori_recommendation(products)
+        recommendations = self.get_apriori_recommendation(products, context=context)
         recommendations_str = ", ".join(recommendations)
 
         system_prompt = f"""
@@ -226,12 +329,7 @@ class RecommendationAgent():
         """
 
         messages[-1]['content'] = prompt
-        input_messages = [{"role": "system", "content": system_prompt}] + messages[-3:]
-
-        chatbot_output =get_chatbot_response(self.client,self.model_name,input_messages)
-        output = self.postprocess(chatbot_output)
-
-        return output
+        return [{"role": "system", "content": system_prompt}] + messages[-3:]
     
     def postprocess(self,output):
         output = {
@@ -0,0 +1,155 @@
+import mmap
+import zlib
+import struct
+import numpy as np
+
+MAGIC = b"CSRA"
+VERSION = 1
+
+# magic, version, reserved, strings, string bytes, antecedents, antecedent items, rules, popularity rows, crc32 of the body
+HEADER = struct.Struct("<4sHHIIIIIII")
+
+class ArtifactError(ValueError):
+    """Raised when a recommendation artifact is truncated, corrupted or of an unknown version"""
+
+def _sections(counts):
+    """(name, dtype, length) of the body sections, in file order"""
+    strings, string_bytes, antecedents, antecedent_items, rules, popularity = counts
+    return (
+        ("string_offsets", np.uint32, strings + 1),
+        ("string_data", np.uint8, string_bytes),
+        ("antecedent_offsets", np.uint32, antecedents + 1),
+        ("antecedent_items", np.uint32, antecedent_items),
+        ("rule_offsets", np.uint32, antecedents + 1),
+        ("rule_products", np.uint32, rules),
+        ("rule_categories", np.uint32, rules),
+        ("rule_confidences", np.float64, rules),
+        ("popularity_products", np.uint32, popularity),
+        ("popularity_categories", np.uint32, popularity),
+        ("popularity_transactions", np.uint32, popularity),
+    )
+
+def _padding(size):
+    # Sections start 8-byte aligned so every array can be viewed in place
+    return -size % 8
+
+def pack_recommendations(rules, popularity_rows):
+    """
+    Serialize the recommendation models to the binary artifact format.
+
+    Args:
+        rules (dict): Antecedent key -> [{product, product_category, confidence}], as in apriori_recommendations.json
+        popularity_rows (list): (product, product_category, number_of_transactions) tuples
+
+    Returns:
+        bytes: Header followed by a string table and fixed-width arrays
+    """
+    strings = {}
+    def intern(name):
+        return strings.setdefault(name, len(strings))
+
+    antecedent_offsets, antecedent_items = [0], []
+    rule_offsets, rule_products, rule_categories, rule_confidences = [0], [], [], []
+    for key, recommendations in rules.items():
+        antecedent_items.extend(intern(item) for item in key.split("_"))
+        antecedent_offsets.append(len(antecedent_items))
+        for recommendation in sorted(recommendations, key=lambda x: x['confidence'], reverse=True):
+            rule_products.append(intern(recommendation['product']))
+            rule_categories.append(intern(recommendation['product_category']))
+            rule_confidences.append(recommendation['confidence'])
+        rule_offsets.append(len(rule_products))
+
+    popularity_rows = list(popularity_rows)
+    popularity_products = [intern(product) for product, _, _ in popularity_rows]
+    popularity_categories = [intern(category) for _, category, _ in popularity_rows]
+    popularity_transactions = [transactions for _, _, transactions in popularity_rows]
+
+    encoded = [name.encode("utf-8") for name in strings]
+    string_offsets = np.cumsum([0] + [len(name) for name in encoded])
+    arrays = {
+        "string_offsets": string_offsets,
+        "string_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "antecedent_offsets": antecedent_offsets,
+        "antecedent_items": antecedent_items,
+        "rule_offsets": rule_offsets,
+        "rule_products": rule_products,
+        "rule_categories": rule_categories,
+        "rule_confidences": rule_confidences,
+        "popularity_products": popularity_products,
+        "popularity_categories": popularity_categories,
+        "popularity_transactions": popularity_transactions,
+    }
+    counts = (len(strings), int(string_offsets[-1]), len(rules), len(antecedent_items), len(rule_products), len(popularity_rows))
+
+    body = bytearray()
+    for name, dtype, length in _sections(counts):
+        data = np.asarray(arrays[name], dtype=dtype).tobytes()
+        body += data + bytes(_padding(len(data)))
+
+    return HEADER.pack(MAGIC, VERSION, 0, *counts, zlib.crc32(body)) + bytes(body)
+
+class RecommendationArtifact:
+    """
+    Memory-mapped view of a binary recommendation artifact.
+
+    The file starts with a fixed header, followed by a string table (offsets and UTF-8
+    bytes) of the product and category names, the antecedents as string ids, and the
+    rules and popularity rows as fixed-width arrays of string ids, confidences and
+    transaction counts. The arrays are numpy views of the mapped file, so worker
+    processes loading the same artifact share its pages instead of each parsing it
+    onto its own heap.
+    """
+    def __init__(self, path, verify=True):
+        with open(path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.buffer) < HEADER.size:
+            raise ArtifactError(f"{path} is too short to be a recommendation artifact")
+        magic, version, _, *counts, checksum = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ArtifactError(f"{path} is not a recommendation artifact")
+        if version != VERSION:
+            raise ArtifactError(f"{path} has artifact version {version}, expected {VERSION}")
+
+        offset = HEADER.size
+        for name, dtype, length in _sections(counts):
+            size = np.dtype(dtype).itemsize * length
+            if offset + size > len(self.buffer):
+                raise ArtifactError(f"{path} is truncated")
+            setattr(self, name, np.frombuffer(self.buffer, dtype=dtype, count=length, offset=offset))
+            offset += size + _padding(size)
+
+        if verify and zlib.crc32(memoryview(self.buffer)[HEADER.size:offset]) != checksum:
+            raise ArtifactError(f"{path} failed its checksum")
+
+        self.version = version
+        self.checksum = checksum
+        self.strings = self._decode_strings()
+
+    def _decode_strings(self):
+        data = self.string_data.tobytes()
+        offsets = self.string_offsets.tolist()
+        return [data[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])]
+
+    def __len__(self):
+        """Number of antecedents"""
+        return len(self.antecedent_offsets) - 1
+
+    def antecedent(self, index):
+        """Item names of an antecedent"""
+        start, end = self.antecedent_offsets[index], self.antecedent_offsets[index + 1]
+        return [self.strings[item] for item in self.antecedent_items[start:end].tolist()]
+
+    def rules(self, index):
+        """(product ids, category ids, confidences) arrays of an antecedent, by confidence"""
+        start, end = self.rule_offsets[index], self.rule_offsets[index + 1]
+        return self.rule_products[start:end], self.rule_categories[start:end], self.rule_confidences[start:end]
+
+    def popularity_rows(self):
+        """(product, product_category, number_of_transactions) tuples"""
+        return [
+            (self.strings[product], self.strings[category], transactions)
+            for product, category, transactions in zip(
+                self.popularity_products.tolist(), self.popularity_categories.tolist(), self.popularity_transactions.tolist()
+            )
+        ]
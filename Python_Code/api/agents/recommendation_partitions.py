@@ -0,0 +1,110 @@
+import json
+import logging
+from datetime import datetime
+from .apriori_index import AprioriIndex
+from .popularity_index import PopularityIndex
+
+logger = logging.getLogger(__name__)
+
+# (name, first hour, end hour) of each part of the day
+DAYPARTS = (("morning", 0, 11), ("afternoon", 11, 16), ("evening", 16, 24))
+
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+def daypart(hour):
+    for name, start, end in DAYPARTS:
+        if start <= hour < end:
+            return name
+    raise ValueError(f"Invalid hour: {hour}")
+
+def partition_keys(outlet_id=None, when=None):
+    """
+    Partitions a context belongs to, most specific first.
+
+    Args:
+        outlet_id: Sales outlet id, or None if unknown
+        when (datetime): Time of the request, or None if unknown
+
+    Returns:
+        list: Partition keys, e.g. ["outlet=3&daypart=morning", "outlet=3", "daypart=morning", "weekday=monday"]
+    """
+    keys = []
+    part = daypart(when.hour) if when is not None else None
+    if outlet_id is not None and part is not None:
+        keys.append(f"outlet={outlet_id}&daypart={part}")
+    if outlet_id is not None:
+        keys.append(f"outlet={outlet_id}")
+    if part is not None:
+        keys.append(f"daypart={part}")
+    if when is not None:
+        keys.append(f"weekday={WEEKDAYS[when.weekday()]}")
+    return keys
+
+def parse_context(context):
+    """
+    Read the recommendation context of a job.
+
+    Args:
+        context (dict): {"outlet_id": 3, "time": "2019-04-01T08:30:00"}, both optional.
+                        The time defaults to now when an outlet is given.
+
+    Returns:
+        tuple: (outlet_id, datetime), either may be None
+    """
+    if not context:
+        return None, None
+    outlet_id = context.get("outlet_id")
+    when = context.get("time")
+    if when is not None:
+        when = datetime.fromisoformat(when)
+    elif outlet_id is not None:
+        when = datetime.now()
+    return (str(outlet_id) if outlet_id is not None else None), when
+
+class PartitionedRecommendations:
+    """
+    Recommendation models trained per outlet, part of the day and weekday.
+
+    Loaded from the recommendation_partitions.json file written by
+    training.partitions. Every partition gets its own AprioriIndex and
+    PopularityIndex, and a context resolves to the most specific partition with
+    enough baskets through a few dictionary lookups.
+    """
+    def __init__(self, path, min_baskets=None):
+        with open(path, 'r') as file:
+            artifact = json.load(file)
+
+        products = artifact["products"]
+        categories = artifact["categories"]
+        self.min_baskets = min_baskets if min_baskets is not None else artifact["min_baskets"]
+
+        self.partitions = {}
+        for key, partition in artifact["partitions"].items():
+            if partition["baskets"] < self.min_baskets:
+                continue
+            rules = {
+                antecedent: [
+                    {"product": products[product], "product_category": categories[category], "confidence": confidence}
+                    for product, category, confidence in recommendations
+                ]
+                for antecedent, recommendations in partition["rules"].items()
+            }
+            popularity = [(products[product], categories[category], count) for product, category, count in partition["popularity"]]
+            self.partitions[key] = (AprioriIndex(rules), PopularityIndex(popularity))
+
+        logger.info(f"Loaded {len(self.partitions)} recommendation partitions")
+
+    def resolve(self, context):
+        """
+        Models for a request context.
+
+        Returns:
+            tuple: (AprioriIndex, PopularityIndex) of the most specific partition, or None
+                   when no partition applies and the global models should be used
+        """
+        outlet_id, when = parse_context(context)
+        for key in partition_keys(outlet_id, when):
+            partition = self.partitions.get(key)
+            if partition is not None:
+                return partition
+        return None
@@ -0,0 +1,187 @@
+import os
+import json
+import hashlib
+import logging
+import pathlib
+import threading
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+DEFAULT_INDEX_PATH = folder_path.parent / "vector_index" / "details_index"
+
+class PineconeRetriever:
+    """Retrieval from the hosted Pinecone index built by build_vector_database.ipynb"""
+    def __init__(self, index_name=None, namespace="ns1"):
+        from pinecone import Pinecone as PineconeClient
+
+        self.pc = PineconeClient(api_key=os.getenv("PINECONE_API_KEY"))
+        self.index_name = index_name or os.getenv("PINECONE_INDEX_NAME")
+        self.namespace = namespace
+
+    def query(self, vector, top_k=2):
+        index = self.pc.Index(self.index_name)
+        return index.query(
+            namespace=self.namespace,
+            vector=vector,
+            top_k=top_k,
+            include_values=False,
+            include_metadata=True
+        )
+
+class LocalVectorIndex:
+    """
+    In-process retrieval over a small corpus.
+
+    The embeddings are stored in a memory-mapped .npy file next to a .json file with
+    the document ids and texts. Queries are brute-force dot products, which is exact
+    and fast for a few thousand documents. Results have the same matches/metadata.text
+    shape as Pinecone's.
+
+    The .json file is swapped in last when the index is rebuilt, so a change of its
+    modification time reloads the index on the next query or version check.
+    """
+    def __init__(self, index_path=None):
+        self.index_path = pathlib.Path(index_path or DEFAULT_INDEX_PATH)
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.snapshot = self._load()
+
+    def _load(self):
+        """(embeddings, ids, texts, version) read from the index files"""
+        mtime = os.stat(self.index_path.with_suffix(".json")).st_mtime_ns
+        embeddings = np.load(self.index_path.with_suffix(".npy"), mmap_mode="r")
+        with open(self.index_path.with_suffix(".json"), 'r') as file:
+            metadata = json.load(file)
+
+        if len(metadata["ids"]) != embeddings.shape[0]:
+            raise ValueError(f"Index {self.index_path} has {embeddings.shape[0]} vectors but {len(metadata['ids'])} documents")
+        self.mtime = mtime
+        return embeddings, metadata["ids"], metadata["texts"], metadata["version"]
+
+    def refresh(self):
+        """Reload the index if its files were rebuilt, keeping the loaded one if the new one can't be read"""
+        try:
+            mtime = os.stat(self.index_path.with_suffix(".json")).st_mtime_ns
+        except OSError:
+            return self.snapshot
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    try:
+                        self.snapshot = self._load()
+                        logger.info(f"Reloaded local index {self.index_path}, version {self.snapshot[3]}")
+                    except (OSError, ValueError) as e:
+                        # Caught between the swaps of the two files, retried on the next query
+                        logger.warning(f"Keeping the loaded index, could not reload {self.index_path}: {str(e)}")
+        return self.snapshot
+
+    @property
+    def version(self):
+        return self.refresh()[3]
+
+    def query(self, vector, top_k=2):
+        embeddings, ids, texts, _ = self.refresh()
+        scores = embeddings @ np.asarray(vector, dtype=embeddings.dtype)
+        top_k = min(top_k, len(scores))
+        if top_k < len(scores):
+            candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            candidates = np.arange(len(scores))
+        ranking = candidates[np.argsort(-scores[candidates])]
+
+        return {
+            "matches": [
+                {
+                    "id": ids[i],
+                    "score": float(scores[i]),
+                    "metadata": {"text": texts[i]}
+                }
+                for i in ranking
+            ]
+        }
+
+    @staticmethod
+    def build(documents, embedding_model, index_path=None):
+        """
+        Embed documents and write the index files.
+
+        Args:
+            documents: List of (id, text) tuples
+            embedding_model: Model with an embed_documents method returning normalized vectors
+            index_path: Path of the index without suffix
+        """
+        index_path = pathlib.Path(index_path or DEFAULT_INDEX_PATH)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+
+        ids = [document_id for document_id, _ in documents]
+        texts = [text for _, text in documents]
+        embeddings = np.asarray(embedding_model.embed_documents(texts), dtype=np.float32)
+        version = hashlib.sha1("\x00".join(texts).encode()).hexdigest()[:16]
+
+        # Write both files before swapping them in so readers never see a half-built index
+        tmp_npy = index_path.with_name(index_path.name + ".tmp.npy")
+        tmp_json = index_path.with_name(index_path.name + ".tmp.json")
+        np.save(tmp_npy, embeddings)
+        with open(tmp_json, 'w') as file:
+            json.dump({"ids": ids, "texts": texts, "version": version}, file)
+        os.replace(tmp_npy, index_path.with_suffix(".npy"))
+        os.replace(tmp_json, index_path.with_suffix(".json"))
+
+        logger.info(f"Built local index with {len(ids)} documents at {index_path}")
+
+def load_corpus(products_folder=None):
+    """
+    Documents indexed for the details agent, built the same way as in
+    build_vector_database.ipynb.
+
+    Returns:
+        list: (id, text) tuples
+    """
+    products_folder = pathlib.Path(products_folder or folder_path.parent.parent / "products")
+
+    texts = []
+    with open(products_folder / "products.jsonl", 'r') as file:
+        for line in file:
+            if not line.strip():
+                continue
+            product = json.loads(line)
+            texts.append(
+                f"{product['name']} : {product['description']}"
+                f" -- Ingredients: {product['ingredients']}"
+                f" -- Price: {product['price']}"
+                f" -- rating: {product['rating']}"
+            )
+
+    with open(products_folder / "Merry's_way_about_us.txt", 'r') as file:
+        texts.append("Coffee shop Merry's Way about section: " + file.read())
+
+    with open(products_folder / "menu_items_text.txt", 'r') as file:
+        texts.append("Menu Items: " + file.read())
+
+    return [(text.split(":")[0].strip(), text) for text in texts]
+
+def get_retriever():
+    """Retrieval backend selected by DETAILS_RETRIEVAL_BACKEND ("pinecone" or "local")"""
+    backend = os.getenv("DETAILS_RETRIEVAL_BACKEND", "pinecone").lower()
+    if backend == "local":
+        return LocalVectorIndex(os.getenv("LOCAL_INDEX_PATH"))
+    if backend == "pinecone":
+        return PineconeRetriever()
+    raise ValueError(f"Unknown retrieval backend: {backend}")
+
+if __name__ == "__main__":
+    # Build the local index: python -m agents.retrieval [products folder]
+    import sys
+    from .embeddings import get_embedding_service
+
+    embedding_model = get_embedding_service(os.getenv("HF_EMBEDDING_MODEL"), 'cpu')
+    LocalVectorIndex.build(
+        load_corpus(sys.argv[1] if len(sys.argv) > 1 else None),
+        embedding_model,
+        os.getenv("LOCAL_INDEX_PATH")
+    )
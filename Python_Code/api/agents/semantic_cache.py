@@ -0,0 +1,125 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+def corpus_fingerprint(paths):
+    """
+    Version of the documents behind an index, changes whenever one of the files does.
+
+    Args:
+        paths: Files the corpus is built from, missing files are ignored
+
+    Returns:
+        str: Short hash of the files' sizes and modification times
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+class SemanticCache:
+    """
+    Answer cache keyed on the query embedding.
+
+    A lookup returns the answer of the most similar cached query when its cosine
+    similarity is above the threshold. Entries expire after a TTL, the least recently
+    used ones are evicted past max_entries, and the whole cache is dropped when the
+    corpus version changes.
+    """
+    def __init__(self, threshold=None, ttl_seconds=None, max_entries=None):
+        self.threshold = threshold if threshold is not None else float(os.getenv("DETAILS_CACHE_THRESHOLD", "0.92"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("DETAILS_CACHE_TTL_SECONDS", "86400"))
+        self.max_entries = max_entries or int(os.getenv("DETAILS_CACHE_MAX_ENTRIES", "512"))
+
+        self.entries = OrderedDict()
+        self.matrix = None
+        self.keys = []
+        self.corpus_version = None
+        self.next_key = 0
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, embedding):
+        """
+        Find a cached answer for a query.
+
+        Args:
+            embedding (list): Normalized query embedding
+
+        Returns:
+            str: The cached answer, or None on a miss
+        """
+        query = np.asarray(embedding, dtype=np.float32)
+        with self.lock:
+            self._evict_expired()
+            if self.entries:
+                if self.matrix is None:
+                    self.keys = list(self.entries.keys())
+                    self.matrix = np.stack([self.entries[key][0] for key in self.keys])
+                scores = self.matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    key = self.keys[best]
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key][1]
+            self.misses += 1
+            return None
+
+    def add(self, embedding, answer):
+        """Cache the answer of a query"""
+        with self.lock:
+            self.entries[self.next_key] = (np.asarray(embedding, dtype=np.float32), answer, time.monotonic())
+            self.next_key += 1
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.matrix = None
+
+    def ensure_version(self, corpus_version):
+        """Drop every entry when the corpus has been rebuilt since they were cached"""
+        with self.lock:
+            if corpus_version != self.corpus_version:
+                if self.corpus_version is not None:
+                    logger.info(f"Corpus changed to {corpus_version}, clearing semantic cache")
+                self.corpus_version = corpus_version
+                self._clear()
+
+    def invalidate(self):
+        with self.lock:
+            self._clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0
+            }
+
+    def _clear(self):
+        self.entries.clear()
+        self.matrix = None
+
+    def _evict_expired(self):
+        deadline = time.monotonic() - self.ttl_seconds
+        expired = [key for key, (_, _, created) in self.entries.items() if created < deadline]
+        for key in expired:
+            del self.entries[key]
+        if expired:
+            self.matrix = None
@@ -1,43 +1,41 @@
-from sentence_transformers import SentenceTransformer
-from langchain_groq import ChatGroq
 from langchain.schema import HumanMessage, AIMessage
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain_community.embeddings import HuggingFaceEmbeddings
+from .llm_factory import get_chat_model
+from .embeddings import get_embedding_service
+from .json_repair import JSONRepairError, loads_tolerant, parse_model, repair_stats
+from .agent_protocol import CompactOutput
 import os
+import json
+import logging
+from functools import lru_cache
 from dotenv import load_dotenv
-import torch
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=None)
 def get_available_device():
     """
     Detect and return the best available device for model inference.
     Returns:
         str: 'cuda' for NVIDIA GPU, 'mps' for Apple Silicon, 'cpu' for CPU
     """
+    # Imported here so that importing the agents does not load torch
+    import torch
+
     if torch.cuda.is_available():
         return 'cuda'
     elif torch.backends.mps.is_available():
         return 'mps'
     return 'cpu'
 
-def get_chatbot_response(client, model_name, messages, temperature=0):
-    # Initialize LangChain chat model with Groq
-    chat_model = ChatGroq(
-        model_name=os.getenv("GROQ_MODEL_NAME"),
-        temperature=temperature,
-        groq_api_key=os.getenv("GROQ_API_KEY")
-    )
-    
-    # Convert messages to LangChain format
-    lc_messages = [
-        HumanMessage(content=msg["content"]) if msg["role"] == "user" 
-        else AIMessage(content=msg["content"])
-        for msg in messages
-    ]
+@lru_cache(maxsize=None)
+def _build_chatbot_chain(temperature=0):
+    # Shared chat model from the client factory
+    chat_model = get_chat_model("chatbot_response", temperature=temperature)
     
     # Create a prompt template
     prompt = ChatPromptTemplate.from_messages([
@@ -46,24 +44,40 @@ def get_chatbot_response(client, model_name, messages, temperature=0):
         ("human", "{input}")
     ])
     
-    # Initialize memory
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True
-    )
-    
-    # Create chain
-    chain = LLMChain(
+    # Built once and reused, so the chain holds no per-conversation memory
+    return LLMChain(
         llm=chat_model,
         prompt=prompt,
-        memory=memory,
         verbose=True
     )
+
+def get_chatbot_response(client, model_name, messages, temperature=0):
+    chain = _build_chatbot_chain(temperature)
     
     # Get response
-    response = chain.predict(input=messages[-1]["content"])
+    response = chain.predict(input=messages[-1]["content"], chat_history=[])
     return response
 
+async def aget_chatbot_response(client, model_name, messages, temperature=0):
+    """Async counterpart of get_chatbot_response"""
+    chain = _build_chatbot_chain(temperature)
+    return await chain.apredict(input=messages[-1]["content"], chat_history=[])
+
+async def astream_chain(chain, **inputs):
+    """
+    Stream the tokens of an LLMChain as they arrive from the model.
+    
+    Args:
+        chain (LLMChain): Chain to run
+        **inputs: Prompt variables for the chain
+    
+    Yields:
+        str: Response tokens
+    """
+    async for chunk in (chain.prompt | chain.llm).astream(inputs):
+        if chunk.content:
+            yield chunk.content
+
 def get_embedding(model_name, text_input):
     """
     Get embeddings using LangChain's HuggingFace embeddings.
@@ -76,32 +90,17 @@ def get_embedding(model_name, text_input):
     Returns:
         list: List of embeddings for the input text(s)
     """
-    # Get the best available device
-    device = get_available_device()
-    print(f"Using device: {device}")
-    
-    # Initialize the embedding model
-    embeddings = HuggingFaceEmbeddings(
-        model_name=model_name,
-        model_kwargs={'device': device},
-        encode_kwargs={'normalize_embeddings': True}
-    )
-    
     # Handle both single string and list of strings
     if isinstance(text_input, str):
         text_input = [text_input]
     
-    # Get embeddings
-    embeddings_result = embeddings.embed_documents(text_input)
-    return embeddings_result
+    # The model is loaded once per process and shared with the agents
+    return get_embedding_service(model_name).embed_documents(text_input)
 
-def double_check_json_output(client, model_name, json_string):
-    # Initialize LangChain chat model with Groq
-    chat_model = ChatGroq(
-        model_name=os.getenv("GROQ_MODEL_NAME"),
-        temperature=0,
-        groq_api_key=os.getenv("GROQ_API_KEY")
-    )
+@lru_cache(maxsize=None)
+def _build_json_check_chain():
+    # Shared chat model from the client factory
+    chat_model = get_chat_model("json_check", temperature=0)
     
     prompt = ChatPromptTemplate.from_messages([
         ("system", """You are a JSON validation expert. Your task is to:
@@ -113,11 +112,70 @@ def double_check_json_output(client, model_name, json_string):
         ("human", "Please validate and correct this JSON string:\n{json_string}")
     ])
     
-    chain = LLMChain(
+    return LLMChain(
         llm=chat_model,
         prompt=prompt,
         verbose=True
     )
-    
+
+def double_check_json_output(client, model_name, json_string):
+    chain = _build_json_check_chain()
     response = chain.predict(json_string=json_string)
-    return response.replace("'", "")
\ No newline at end of file
+    return _json_check_result(response)
+
+async def adouble_check_json_output(client, model_name, json_string):
+    """Async counterpart of double_check_json_output"""
+    chain = _build_json_check_chain()
+    response = await chain.apredict(json_string=json_string)
+    return _json_check_result(response)
+
+def _json_check_result(response):
+    # Repaired locally rather than stripping quotes, which corrupted values such as "I'm"
+    try:
+        return json.dumps(loads_tolerant(response)[0])
+    except JSONRepairError:
+        return response
+
+def parse_structured_output(agent_name, text, schema):
+    """
+    Parse an agent's model output into its Pydantic schema.
+
+    The output is repaired locally first, the JSON check LLM is only called when
+    that fails.
+
+    Args:
+        agent_name (str): Agent the parse outcome is counted for
+        text (str): Raw model output
+        schema: Pydantic model class of the agent's output
+
+    Returns:
+        An instance of schema, or of its full schema if schema is a CompactOutput
+
+    Raises:
+        JSONRepairError: If neither repair gives a valid output
+    """
+    try:
+        return _expand(parse_model(text, schema, agent_name))
+    except JSONRepairError as e:
+        logger.warning(f"Local repair failed for {agent_name}, asking the LLM: {str(e)}")
+    return _expand(_parse_llm_repair(agent_name, double_check_json_output(None, None, text), schema))
+
+async def aparse_structured_output(agent_name, text, schema):
+    """Async counterpart of parse_structured_output"""
+    try:
+        return _expand(parse_model(text, schema, agent_name))
+    except JSONRepairError as e:
+        logger.warning(f"Local repair failed for {agent_name}, asking the LLM: {str(e)}")
+    return _expand(_parse_llm_repair(agent_name, await adouble_check_json_output(None, None, text), schema))
+
+def _expand(parsed):
+    return parsed.expand() if isinstance(parsed, CompactOutput) else parsed
+
+def _parse_llm_repair(agent_name, json_string, schema):
+    try:
+        parsed = parse_model(json_string, schema)
+    except JSONRepairError:
+        repair_stats.record(agent_name, "failed")
+        raise
+    repair_stats.record(agent_name, "repaired_by_llm")
+    return parsed
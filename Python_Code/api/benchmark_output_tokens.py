@@ -0,0 +1,63 @@
+"""
+Output tokens of the structured-output agents in full and compact mode.
+
+Sends the same user messages to every agent with its full schema (with the
+chain_of_thought field) and its compact schema, and prints the output tokens per
+call of each mode from the token usage Groq reports. Needs the LLM settings of the
+API (GROQ_API_KEY, MODEL_NAME). Run from Python_Code/api:
+
+    python benchmark_output_tokens.py
+"""
+import json
+import pathlib
+from agents.gaurd_agent import GuardAgent
+from agents.classification_agent import ClassificationAgent
+from agents.guard_router_agent import GuardRouterAgent
+from agents.recommendation_agent import RecommendationAgent
+from agents.order_taking_agent import OrderTakingAgent
+from agents.llm_factory import get_output_token_stats
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+MESSAGES = [
+    "What time do you open on Sundays?",
+    "Can I get two lattes and a chocolate croissant?",
+    "Actually remove the croissant, that's all",
+    "What goes well with a cappuccino?",
+    "What are your most popular pastries?",
+    "Who won the football game yesterday?",
+]
+
+def build_agents(compact):
+    recommendation_agent = RecommendationAgent(
+        f"{folder_path}/recommendation_objects/apriori_recommendations.json",
+        f"{folder_path}/recommendation_objects/popularity_recommendation.csv",
+        compact=compact
+    )
+    return {
+        "guard_agent": GuardAgent(compact=compact),
+        "classification_agent": ClassificationAgent(compact=compact),
+        "guard_router_agent": GuardRouterAgent(compact=compact),
+        "recommendation_agent": recommendation_agent,
+        "order_taking_agent": OrderTakingAgent(recommendation_agent, compact=compact),
+    }
+
+def run(agents, session_id):
+    for message in MESSAGES:
+        messages = [{"role": "user", "content": message}]
+        agents["guard_agent"].get_response(messages, session_id)
+        agents["classification_agent"].get_response(messages, session_id)
+        agents["guard_router_agent"].get_response(messages, session_id)
+        agents["recommendation_agent"].recommendation_classification(messages, session_id)
+        # Only the extraction call, the recommendations after the first order are free text
+        order_agent = agents["order_taking_agent"]
+        combined_input, _, _ = order_agent.build_input(messages)
+        order_agent.chain.predict(input=combined_input, chat_history=[])
+
+def main():
+    run(build_agents(compact=False), "benchmark-full")
+    run(build_agents(compact=True), "benchmark-compact")
+    print(json.dumps(get_output_token_stats(), indent=2))
+
+if __name__ == "__main__":
+    main()
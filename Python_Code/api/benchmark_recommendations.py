@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of the recommendation lookups.
+
+Compares AprioriIndex with the original sort-per-call implementation on random
+baskets drawn from the rule antecedents, for the shipped rules and for a synthetic
+rule set with longer rule lists. Run from Python_Code/api:
+
+    python benchmark_recommendations.py [iterations]
+"""
+import sys
+import json
+import random
+import timeit
+import pathlib
+from agents.apriori_index import AprioriIndex
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+def sorted_apriori_recommendation(apriori_recommendations, products, top_k=5):
+    """The original RecommendationAgent.get_apriori_recommendation"""
+    recommendation_list = []
+    for product in products:
+        if product in apriori_recommendations:
+            recommendation_list += apriori_recommendations[product]
+    recommendation_list = sorted(recommendation_list, key=lambda x: x['confidence'], reverse=True)
+
+    recommendations = []
+    recommendations_per_category = {}
+    for recommendation in recommendation_list:
+        if recommendation in recommendations:
+            continue
+        product_catory = recommendation['product_category']
+        if product_catory not in recommendations_per_category:
+            recommendations_per_category[product_catory] = 0
+        if recommendations_per_category[product_catory] >= 2:
+            continue
+        recommendations_per_category[product_catory] += 1
+        recommendations.append(recommendation['product'])
+        if len(recommendations) >= top_k:
+            break
+    return recommendations
+
+def synthetic_rules(products=200, rules_per_product=100, categories=8):
+    """Rule set of a larger menu, to see how both implementations scale"""
+    random.seed(0)
+    names = [f"Product {i}" for i in range(products)]
+    category = {name: f"Category {i % categories}" for i, name in enumerate(names)}
+    return {
+        name: sorted(
+            [
+                {"product": consequent, "product_category": category[consequent], "confidence": random.random()}
+                for consequent in random.sample(names, rules_per_product)
+            ],
+            key=lambda x: x['confidence'],
+            reverse=True
+        )
+        for name in names
+    }
+
+def benchmark(label, apriori_recommendations, iterations):
+    apriori_index = AprioriIndex(apriori_recommendations)
+
+    random.seed(0)
+    items = [key for key in apriori_recommendations if "_" not in key]
+    baskets = [random.sample(items, random.randint(1, 4)) for _ in range(256)]
+
+    def run_sorted():
+        for basket in baskets:
+            sorted_apriori_recommendation(apriori_recommendations, basket)
+
+    def run_index():
+        for basket in baskets:
+            apriori_index.recommend(basket)
+
+    number = max(iterations // len(baskets), 1)
+    for name, function in (("sorted", run_sorted), ("index", run_index)):
+        seconds = min(timeit.repeat(function, number=number, repeat=5))
+        print(f"{label} apriori {name:>6}: {1e6 * seconds / (number * len(baskets)):.2f} us per basket")
+
+def main(iterations=20000):
+    with open(folder_path / "recommendation_objects" / "apriori_recommendations.json", 'r') as file:
+        benchmark("shipped", json.load(file), iterations)
+    benchmark("synthetic", synthetic_rules(), iterations // 10)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
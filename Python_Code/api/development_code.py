@@ -1,5 +1,7 @@
 from agents.gaurd_agent import GuardAgent
 from agents.classification_agent import ClassificationAgent
+from agents.guard_router_agent import GuardRouterAgent
+from agents.intent_router import IntentRouter
 from agents.details_agent import DetailsAgent
 from agents.recommendation_agent import RecommendationAgent
 from agents.order_taking_agent import OrderTakingAgent
@@ -30,14 +32,21 @@ class CoffeeShopChatbot:
             # Initialize agents
             self.guard_agent = GuardAgent()
             self.classification_agent = ClassificationAgent()
+            self.guard_router_agent = GuardRouterAgent() if os.getenv("FUSED_GUARD_ROUTING", "false").lower() == "true" else None
             self.recommendation_agent = RecommendationAgent(
                 str(base_path / 'recommendation_objects/apriori_recommendations.json'),
                 str(base_path / 'recommendation_objects/popularity_recommendation.csv')
             )
             
+            self.details_agent = DetailsAgent()
+
+            # Route obvious queries locally with the details agent's embedding model
+            if os.getenv("LOCAL_INTENT_ROUTER", "false").lower() == "true":
+                self.classification_agent = IntentRouter(self.classification_agent, self.details_agent.embedding_model)
+            
             # Initialize agent dictionary
             self.agent_dict: Dict[str, AgentProtocol] = {
-                "details_agent": DetailsAgent(),
+                "details_agent": self.details_agent,
                 "recommendation_agent": self.recommendation_agent,
                 "order_taking_agent": OrderTakingAgent(self.recommendation_agent)
             }
@@ -78,15 +87,12 @@ class CoffeeShopChatbot:
             messages.append({"role": "user", "content": user_input})
             logger.info(f"Processing user input: {user_input[:50]}...")
 
-            # Get GuardAgent's response
-            guard_agent_response = self.guard_agent.get_response(messages)
-            if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            guard_agent_response, classification_agent_response = self.get_pre_routing_responses(messages)
+            if classification_agent_response is None:
                 logger.info("Guard agent rejected the query")
                 messages.append(guard_agent_response)
                 return messages
 
-            # Get ClassificationAgent's response
-            classification_agent_response = self.classification_agent.get_response(messages)
             chosen_agent = classification_agent_response["memory"]["classification_decision"]
             logger.info(f"Chosen agent: {chosen_agent}")
 
@@ -116,6 +122,34 @@ class CoffeeShopChatbot:
             messages.append(error_response)
             return messages
 
+    def get_pre_routing_responses(self, messages: List[Dict[str, Any]]):
+        """
+        Get the guard and classification decisions for the conversation
+        
+        Args:
+            messages: List of conversation messages
+            
+        Returns:
+            Tuple of (guard response, classification response), the classification
+            response is None when the query is not allowed
+        """
+        if self.guard_router_agent is not None:
+            try:
+                guard_router_response = self.guard_router_agent.get_response(messages)
+                if guard_router_response["memory"]["guard_decision"] == "not allowed":
+                    return guard_router_response, None
+                return guard_router_response, guard_router_response
+            except Exception as e:
+                logger.error(f"Fused guard routing failed, using separate agents: {str(e)}")
+
+        # Get GuardAgent's response
+        guard_agent_response = self.guard_agent.get_response(messages)
+        if guard_agent_response["memory"]["guard_decision"] == "not allowed":
+            return guard_agent_response, None
+
+        # Get ClassificationAgent's response
+        return guard_agent_response, self.classification_agent.get_response(messages)
+
 def main():
     """Main function to run the coffee shop chatbot"""
     try:
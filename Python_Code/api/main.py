@@ -1,12 +1,43 @@
+import time
+import_start = time.perf_counter()
 from agent_controller import AgentController
+import os
+import threading
 import runpod
+import_seconds = time.perf_counter() - import_start
+
+
+def concurrency_modifier(current_concurrency):
+    """Number of jobs a single worker may run at the same time"""
+    return int(os.getenv("MAX_CONCURRENCY", "20"))
+
+def prewarm(agent_controller):
+    """Build the agents in the background so the first jobs don't pay for it"""
+    agent_controller.prewarm()
+    agent_controller.log_startup_timings()
 
 def main():
     agent_controller = AgentController()
-    runpod.serverless.start({"handler": agent_controller.get_response})
+    agent_controller.startup_timings["import:main"] = import_seconds
+    agent_controller.log_startup_timings()
+
+    # With LAZY_AGENTS the worker registers its handler right away and can warm up while idle
+    if agent_controller.lazy_agents and os.getenv("PREWARM_AGENTS", "true").lower() == "true":
+        threading.Thread(target=prewarm, args=(agent_controller,), name="prewarm", daemon=True).start()
+
+    if os.getenv("STREAM_RESPONSES", "false").lower() == "true":
+        # Generator handler: tokens are sent to /stream as they arrive
+        runpod.serverless.start({
+            "handler": agent_controller.astream_response,
+            "concurrency_modifier": concurrency_modifier,
+            "return_aggregate_stream": True
+        })
+    else:
+        runpod.serverless.start({
+            "handler": agent_controller.aget_response,
+            "concurrency_modifier": concurrency_modifier
+        })
 
 
 if __name__ == "__main__":
     main()
-
-    
\ No newline at end of file
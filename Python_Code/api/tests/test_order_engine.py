@@ -0,0 +1,117 @@
+"""
+Tests of the deterministic order engine against the shipped menu. Run from
+Python_Code/api:
+
+    python -m pytest tests
+"""
+from decimal import Decimal
+import pytest
+from agents.catalog import Catalog
+from agents.order_engine import (
+    OrderEngine, OrderExtraction, OrderState, ItemMention, TAKING_ORDER, CONFIRMING, CLOSED
+)
+
+@pytest.fixture(scope="module")
+def engine():
+    return OrderEngine(Catalog(popularity_path=False))
+
+def extraction(*items, finished=False):
+    return OrderExtraction(
+        items=[ItemMention(item=item, quantity=quantity, action=action) for item, quantity, action in items],
+        finished=finished
+    )
+
+def test_add_sums_quantities_and_prices(engine):
+    update = engine.apply(OrderState(), extraction(("latte", 2, "add"), ("croissant", 1, "add")))
+    update = engine.apply(update.state, extraction(("Latte", 1, "add")))
+
+    assert update.state.quantities == {"Croissant": 1, "Latte": 3}
+    assert update.state.step_number == TAKING_ORDER
+    assert engine.total(update.state) == Decimal("17.50")
+    assert engine.order_lines(update.state) == [
+        {"item": "Latte", "quantity": 3, "price": 14.25},
+        {"item": "Croissant", "quantity": 1, "price": 3.25},
+    ]
+    reply = engine.reply(update)
+    assert "I've added Latte to your order." in reply
+    assert "Total: $17.50" in reply
+
+def test_unknown_item_is_reported(engine):
+    update = engine.apply(OrderState(), extraction(("latte", 1, "add"), ("pizza", 1, "add")))
+
+    assert update.state.quantities == {"Latte": 1}
+    assert update.unknown == ["pizza"]
+    assert "Sorry, pizza is not on our menu." in engine.reply(update)
+
+def test_remove_decrements_in_place(engine):
+    state = OrderState(quantities={"Latte": 3, "Croissant": 1})
+    update = engine.apply(state, extraction(("latte", 1, "remove")))
+    assert list(update.state.quantities.items()) == [("Latte", 2), ("Croissant", 1)]
+
+    update = engine.apply(update.state, extraction(("croissant", 5, "remove")))
+    assert update.state.quantities == {"Latte": 2}
+    assert update.removed == ["Croissant"]
+    assert "I've removed Croissant from your order." in engine.reply(update)
+
+def test_ambiguous_add_asks_which_item(engine):
+    update = engine.apply(OrderState(), extraction(("scone", 1, "add")))
+
+    assert update.state.quantities == {}
+    assert set(update.ambiguous["scone"]) == {"Jumbo Savory Scone", "Cranberry Scone", "Oatmeal Scone", "Ginger Scone"}
+    reply = engine.reply(update)
+    assert reply.startswith("Which scone do you mean:")
+    assert "Your order is empty" not in reply
+
+def test_ambiguous_remove_uses_the_ordered_item(engine):
+    state = OrderState(quantities={"Latte": 1, "Ginger Scone": 2})
+    update = engine.apply(state, extraction(("scone", 2, "remove")))
+
+    assert update.state.quantities == {"Latte": 1}
+    assert update.removed == ["Ginger Scone"]
+    assert not update.ambiguous
+
+def test_ambiguous_remove_asks_between_ordered_items(engine):
+    state = OrderState(quantities={"Ginger Scone": 1, "Oatmeal Scone": 1})
+    update = engine.apply(state, extraction(("scone", 1, "remove")))
+
+    assert update.state.quantities == state.quantities
+    assert update.ambiguous == {"scone": ["Oatmeal Scone", "Ginger Scone"]}
+    assert "Which scone do you mean: Oatmeal Scone or Ginger Scone?" in engine.reply(update)
+
+def test_confirm_then_close(engine):
+    state = OrderState(quantities={"Latte": 2})
+    update = engine.apply(state, extraction(finished=True))
+    assert update.state.step_number == CONFIRMING
+    assert "Shall I place it?" in engine.reply(update)
+    assert "Total: $9.50" in engine.reply(update)
+
+    update = engine.apply(update.state, extraction(finished=True))
+    assert update.state.step_number == CLOSED
+    assert "Your order is placed:" in engine.reply(update)
+
+def test_change_while_confirming_asks_again(engine):
+    state = OrderState(step_number=CONFIRMING, quantities={"Latte": 1})
+    update = engine.apply(state, extraction(("croissant", 1, "add"), finished=True))
+
+    assert update.state.step_number == CONFIRMING
+    assert "Shall I place it?" in engine.reply(update)
+
+def test_ambiguous_mention_does_not_close(engine):
+    state = OrderState(step_number=CONFIRMING, quantities={"Latte": 1})
+    update = engine.apply(state, extraction(("scone", 1, "add"), finished=True))
+
+    assert update.state.step_number == CONFIRMING
+
+def test_message_after_close_starts_new_order(engine):
+    state = OrderState(step_number=CLOSED, quantities={"Latte": 1})
+    update = engine.apply(state, extraction(("croissant", 1, "add")))
+
+    assert update.state.quantities == {"Croissant": 1}
+    assert update.state.step_number == TAKING_ORDER
+
+def test_state_from_memory_revalidates_items(engine):
+    state = engine.state_from_memory({
+        "step number": 7,
+        "order": [{"item": "Latte", "quantity": 2, "price": 9.5}, {"item": "pizza", "quantity": 1, "price": 1}]
+    })
+    assert state == OrderState(step_number=TAKING_ORDER, quantities={"Latte": 2})
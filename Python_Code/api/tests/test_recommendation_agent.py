@@ -0,0 +1,48 @@
+"""
+Tests of the popularity recommendations of known and anonymous customers against
+the shipped popularity ranking. The agent is built without its LLM chains. Run from
+Python_Code/api:
+
+    python -m pytest tests
+"""
+import json
+import pathlib
+import numpy as np
+import pytest
+from agents.personalization import CustomerRecommendations
+from agents.popularity_index import PopularityIndex
+from agents.recommendation_agent import RecommendationAgent
+
+POPULARITY_PATH = pathlib.Path(__file__).parent.parent / "recommendation_objects" / "popularity_recommendation.csv"
+
+@pytest.fixture
+def agent(tmp_path):
+    popularity_index = PopularityIndex.from_csv(POPULARITY_PATH)
+    products = ["Cappuccino", "Latte", "Ginger Scone", "Hazelnut Biscotti", "Chocolate Croissant"]
+    # Customer 1 has a 5 product row with 2 Bakery products, customer 2 has none
+    np.save(tmp_path / "customers.npy", np.array([[-1] * 5, [0, 2, 1, 3, -1], [-1] * 5]))
+    with open(tmp_path / "customers.json", 'w') as file:
+        json.dump({"products": products, "version": "test"}, file)
+
+    agent = RecommendationAgent.__new__(RecommendationAgent)
+    agent.popularity_index = popularity_index
+    agent.partitions = None
+    agent.personalization = CustomerRecommendations(tmp_path / "customers")
+    agent.personalization_categories = dict(zip(popularity_index.products, popularity_index.product_categories))
+    return agent
+
+def test_known_customer_category_is_filled_with_popular_products(agent):
+    recommendations = agent.get_popular_recommendation(["Bakery"], top_k=5, context={"customer_id": 1})
+
+    assert len(recommendations) == 5
+    assert recommendations[:2] == ["Ginger Scone", "Hazelnut Biscotti"]
+    assert len(set(recommendations)) == 5
+    popular = agent.popularity_index.recommend(["Bakery"], top_k=7)
+    assert recommendations[2:] == [product for product in popular if product not in recommendations[:2]][:3]
+
+def test_customer_without_recommendations_gets_popular_products(agent):
+    recommendations = agent.get_popular_recommendation(["Bakery"], top_k=5, context={"customer_id": 2})
+    assert recommendations == agent.popularity_index.recommend(["Bakery"], top_k=5)
+
+def test_anonymous_customer_gets_popular_products(agent):
+    assert agent.get_popular_recommendation(top_k=3) == agent.popularity_index.recommend(top_k=3)
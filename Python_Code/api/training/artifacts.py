@@ -0,0 +1,81 @@
+"""
+Writers of the recommendation artifacts, and a converter of the JSON and CSV
+artifacts to the binary format. Run from Python_Code/api:
+
+    python -m training.artifacts
+"""
+import os
+import csv
+import json
+import logging
+import pathlib
+import argparse
+import tempfile
+from agents.recommendation_artifact import pack_recommendations
+from agents.popularity_index import PopularityIndex
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+OUTPUT_PATH = folder_path.parent / "recommendation_objects"
+
+def atomic_write(path, write, mode='w'):
+    """
+    Write a file through a temporary file in the same folder and swap it in, so the
+    agents never read a half-written artifact.
+
+    Args:
+        path: Destination path
+        write: Function called with the open temporary file
+        mode: 'w' for text or 'wb' for binary files
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode, newline=None if 'b' in mode else '') as file:
+            write(file)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def write_apriori_recommendations(path, recommendations):
+    """Write apriori_recommendations.json: antecedent key -> [{product, product_category, confidence}]"""
+    atomic_write(path, lambda file: json.dump(recommendations, file))
+
+def write_popularity_recommendations(path, rows):
+    """Write popularity_recommendation.csv from (product, product_category, number_of_transactions) rows"""
+    def write(file):
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(["product", "product_category", "number_of_transactions"])
+        writer.writerows(rows)
+    atomic_write(path, write)
+
+def write_binary_recommendations(path, recommendations, rows):
+    """Write recommendations.bin, the memory-mappable form of both artifacts above"""
+    data = pack_recommendations(recommendations, rows)
+    atomic_write(path, lambda file: file.write(data), mode='wb')
+
+def convert(apriori_path, popularity_path, output_path):
+    """Convert apriori_recommendations.json and popularity_recommendation.csv to recommendations.bin"""
+    with open(apriori_path, 'r') as file:
+        recommendations = json.load(file)
+    rows = PopularityIndex.from_csv(popularity_path).rows
+    write_binary_recommendations(output_path, recommendations, rows)
+    logger.info(f"Wrote {len(recommendations)} antecedents and {len(rows)} popularity rows to {output_path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert the JSON and CSV recommendation artifacts to the binary format")
+    parser.add_argument("--apriori", default=str(OUTPUT_PATH / "apriori_recommendations.json"), help="Apriori recommendations JSON")
+    parser.add_argument("--popularity", default=str(OUTPUT_PATH / "popularity_recommendation.csv"), help="Popularity recommendations CSV")
+    parser.add_argument("--output", default=str(OUTPUT_PATH / "recommendations.bin"), help="Binary artifact path")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args()
+    convert(args.apriori, args.popularity, args.output)
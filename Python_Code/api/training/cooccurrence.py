@@ -0,0 +1,232 @@
+"""
+Incremental co-occurrence model of the sales receipts.
+
+Keeps the basket count, item and item pair co-occurrence counts and the line item
+counts per product and category in one .npz store. New receipt batches are added to
+the counts, optionally decaying the old counts first, and the recommendation artifacts
+are regenerated from the counts without re-reading the receipts history.
+Run from Python_Code/api:
+
+    python -m training.cooccurrence ingest --receipts "../dataset/201905 sales reciepts.csv" --export
+    python -m training.cooccurrence export
+
+Rules are pairwise (one antecedent, one consequent), which covers every rule the
+April receipts produce. A basket that straddles two batches is counted as two.
+"""
+import io
+import json
+import logging
+import pathlib
+import argparse
+import numpy as np
+import pandas as pd
+from .artifacts import atomic_write, write_apriori_recommendations, write_popularity_recommendations, write_binary_recommendations
+from .recommendations import (
+    DATASET_PATH, OUTPUT_PATH, StageTimer, load_products, read_line_items,
+    keep_multi_item_transactions, basket_matrix, apriori_recommendations
+)
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+STORE_PATH = folder_path.parent / "recommendation_objects" / "cooccurrence_store.npz"
+
+class CooccurrenceStore:
+    """
+    Decayed counts behind the recommendation artifacts.
+
+    co_occurrence[i, j] is the number of baskets with products i and j, its diagonal
+    the number of baskets with product i. line_items[i, c] counts the line items of
+    product i sold under category c, which is what the popularity ranking uses.
+    """
+    def __init__(self, product_names=(), category_names=()):
+        self.product_names = list(product_names)
+        self.category_names = list(category_names)
+        self.baskets = 0.0
+        self.co_occurrence = np.zeros((len(self.product_names), len(self.product_names)))
+        self.line_items = np.zeros((len(self.product_names), len(self.category_names)))
+        # Day of the newest receipt ingested, decay is measured from it
+        self.last_date = None
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            metadata = json.loads(str(data["metadata"]))
+            store = cls(metadata["product_names"], metadata["category_names"])
+            store.baskets = float(data["baskets"])
+            store.co_occurrence = data["co_occurrence"]
+            store.line_items = data["line_items"]
+            store.last_date = np.datetime64(metadata["last_date"]) if metadata["last_date"] else None
+        return store
+
+    def save(self, path):
+        metadata = {
+            "product_names": self.product_names,
+            "category_names": self.category_names,
+            "last_date": str(self.last_date) if self.last_date is not None else None
+        }
+        buffer = io.BytesIO()
+        np.savez(
+            buffer,
+            metadata=np.array(json.dumps(metadata)),
+            baskets=np.array(self.baskets),
+            co_occurrence=self.co_occurrence,
+            line_items=self.line_items
+        )
+        atomic_write(path, lambda file: file.write(buffer.getvalue()), mode='wb')
+
+    def _indexes(self, names, known_names):
+        """Store indexes of names, adding the ones it has not seen yet"""
+        indexes = []
+        for name in names:
+            if name not in known_names:
+                known_names.append(name)
+            indexes.append(known_names.index(name))
+        return np.array(indexes, dtype=np.int64)
+
+    def _grow(self):
+        products, categories = len(self.product_names), len(self.category_names)
+        co_occurrence = np.zeros((products, products))
+        co_occurrence[:self.co_occurrence.shape[0], :self.co_occurrence.shape[1]] = self.co_occurrence
+        line_items = np.zeros((products, categories))
+        line_items[:self.line_items.shape[0], :self.line_items.shape[1]] = self.line_items
+        self.co_occurrence, self.line_items = co_occurrence, line_items
+
+    def decay(self, until, half_life_days):
+        """Scale the counts down by the time elapsed since the last ingested receipt"""
+        if self.last_date is None or half_life_days is None:
+            return
+        elapsed_days = (until - self.last_date) / np.timedelta64(1, 'D')
+        if elapsed_days > 0:
+            factor = 0.5 ** (elapsed_days / half_life_days)
+            self.baskets *= factor
+            self.co_occurrence *= factor
+            self.line_items *= factor
+
+    def ingest(self, line_items, product_names, category_names, half_life_days=None):
+        """
+        Add a batch of line items.
+
+        Args:
+            line_items (DataFrame): Output of read_line_items for the batch
+            product_names (list): Names of the batch's product indexes
+            category_names (list): Names of the batch's category indexes
+            half_life_days (float): Half-life of the old counts, no decay if None
+        """
+        line_items = keep_multi_item_transactions(line_items)
+        if line_items.empty:
+            return
+
+        batch_date = np.datetime64(pd.to_datetime(line_items["transaction_date"]).max().date())
+        self.decay(batch_date, half_life_days)
+
+        product_indexes = self._indexes(product_names, self.product_names)
+        category_indexes = self._indexes(category_names, self.category_names)
+        self._grow()
+
+        baskets = basket_matrix(line_items, len(product_names)).astype(np.int64)
+        batch_co_occurrence = (baskets.T @ baskets).toarray()
+        self.co_occurrence[np.ix_(product_indexes, product_indexes)] += batch_co_occurrence
+        self.baskets += baskets.shape[0]
+
+        counts = line_items.groupby(["product", "category"]).size()
+        np.add.at(
+            self.line_items,
+            (product_indexes[counts.index.get_level_values(0)], category_indexes[counts.index.get_level_values(1)]),
+            counts.to_numpy()
+        )
+
+        if self.last_date is None or batch_date > self.last_date:
+            self.last_date = batch_date
+
+    def rules(self, min_support=0.05, min_lift=1.0):
+        """
+        Pairwise rules from the counts.
+
+        Returns:
+            list: (antecedent, consequent, confidence, lift) tuples in the training module's format
+        """
+        if self.baskets == 0:
+            return []
+        item_counts = np.diag(self.co_occurrence)
+        support = self.co_occurrence / self.baskets
+        item_support = item_counts / self.baskets
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidence = self.co_occurrence / item_counts[:, None]
+            lift = confidence / item_support[None, :]
+
+        frequent = (support >= min_support) & (lift >= min_lift)
+        np.fill_diagonal(frequent, False)
+        frequent &= (item_support >= min_support)[:, None] & (item_support >= min_support)[None, :]
+
+        return [
+            ((a,), (b,), float(confidence[a, b]), float(lift[a, b]))
+            for a, b in zip(*np.nonzero(frequent))
+        ]
+
+    def popularity_rows(self):
+        """(product, product_category, number_of_transactions) rows of the products sold"""
+        products, categories = np.nonzero(self.line_items.round() > 0)
+        rows = [
+            (self.product_names[product], self.category_names[category], int(round(self.line_items[product, category])))
+            for product, category in zip(products, categories)
+        ]
+        return sorted(rows)
+
+    def product_categories(self):
+        """Product name -> category it is sold under most often"""
+        return {
+            name: self.category_names[int(np.argmax(self.line_items[product]))]
+            for product, name in enumerate(self.product_names)
+        }
+
+    def export(self, output_path, min_support=0.05, min_lift=1.0):
+        """Regenerate apriori_recommendations.json, popularity_recommendation.csv and recommendations.bin"""
+        output_path = pathlib.Path(output_path)
+        recommendations = apriori_recommendations(self.rules(min_support, min_lift), self.product_names, self.product_categories())
+        popularity = self.popularity_rows()
+        write_apriori_recommendations(output_path / "apriori_recommendations.json", recommendations)
+        write_popularity_recommendations(output_path / "popularity_recommendation.csv", popularity)
+        write_binary_recommendations(output_path / "recommendations.bin", recommendations, popularity)
+        logger.info(f"Exported rules for {len(recommendations)} antecedents to {output_path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Maintain the incremental co-occurrence model")
+    parser.add_argument("--store", default=str(STORE_PATH), help="Path of the .npz count store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="Add receipt batches to the counts")
+    ingest.add_argument("--receipts", nargs="+", required=True, help="Sales receipts CSV files, oldest first")
+    ingest.add_argument("--products", default=str(DATASET_PATH / "product.csv"), help="Product catalog CSV")
+    ingest.add_argument("--half-life-days", type=float, default=None, help="Decay old counts with this half-life")
+    ingest.add_argument("--export", action="store_true", help="Regenerate the artifacts after ingesting")
+
+    for subparser in (ingest, subparsers.add_parser("export", help="Regenerate the artifacts from the counts")):
+        subparser.add_argument("--output", default=str(OUTPUT_PATH), help="Folder the artifacts are written to")
+        subparser.add_argument("--min-support", type=float, default=0.05)
+        subparser.add_argument("--min-lift", type=float, default=1.0)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args()
+    timer = StageTimer()
+
+    store_path = pathlib.Path(args.store)
+    store = CooccurrenceStore.load(store_path) if store_path.exists() else CooccurrenceStore()
+
+    if args.command == "ingest":
+        with timer.stage("load products"):
+            product_index, category_index, product_names, category_names = load_products(args.products)
+        for receipt_path in args.receipts:
+            with timer.stage(f"ingest {pathlib.Path(receipt_path).name}"):
+                line_items = read_line_items([receipt_path], product_index, category_index)
+                store.ingest(line_items, product_names, category_names, args.half_life_days)
+        with timer.stage("save store"):
+            store.save(store_path)
+
+    if args.command == "export" or args.export:
+        with timer.stage("export"):
+            store.export(args.output, args.min_support, args.min_lift)
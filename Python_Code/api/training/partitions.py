@@ -0,0 +1,134 @@
+"""
+Train recommendation models per outlet, part of the day and weekday.
+
+Writes recommendation_partitions.json, read by RecommendationAgent when
+RECOMMENDATION_PARTITIONS_PATH is set. Run from Python_Code/api:
+
+    python -m training.partitions --receipts "../dataset/201904 sales reciepts.csv"
+
+Products and categories are stored once in string tables. Each partition holds its
+basket count, its rules as [product, category, confidence] rows and its popularity
+as [product, category, count] rows. Partitions with fewer than --min-baskets
+baskets are left out, so requests in them fall back to the global models.
+"""
+import json
+import logging
+import pathlib
+import argparse
+import numpy as np
+import pandas as pd
+from agents.recommendation_partitions import DAYPARTS, WEEKDAYS
+from .artifacts import atomic_write
+from .recommendations import (
+    DATASET_PATH, OUTPUT_PATH, NOTEBOOK_TRANSACTION_KEY, RECEIPT_TRANSACTION_KEY, StageTimer,
+    load_products, read_line_items, keep_multi_item_transactions, basket_matrix, frequent_itemsets,
+    association_rules, apriori_recommendations, popularity_rows, main_category
+)
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_VERSION = 1
+
+def partition_columns(line_items):
+    """Add the outlet, daypart and weekday partition keys of every line item"""
+    hours = pd.to_numeric(line_items["transaction_time"].str[:2])
+    dayparts = pd.cut(
+        hours,
+        bins=[start for _, start, _ in DAYPARTS] + [DAYPARTS[-1][2]],
+        labels=[name for name, _, _ in DAYPARTS],
+        right=False
+    ).astype(str)
+    weekdays = pd.Series(
+        np.array(WEEKDAYS)[pd.to_datetime(line_items["transaction_date"]).dt.weekday.to_numpy()],
+        index=line_items.index
+    )
+    outlets = line_items["sales_outlet_id"].astype(str)
+
+    return line_items.assign(
+        outlet_daypart="outlet=" + outlets + "&daypart=" + dayparts,
+        outlet="outlet=" + outlets,
+        daypart="daypart=" + dayparts,
+        weekday="weekday=" + weekdays
+    )
+
+def train_partition(line_items, product_names, product_categories, category_names, min_support, min_lift, max_len):
+    """Rules and popularity of the line items of one partition"""
+    line_items = keep_multi_item_transactions(line_items.assign(
+        transaction=pd.factorize(line_items["transaction"])[0]
+    ))
+    if line_items.empty:
+        return {"baskets": 0, "rules": {}, "popularity": []}
+
+    baskets = basket_matrix(line_items, len(product_names))
+    rules = association_rules(frequent_itemsets(baskets, min_support, max_len), min_lift)
+    recommendations = apriori_recommendations(rules, product_names, product_categories)
+
+    category_ids = {name: i for i, name in enumerate(category_names)}
+    product_ids = {name: i for i, name in enumerate(product_names)}
+    return {
+        "baskets": int(baskets.shape[0]),
+        "rules": {
+            key: [[product_ids[rule["product"]], category_ids[rule["product_category"]], rule["confidence"]] for rule in rules]
+            for key, rules in recommendations.items()
+        },
+        "popularity": [
+            [product_ids[product], category_ids[category], count]
+            for product, category, count in popularity_rows(line_items, product_names, category_names)
+        ]
+    }
+
+def train(receipt_paths, product_path, output_path, min_support=0.05, min_lift=1.0, max_len=None,
+          min_baskets=200, transaction_key=NOTEBOOK_TRANSACTION_KEY):
+    timer = StageTimer()
+
+    with timer.stage("load products"):
+        product_index, category_index, product_names, category_names = load_products(product_path)
+
+    with timer.stage("read receipts"):
+        line_items = partition_columns(read_line_items(receipt_paths, product_index, category_index, transaction_key=transaction_key))
+        product_categories = main_category(line_items, product_names, category_names)
+
+    partitions = {}
+    for column in ("outlet_daypart", "outlet", "daypart", "weekday"):
+        with timer.stage(f"partitions by {column}"):
+            for key, partition_line_items in line_items.groupby(column):
+                partitions[key] = train_partition(
+                    partition_line_items, product_names, product_categories, category_names, min_support, min_lift, max_len
+                )
+
+    sparse_partitions = [key for key, partition in partitions.items() if partition["baskets"] < min_baskets]
+    for key in sparse_partitions:
+        del partitions[key]
+    logger.info(f"{len(partitions)} partitions, {len(sparse_partitions)} left out with fewer than {min_baskets} baskets")
+
+    with timer.stage("write artifact"):
+        artifact = {
+            "version": ARTIFACT_VERSION,
+            "min_baskets": min_baskets,
+            "products": list(product_names),
+            "categories": list(category_names),
+            "partitions": partitions
+        }
+        atomic_write(pathlib.Path(output_path) / "recommendation_partitions.json", lambda file: json.dump(artifact, file, separators=(",", ":")))
+
+    return timer.timings
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train recommendation models per outlet, part of the day and weekday")
+    parser.add_argument("--receipts", nargs="+", default=[str(DATASET_PATH / "201904 sales reciepts.csv")], help="Sales receipts CSV files")
+    parser.add_argument("--products", default=str(DATASET_PATH / "product.csv"), help="Product catalog CSV")
+    parser.add_argument("--output", default=str(OUTPUT_PATH), help="Folder the artifact is written to")
+    parser.add_argument("--min-support", type=float, default=0.05)
+    parser.add_argument("--min-lift", type=float, default=1.0)
+    parser.add_argument("--max-len", type=int, default=None, help="Largest itemset size, unlimited by default")
+    parser.add_argument("--min-baskets", type=int, default=200, help="Smallest partition kept")
+    parser.add_argument("--per-receipt", action="store_true", help="Treat every receipt as its own basket instead of the notebook's transaction and customer id")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args()
+    train(
+        args.receipts, args.products, args.output, args.min_support, args.min_lift, args.max_len, args.min_baskets,
+        RECEIPT_TRANSACTION_KEY if args.per_receipt else NOTEBOOK_TRANSACTION_KEY
+    )
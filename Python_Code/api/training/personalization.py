@@ -0,0 +1,105 @@
+"""
+Train per-customer recommendations with item-based collaborative filtering.
+
+Builds a sparse customer x product purchase matrix from the receipts, the item-item
+cosine similarity of its columns, and scores every customer's unpurchased products
+by their similarity to what the customer bought. The top N product ids per customer
+are written to customer_recommendations.npy, indexed by customer_id, with the
+product names in customer_recommendations.json. Run from Python_Code/api:
+
+    python -m training.personalization --receipts "../dataset/201904 sales reciepts.csv"
+
+RecommendationAgent reads them from CUSTOMER_RECOMMENDATIONS_PATH (the path
+without suffix).
+"""
+import json
+import hashlib
+import logging
+import pathlib
+import argparse
+import numpy as np
+from scipy import sparse
+from .artifacts import atomic_write
+from .recommendations import DATASET_PATH, OUTPUT_PATH, StageTimer, load_products, read_line_items
+
+logger = logging.getLogger(__name__)
+
+def customer_matrix(line_items, number_of_products):
+    """Sparse customer x product matrix of line item counts, anonymous customers (id 0) left out"""
+    line_items = line_items[line_items["customer_id"] > 0]
+    customers = line_items["customer_id"].to_numpy()
+    return sparse.csr_matrix(
+        (np.ones(len(customers), dtype=np.float32), (customers, line_items["product"].to_numpy())),
+        shape=(customers.max() + 1, number_of_products)
+    )
+
+def item_similarity(purchases):
+    """Cosine similarity of the product columns, zero on the diagonal"""
+    # Damp heavy buyers so a single regular does not dominate the similarities
+    purchases = purchases.log1p()
+    norms = np.sqrt(np.asarray(purchases.multiply(purchases).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    similarity = (purchases.T @ purchases).toarray() / np.outer(norms, norms)
+    np.fill_diagonal(similarity, 0)
+    return similarity
+
+def top_n(purchases, similarity, n=5, include_purchased=False):
+    """
+    Top n product ids per customer by similarity to their purchases.
+
+    Returns:
+        ndarray: (customers, n) int16 array padded with -1, rows of customers without purchases are all -1
+    """
+    scores = np.asarray((purchases.log1p() @ similarity))
+    if not include_purchased:
+        scores[purchases.toarray() > 0] = 0
+
+    n = min(n, scores.shape[1])
+    ranking = np.argsort(-scores, axis=1, kind="stable")[:, :n]
+    ranked_scores = np.take_along_axis(scores, ranking, axis=1)
+    return np.where(ranked_scores > 0, ranking, -1).astype(np.int16)
+
+def train(receipt_paths, product_path, output_path, n=5, include_purchased=False):
+    timer = StageTimer()
+
+    with timer.stage("load products"):
+        product_index, category_index, product_names, _ = load_products(product_path)
+
+    with timer.stage("read receipts"):
+        line_items = read_line_items(receipt_paths, product_index, category_index)
+
+    with timer.stage("customer matrix"):
+        purchases = customer_matrix(line_items, len(product_names))
+        logger.info(f"{purchases.getnnz(axis=1).astype(bool).sum()} customers, {purchases.nnz} customer-product pairs")
+
+    with timer.stage("item similarity"):
+        similarity = item_similarity(purchases)
+
+    with timer.stage("top n"):
+        recommendations = top_n(purchases, similarity, n, include_purchased)
+
+    with timer.stage("write artifacts"):
+        output_path = pathlib.Path(output_path) / "customer_recommendations"
+        metadata = {
+            "products": list(product_names),
+            "top_n": n,
+            "version": hashlib.sha1(recommendations.tobytes()).hexdigest()[:16]
+        }
+        atomic_write(output_path.with_suffix(".npy"), lambda file: np.save(file, recommendations), mode='wb')
+        atomic_write(output_path.with_suffix(".json"), lambda file: json.dump(metadata, file))
+
+    return timer.timings
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train per-customer recommendations")
+    parser.add_argument("--receipts", nargs="+", default=[str(DATASET_PATH / "201904 sales reciepts.csv")], help="Sales receipts CSV files")
+    parser.add_argument("--products", default=str(DATASET_PATH / "product.csv"), help="Product catalog CSV")
+    parser.add_argument("--output", default=str(OUTPUT_PATH), help="Folder the artifacts are written to")
+    parser.add_argument("--top-n", type=int, default=5, help="Recommendations kept per customer")
+    parser.add_argument("--include-purchased", action="store_true", help="Also recommend products the customer already bought")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args()
+    train(args.receipts, args.products, args.output, args.top_n, args.include_purchased)
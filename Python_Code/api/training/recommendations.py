@@ -0,0 +1,392 @@
+"""
+Train the recommendation artifacts from the sales receipts.
+
+Replaces recommendation_engine_training.ipynb. Run from Python_Code/api:
+
+    python -m training.recommendations --receipts "../dataset/201904 sales reciepts.csv"
+
+Several --receipts files can be given to train on more than one month.
+"""
+import time
+import logging
+import pathlib
+import argparse
+from contextlib import contextmanager
+from itertools import combinations
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .artifacts import OUTPUT_PATH, write_apriori_recommendations, write_popularity_recommendations, write_binary_recommendations
+
+logger = logging.getLogger(__name__)
+
+folder_path = pathlib.Path(__file__).parent.resolve()
+
+DATASET_PATH = folder_path.parent.parent / "dataset"
+
+# Menu items the recommendations are built for, after removing size suffixes
+PRODUCTS_TO_TAKE = [
+    'Cappuccino', 'Latte', 'Espresso shot', 'Dark chocolate', 'Sugar Free Vanilla syrup',
+    'Chocolate syrup', 'Carmel syrup', 'Hazelnut syrup', 'Ginger Scone', 'Chocolate Croissant',
+    'Jumbo Savory Scone', 'Cranberry Scone', 'Hazelnut Biscotti', 'Croissant', 'Almond Croissant',
+    'Oatmeal Scone', 'Chocolate Chip Biscotti', 'Ginger Biscotti'
+]
+
+SIZE_SUFFIX_PATTERN = r" (?:Rg|Sm|Lg)$"
+
+NOTEBOOK_TRANSACTION_KEY = ("transaction_id", "customer_id")
+# Transaction ids restart across outlets and days
+RECEIPT_TRANSACTION_KEY = ("transaction_date", "sales_outlet_id", "transaction_id", "customer_id")
+
+RECEIPT_COLUMNS = ["transaction_id", "transaction_date", "transaction_time", "sales_outlet_id", "customer_id", "product_id"]
+
+class StageTimer:
+    """Wall time of each training stage"""
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.timings[name] = time.perf_counter() - start
+        logger.info(f"{name}: {self.timings[name]:.2f}s")
+
+def load_products(product_path, products_to_take=PRODUCTS_TO_TAKE):
+    """
+    Map product ids to menu items.
+
+    Returns:
+        tuple: (product_id -> product index, product_id -> category index, product names, category names)
+    """
+    products = pd.read_csv(product_path, usecols=["product_id", "product_category", "product"])
+    products["product"] = products["product"].str.strip().str.replace(SIZE_SUFFIX_PATTERN, "", regex=True)
+    products = products[products["product"].isin(products_to_take)]
+
+    product_names, product_codes = np.unique(products["product"].to_numpy(), return_inverse=True)
+    category_names, category_codes = np.unique(products["product_category"].to_numpy(), return_inverse=True)
+
+    product_index = dict(zip(products["product_id"], product_codes))
+    category_index = dict(zip(products["product_id"], category_codes))
+    return product_index, category_index, list(product_names), list(category_names)
+
+def read_line_items(receipt_paths, product_index, category_index, chunksize=200000, transaction_key=NOTEBOOK_TRANSACTION_KEY):
+    """
+    Read the line items of the menu items into one DataFrame, for the trainings that
+    need every line item. The global models are trained from count_baskets instead.
+
+    Args:
+        transaction_key: Receipt columns identifying a basket. The notebook's
+            (transaction_id, customer_id) also merges a customer's receipts that share
+            a transaction id, RECEIPT_TRANSACTION_KEY keeps receipts apart.
+
+    Returns:
+        DataFrame: One row per line item with a transaction number and product and category indexes
+    """
+    chunks = []
+    for receipt_path in receipt_paths:
+        for chunk in pd.read_csv(receipt_path, usecols=RECEIPT_COLUMNS, chunksize=chunksize):
+            chunk = chunk[chunk["product_id"].isin(product_index.keys())]
+            chunks.append(pd.DataFrame({
+                "transaction_date": chunk["transaction_date"].to_numpy(),
+                "transaction_time": chunk["transaction_time"].to_numpy(),
+                "sales_outlet_id": chunk["sales_outlet_id"].to_numpy(dtype=np.int32),
+                "transaction_id": chunk["transaction_id"].to_numpy(dtype=np.int64),
+                "customer_id": chunk["customer_id"].to_numpy(dtype=np.int64),
+                "product": chunk["product_id"].map(product_index).to_numpy(dtype=np.int32),
+                "category": chunk["product_id"].map(category_index).to_numpy(dtype=np.int32)
+            }))
+
+    line_items = pd.concat(chunks, ignore_index=True)
+    line_items["transaction"] = line_items.groupby(list(transaction_key), sort=False).ngroup().to_numpy(dtype=np.int64)
+    return line_items
+
+class BasketCounts:
+    """
+    Receipts aggregated for the global models: the number of baskets holding each
+    set of products, with the sets as product bitmasks, and the line items of each
+    product and category. Only baskets with more than one line item are counted.
+    """
+    def __init__(self, number_of_products, number_of_categories):
+        if number_of_products > 63:
+            raise ValueError(f"{number_of_products} products don't fit in a 64-bit basket mask")
+        self.number_of_products = number_of_products
+        self.mask_counts = {}
+        self.popularity = np.zeros((number_of_products, number_of_categories), dtype=np.int64)
+        self.line_items = 0
+
+    def add(self, rows, transaction_key):
+        """
+        Count complete baskets.
+
+        Args:
+            rows (DataFrame): transaction_key columns, product, category and the number of
+                line items, every basket in it complete
+            transaction_key: Columns identifying a basket
+        """
+        key = list(transaction_key)
+        rows = rows[rows.groupby(key, sort=False)["lines"].transform("sum").to_numpy() > 1]
+        if rows.empty:
+            return
+        self.line_items += int(rows["lines"].sum())
+        np.add.at(self.popularity, (rows["product"].to_numpy(), rows["category"].to_numpy()), rows["lines"].to_numpy())
+
+        # Distinct products of a basket have distinct bits, so their sum is the mask
+        products = rows.drop_duplicates(key + ["product"])
+        bits = np.left_shift(np.uint64(1), products["product"].to_numpy(dtype=np.uint64))
+        masks = pd.Series(bits, index=products.index).groupby([products[column] for column in key], sort=False).sum()
+        for mask, count in zip(*np.unique(masks.to_numpy(dtype=np.uint64), return_counts=True)):
+            self.mask_counts[int(mask)] = self.mask_counts.get(int(mask), 0) + int(count)
+
+    @property
+    def baskets(self):
+        return sum(self.mask_counts.values())
+
+    def basket_matrix(self):
+        """
+        Sparse boolean matrix of the distinct product sets and the number of baskets of each.
+
+        Returns:
+            tuple: (csc matrix, weights array)
+        """
+        masks = np.array(list(self.mask_counts), dtype=np.uint64)
+        weights = np.array(list(self.mask_counts.values()), dtype=np.int64)
+        dense = (masks[:, None] >> np.arange(self.number_of_products, dtype=np.uint64)) & np.uint64(1)
+        return sparse.csc_matrix(dense.astype(np.bool_)), weights
+
+    def popularity_rows(self, product_names, category_names):
+        """(product, product_category, number_of_transactions) rows counting line items"""
+        products, categories = np.nonzero(self.popularity)
+        return [
+            (product_names[product], category_names[category], int(self.popularity[product, category]))
+            for product, category in zip(products, categories)
+        ]
+
+    def main_category(self, product_names, category_names):
+        """Product name -> category it is sold under most often"""
+        return {
+            product_names[product]: category_names[int(np.argmax(self.popularity[product]))]
+            for product in np.nonzero(self.popularity.sum(axis=1))[0]
+        }
+
+def count_baskets(receipt_paths, product_index, category_index, number_of_products, number_of_categories,
+                  chunksize=200000, transaction_key=NOTEBOOK_TRANSACTION_KEY):
+    """
+    Stream the receipts into BasketCounts.
+
+    Every chunk is reduced to one row per basket, product and category. With a key
+    holding transaction_date (RECEIPT_TRANSACTION_KEY), the baskets of the days before
+    the latest one read are complete and counted right away, so memory is bounded by
+    a day of receipts and the receipts have to be in date order. The notebook's key
+    merges baskets across days, so its baskets are only complete at the end and
+    stay in the reduced form until then.
+
+    Raises:
+        ValueError: If the receipts streamed per day are not in date order
+    """
+    key = list(transaction_key)
+    columns = key + ["product", "category"]
+    by_day = "transaction_date" in key
+    counts = BasketCounts(number_of_products, number_of_categories)
+    open_rows = None
+    counted_until = None
+
+    for receipt_path in receipt_paths:
+        for chunk in pd.read_csv(receipt_path, usecols=list(dict.fromkeys(key + ["product_id"])), chunksize=chunksize):
+            chunk = chunk[chunk["product_id"].isin(product_index.keys())]
+            rows = pd.DataFrame({column: chunk[column].to_numpy(dtype=np.int64) for column in key if column != "transaction_date"})
+            if by_day:
+                rows["transaction_date"] = pd.to_datetime(chunk["transaction_date"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+                if counted_until is not None and len(rows) and rows["transaction_date"].min() < counted_until:
+                    raise ValueError(f"{receipt_path} is not in transaction_date order, sort the receipts before training")
+            rows["product"] = chunk["product_id"].map(product_index).to_numpy(dtype=np.int64)
+            rows["category"] = chunk["product_id"].map(category_index).to_numpy(dtype=np.int64)
+            rows["lines"] = 1
+
+            if open_rows is not None:
+                rows = pd.concat([open_rows, rows], ignore_index=True)
+            open_rows = rows.groupby(columns, sort=False)["lines"].sum().reset_index()
+
+            if by_day and len(open_rows):
+                counted_until = open_rows["transaction_date"].max()
+                complete = open_rows["transaction_date"].to_numpy() < counted_until
+                counts.add(open_rows[complete], key)
+                open_rows = open_rows[~complete]
+
+    if open_rows is not None:
+        counts.add(open_rows, key)
+    return counts
+
+def keep_multi_item_transactions(line_items):
+    """Drop the transactions with a single line item, they carry no co-occurrence"""
+    counts = np.bincount(line_items["transaction"].to_numpy())
+    return line_items[counts[line_items["transaction"].to_numpy()] > 1]
+
+def popularity_rows(line_items, product_names, category_names):
+    """(product, product_category, number_of_transactions) rows counting line items"""
+    counts = line_items.groupby(["product", "category"]).size()
+    return [
+        (product_names[product], category_names[category], int(count))
+        for (product, category), count in counts.items()
+    ]
+
+def basket_matrix(line_items, number_of_products):
+    """Sparse boolean transaction x product matrix"""
+    _, rows = np.unique(line_items["transaction"].to_numpy(), return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.bool_), (rows, line_items["product"].to_numpy())),
+        shape=(rows.max() + 1, number_of_products)
+    )
+    # Duplicate line items are summed by the constructor, bool keeps them at True
+    return baskets.tocsc()
+
+def frequent_itemsets(baskets, min_support=0.05, max_len=None, weights=None):
+    """
+    Level-wise frequent itemset mining over the sparse basket matrix.
+
+    Pairs come from one sparse co-occurrence product, larger itemsets are counted
+    from the columns of their items.
+
+    Args:
+        weights: Number of baskets of each row, one per row if None
+
+    Returns:
+        dict: Itemset (tuple of product indexes) -> support
+    """
+    if weights is None:
+        weights = np.ones(baskets.shape[0], dtype=np.int64)
+    number_of_baskets = weights.sum()
+    columns = baskets.astype(np.int64)
+    weighted = sparse.diags(weights, dtype=np.int64) @ columns
+
+    item_support = np.asarray(weighted.sum(axis=0)).ravel() / number_of_baskets
+    supports = {(item,): support for item, support in enumerate(item_support) if support >= min_support}
+
+    co_occurrence = (columns.T @ weighted).toarray() / number_of_baskets
+    frequent = {}
+    for (a,), (b,) in combinations(sorted(supports), 2):
+        if co_occurrence[a, b] >= min_support:
+            frequent[(a, b)] = co_occurrence[a, b]
+    supports.update(frequent)
+
+    size = 3
+    while frequent and (max_len is None or size <= max_len):
+        previous = set(frequent)
+        candidates = {
+            tuple(sorted(set(a) | set(b)))
+            for a, b in combinations(sorted(previous), 2)
+            if a[:-1] == b[:-1]
+        }
+        frequent = {}
+        for candidate in candidates:
+            if all(subset in previous for subset in combinations(candidate, size - 1)):
+                support = weights[np.asarray(columns[:, list(candidate)].sum(axis=1)).ravel() == size].sum() / number_of_baskets
+                if support >= min_support:
+                    frequent[candidate] = support
+        supports.update(frequent)
+        size += 1
+
+    return supports
+
+def association_rules(supports, min_lift=1.0):
+    """
+    Rules antecedent -> consequent from the frequent itemsets.
+
+    Returns:
+        list: (antecedent, consequent, confidence, lift) tuples
+    """
+    rules = []
+    for itemset, support in supports.items():
+        if len(itemset) < 2:
+            continue
+        for size in range(1, len(itemset)):
+            for antecedent in combinations(itemset, size):
+                consequent = tuple(item for item in itemset if item not in antecedent)
+                confidence = support / supports[antecedent]
+                lift = confidence / supports[consequent]
+                if lift >= min_lift:
+                    rules.append((antecedent, consequent, confidence, lift))
+    return rules
+
+def apriori_recommendations(rules, product_names, product_categories):
+    """
+    Group the rules by antecedent in the apriori_recommendations.json layout.
+
+    Keys are the antecedent's product names joined with "_", each consequent product
+    is listed once with its best confidence.
+    """
+    recommendations = {}
+    for antecedent, consequent, confidence, _ in sorted(rules, key=lambda rule: -rule[2]):
+        key = "_".join(product_names[item] for item in antecedent)
+        recommendation_list = recommendations.setdefault(key, [])
+        for item in consequent:
+            product = product_names[item]
+            if any(recommendation['product'] == product for recommendation in recommendation_list):
+                continue
+            recommendation_list.append({
+                'product': product,
+                'product_category': product_categories[product],
+                'confidence': confidence
+            })
+    return recommendations
+
+def main_category(line_items, product_names, category_names):
+    """Product name -> category it is sold under most often"""
+    counts = line_items.groupby(["product", "category"]).size().sort_values()
+    return {product_names[product]: category_names[category] for (product, category) in counts.index}
+
+def train(receipt_paths, product_path, output_path, min_support=0.05, min_lift=1.0, max_len=None, chunksize=200000,
+          transaction_key=NOTEBOOK_TRANSACTION_KEY):
+    timer = StageTimer()
+
+    with timer.stage("load products"):
+        product_index, category_index, product_names, category_names = load_products(product_path)
+
+    with timer.stage("read receipts"):
+        counts = count_baskets(
+            receipt_paths, product_index, category_index, len(product_names), len(category_names), chunksize, transaction_key
+        )
+        logger.info(f"{counts.line_items} line items in {counts.baskets} transactions")
+
+    with timer.stage("popularity"):
+        popularity = counts.popularity_rows(product_names, category_names)
+
+    with timer.stage("basket matrix"):
+        baskets, weights = counts.basket_matrix()
+
+    with timer.stage("frequent itemsets"):
+        supports = frequent_itemsets(baskets, min_support, max_len, weights)
+
+    with timer.stage("association rules"):
+        rules = association_rules(supports, min_lift)
+        recommendations = apriori_recommendations(rules, product_names, counts.main_category(product_names, category_names))
+        logger.info(f"{len(rules)} rules for {len(recommendations)} antecedents")
+
+    with timer.stage("write artifacts"):
+        output_path = pathlib.Path(output_path)
+        write_apriori_recommendations(output_path / "apriori_recommendations.json", recommendations)
+        write_popularity_recommendations(output_path / "popularity_recommendation.csv", popularity)
+        write_binary_recommendations(output_path / "recommendations.bin", recommendations, popularity)
+
+    logger.info(f"Total: {sum(timer.timings.values()):.2f}s")
+    return timer.timings
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Train the recommendation artifacts from sales receipts")
+    parser.add_argument("--receipts", nargs="+", default=[str(DATASET_PATH / "201904 sales reciepts.csv")], help="Sales receipts CSV files")
+    parser.add_argument("--products", default=str(DATASET_PATH / "product.csv"), help="Product catalog CSV")
+    parser.add_argument("--output", default=str(OUTPUT_PATH), help="Folder the artifacts are written to")
+    parser.add_argument("--min-support", type=float, default=0.05)
+    parser.add_argument("--min-lift", type=float, default=1.0)
+    parser.add_argument("--max-len", type=int, default=None, help="Largest itemset size, unlimited by default")
+    parser.add_argument("--chunksize", type=int, default=200000, help="Receipt rows read at a time")
+    parser.add_argument("--per-receipt", action="store_true", help="Treat every receipt as its own basket instead of the notebook's transaction and customer id")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    args = parse_args()
+    train(
+        args.receipts, args.products, args.output, args.min_support, args.min_lift, args.max_len, args.chunksize,
+        RECEIPT_TRANSACTION_KEY if args.per_receipt else NOTEBOOK_TRANSACTION_KEY
+    )